@@ -0,0 +1,310 @@
+import re
+from logging import getLogger
+
+_log = getLogger(__name__)
+
+# conservative minifiers: strip comments and redundant whitespace only.
+# newlines in javascript are kept (automatic semicolon insertion)
+
+_js_regex_before = set("(,=:[!&|?{};+-*%<>~^")
+_js_regex_keywords = {"return", "typeof", "instanceof", "in", "of", "new", "delete", "void", "throw", "case",
+                      "do", "else", "yield", "await"}
+
+
+def _is_word(c: str) -> bool:
+    return c.isalnum() or c in "_$.\\" or ord(c) > 127
+
+
+def _js_skip_string(src: str, i: int) -> int:
+    """index after string literal starting at src[i]"""
+    quote = src[i]
+    i += 1
+    while i < len(src):
+        c = src[i]
+        if c == "\\":
+            i += 2
+            continue
+        if c == quote or (c == "\n" and quote != "`"):
+            return i + 1
+        if quote == "`" and src.startswith("${", i):
+            i = _js_skip_expr(src, i + 2)
+            continue
+        i += 1
+    return i
+
+
+def _js_skip_expr(src: str, i: int) -> int:
+    """index after '}' closing template expression"""
+    depth = 1
+    while i < len(src):
+        c = src[i]
+        if c in "'\"`":
+            i = _js_skip_string(src, i)
+            continue
+        if c == "{":
+            depth += 1
+        elif c == "}":
+            depth -= 1
+            if depth == 0:
+                return i + 1
+        i += 1
+    return i
+
+
+def _js_skip_regex(src: str, i: int) -> int:
+    """index after regex literal (with flags) starting at src[i]"""
+    i += 1
+    in_class = False
+    while i < len(src):
+        c = src[i]
+        if c == "\\":
+            i += 2
+            continue
+        if c == "\n":
+            return i
+        if c == "[":
+            in_class = True
+        elif c == "]":
+            in_class = False
+        elif c == "/" and not in_class:
+            i += 1
+            while i < len(src) and (src[i].isalnum() or src[i] == "_"):
+                i += 1
+            return i
+        i += 1
+    return i
+
+
+def _js_need_space(prev: str, nxt: str) -> bool:
+    if _is_word(prev) and _is_word(nxt):
+        return True
+    # a + +b, a - -b, a / /re/
+    return prev == nxt and prev in "+-/" or (prev, nxt) in {("+", "++"), ("-", "--")}
+
+
+def minify_js(src: str) -> str:
+    """strip comments and whitespace of javascript, keep newlines and strings
+
+    >>> minify_js("var a = 1; // comment\\n\\n  /* block */ return  a + +b")
+    'var a=1;\\nreturn a+ +b'
+    >>> minify_js("x = a / 2 / b; y = /[/]\\\\// .test(s);")
+    'x=a/2/b;y=/[/]\\\\//.test(s);'
+    >>> minify_js("s = `a  ${ b  +  `c  d` }`  ;/*! license */")
+    's=`a  ${ b  +  `c  d` }`;/*! license */'
+    """
+    out: list[str] = []
+    i, n = 0, len(src)
+    space = newline = False
+    last = ""
+    last_word = ""
+    while i < n:
+        c = src[i]
+        if c == "\n":
+            newline = True
+            i += 1
+            continue
+        if c.isspace():
+            space = True
+            i += 1
+            continue
+        if src.startswith("//", i):
+            end = src.find("\n", i)
+            i = n if end == -1 else end
+            continue
+        if src.startswith("/*", i) and not src.startswith("/*!", i):
+            end = src.find("*/", i + 2)
+            end = n if end == -1 else end + 2
+            if "\n" in src[i:end]:
+                newline = True
+            else:
+                space = True
+            i = end
+            continue
+        if c in "'\"`":
+            j = _js_skip_string(src, i)
+        elif src.startswith("/*!", i):
+            end = src.find("*/", i + 3)
+            j = n if end == -1 else end + 2
+        elif c == "/" and (last == "" or last in _js_regex_before or last_word in _js_regex_keywords):
+            j = _js_skip_regex(src, i)
+        elif _is_word(c):
+            j = i + 1
+            while j < n and _is_word(src[j]):
+                j += 1
+        else:
+            j = i + 1
+        token = src[i:j]
+        if out:
+            if newline:
+                out.append("\n")
+            elif space and _js_need_space(last, token[0]):
+                out.append(" ")
+        space = newline = False
+        out.append(token)
+        last = token[-1]
+        last_word = token if _is_word(c) else ""
+        i = j
+    return "".join(out)
+
+
+_css_token_re = re.compile(r'"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'|/\*.*?(?:\*/|$)|\s+|[^"\'/\s{};,>]+|.', re.S)
+_css_nospace = set("{};,>")
+
+
+def minify_css(src: str) -> str:
+    """strip comments and whitespace of css, keep strings
+
+    >>> minify_css("a , b > c {\\n  color : red ;\\n  /* x */ margin: 0 auto;\\n}\\n")
+    'a,b>c{color : red;margin: 0 auto}'
+    >>> minify_css('a::after { content: "  ;  " } /*! keep */')
+    'a::after{content: "  ;  "}/*! keep */'
+    """
+    out: list[str] = []
+    space = False
+    for m in _css_token_re.finditer(src):
+        token = m.group(0)
+        if token.startswith("/*") and not token.startswith("/*!"):
+            space = True
+            continue
+        if token.isspace():
+            space = True
+            continue
+        if out:
+            if token == "}" and out[-1] == ";":
+                out.pop()
+            elif space and out[-1][-1] not in _css_nospace and token[0] not in _css_nospace:
+                out.append(" ")
+        space = False
+        out.append(token)
+    return "".join(out)
+
+
+_attr_re = re.compile(r'''([^\s=/>]+)(?:\s*=\s*("[^"]*"|'[^']*'|[^\s>]+))?''')
+_unquoted_re = re.compile(r"[A-Za-z0-9_\-.:/]+")
+
+
+def _minify_tag(tag: str, unquote: bool) -> str:
+    """normalize whitespace in a tag, keep attribute values"""
+    m = re.match(r"<(/?)([^\s/>]+)(.*?)(/?)>$", tag, re.S)
+    if m is None or tag.startswith("<!") or tag.startswith("<?"):
+        return re.sub(r"\s+", " ", tag)
+    close, name, rest, selfclose = m.groups()
+    res = "<" + close + name
+    last_unquoted = False
+    for am in _attr_re.finditer(rest):
+        attr, value = am.groups()
+        res += " " + attr
+        last_unquoted = False
+        if value is None:
+            continue
+        if unquote and value[:1] in "\"'" and _unquoted_re.fullmatch(value[1:-1]):
+            value = value[1:-1]
+            last_unquoted = True
+        res += "=" + value
+    if selfclose:
+        res += " /" if last_unquoted else "/"
+    return res + ">"
+
+
+_html_token_re = re.compile(
+    r"(?P<comment><!--.*?-->)"
+    r"|(?P<raw>(?P<open><(?P<rawtag>pre|textarea|script|style)\b(?:\"[^\"]*\"|'[^']*'|[^'\">])*>)"
+    r"(?P<body>.*?)(?P<close></(?P=rawtag)\s*>))"
+    r"|(?P<tag><[A-Za-z/!?](?:\"[^\"]*\"|'[^']*'|[^'\">])*>)"
+    r"|(?P<text>[^<]+|<)", re.S | re.I)
+_js_types = {"", "text/javascript", "application/javascript", "module"}
+# whitespace around these tags is not rendered.
+# not here: elements which may appear in phrasing content (script, picture, noscript, link, meta, ...)
+_html_block = {
+    "!doctype", "html", "head", "body", "div", "p", "ul", "ol", "li", "dl", "dt", "dd", "table", "thead", "tbody",
+    "tfoot", "tr", "td", "th", "caption", "colgroup", "col", "section", "article", "header", "footer", "nav",
+    "main", "aside", "figure", "figcaption", "blockquote", "form", "fieldset", "legend", "hr",
+    "h1", "h2", "h3", "h4", "h5", "h6", "pre"}
+
+
+def _html_is_block(tag: str) -> bool:
+    m = re.match(r"</?([^\s/>]+)", tag)
+    return m is not None and m.group(1).lower() in _html_block
+
+
+def minify_html(src: str, unquote: bool = False) -> str:
+    """strip comments and collapse whitespace of html, drop whitespace around block tags.
+    pre/textarea are kept, script/style are minified
+
+    >>> minify_html('<p class="a"  id = "x">hello\\n   <b>world</b></p>  <!-- c -->\\n<pre> a\\n b </pre>', True)
+    '<p class=a id=x>hello <b>world</b></p><pre> a\\n b </pre>'
+    >>> minify_html('<script>var a = 1;  // x\\n</script><style> a { b: c; } </style>')
+    '<script>var a=1;</script><style>a{b: c}</style>'
+    >>> minify_html('<p>see <picture><img src="a.png"></picture> here</p>\\n<p>Hello <script>f()</script> world</p>')
+    '<p>see <picture><img src="a.png"></picture> here</p><p>Hello <script>f()</script> world</p>'
+    """
+    out: list[str] = []
+    for m in _html_token_re.finditer(src):
+        if m.group("comment") is not None:
+            if m.group("comment").startswith("<!--[if"):
+                out.append(m.group("comment"))
+            continue
+        if m.group("raw") is not None:
+            body = m.group("body")
+            tag = m.group("rawtag").lower()
+            if tag == "style":
+                body = minify_css(body)
+            elif tag == "script":
+                typ = re.search(r'''\stype\s*=\s*["']?([^"'\s>]*)''', m.group("open"), re.I)
+                if typ is None or typ.group(1).lower() in _js_types:
+                    body = minify_js(body)
+            tag = _minify_tag(m.group("open"), unquote) + body + m.group("close")
+        elif m.group("tag") is not None:
+            tag = _minify_tag(m.group("tag"), unquote)
+        else:
+            text = re.sub(r"\s+", " ", m.group("text"))
+            if text.startswith(" ") and out and (out[-1].endswith(" ") or _html_is_block(out[-1])):
+                text = text[1:]
+            if text:
+                out.append(text)
+            continue
+        if out and out[-1].endswith(" ") and _html_is_block(tag):
+            out[-1] = out[-1][:-1]
+        out.append(tag)
+    return "".join(out).strip()
+
+
+_svg_token_re = re.compile(
+    r"(?P<comment><!--.*?-->)|(?P<cdata><!\[CDATA\[.*?\]\]>)"
+    r"|(?P<tag><[A-Za-z/!?](?:\"[^\"]*\"|'[^']*'|[^'\">])*>)|(?P<text>[^<]+|<)", re.S)
+_svg_keep = {"text", "tspan", "textPath", "title", "desc", "script", "style"}
+
+
+def minify_svg(src: str) -> str:
+    """strip comments and whitespace between tags of svg, keep text elements
+
+    >>> minify_svg('<svg  xmlns="x">\\n  <!-- c -->\\n  <g>\\n    <text> a  b </text>\\n  </g>\\n</svg>\\n')
+    '<svg xmlns="x"><g><text> a  b </text></g></svg>'
+    """
+    out: list[str] = []
+    keep = []
+    for m in _svg_token_re.finditer(src):
+        if m.group("comment") is not None:
+            continue
+        if m.group("cdata") is not None:
+            out.append(m.group("cdata"))
+            continue
+        tag = m.group("tag")
+        if tag is not None:
+            name = re.match(r"</?([^\s/>]*)", tag).group(1)
+            if tag.startswith("</"):
+                if keep and keep[-1] == name:
+                    keep.pop()
+            elif not tag.endswith("/>") and name in _svg_keep:
+                keep.append(name)
+            out.append(_minify_tag(tag, False))
+            continue
+        text = m.group("text")
+        if keep:
+            out.append(minify_css(text) if keep[-1] == "style" else text)
+        elif not text.isspace():
+            out.append(re.sub(r"\s+", " ", text))
+    return "".join(out).strip()
+
+
+minifiers = {".html": minify_html, ".css": minify_css, ".js": minify_js, ".svg": minify_svg}
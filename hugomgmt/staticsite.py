@@ -1,115 +1,408 @@
 from pathlib import Path
+import os
+import re
 import functools
+import contextlib
 import tempfile
-from typing import Optional, Callable
+from typing import Optional, Callable, TextIO
 import subprocess
 import gzip
 import click
 import shutil
 from logging import getLogger
-from .util import find_files
+from .util import find_files, scan_files, match_name
+from .minify import minifiers, minify_html
 
 _log = getLogger(__name__)
+CompressFn = Callable[[bytes], bytes]
 
 
-@click.option("--pretty/--compact", default=False, show_default=True)
-@click.option("--format", type=click.Choice(["rss", "atom", "rdf"]),
-              default="atom", show_default=True, help="output format")
-@click.argument("input", type=click.File('r'), default="-")
-@click.argument("output", type=click.File('w'), default="-")
-def static_rss_atom(input, output, format, pretty):
-    """static site: convert rss, rdf and atom"""
-    import xml.dom.minidom
-    import feedendum
-    data = input.read()
-    feed = None
-    if feed is None:
-        try:
-            feed = feedendum.from_rss_text(data)
-            _log.info("feed is rss")
-        except feedendum.exceptions.FeedParseError:
-            pass
-    if feed is None:
+class CompManifest:
+    """persistent state of compressed files
+
+    records (size, mtime, digest) of source file and (size, mtime) of compressed file
+    for each (path, ext). unchanged source can be skipped with a stat of source and compressed file.
+
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as td:
+    ...     m = CompManifest(Path(td) / "manifest.db", ".gz")
+    ...     m.update(Path(td) / "a.html", 100, 12345, "abcd", 50, 12345)
+    ...     m.save()
+    ...     CompManifest(Path(td) / "manifest.db", ".gz").get(Path(td) / "a.html")
+    (100, 12345, 'abcd', 50, 12345)
+    """
+
+    def __init__(self, dbpath: Path, ext: str):
+        import sqlite3
+        import threading
+        self.ext = ext
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(dbpath)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS manifest (path TEXT, ext TEXT, size INTEGER, mtime_ns INTEGER,"
+            " digest TEXT, comp_size INTEGER, comp_mtime_ns INTEGER, PRIMARY KEY (path, ext))")
+        columns = [x[1] for x in self.conn.execute("PRAGMA table_info(manifest)")]
+        if "comp_mtime_ns" not in columns:
+            # manifest of older version: entries are checked again in this run
+            self.conn.execute("ALTER TABLE manifest ADD COLUMN comp_mtime_ns INTEGER")
+        res = self.conn.execute(
+            "SELECT path, size, mtime_ns, digest, comp_size, comp_mtime_ns FROM manifest WHERE ext = ?", (ext, ))
+        self.entries: dict[str, tuple[int, int, Optional[str], int, int]] = {
+            x[0]: tuple(x[1:]) for x in res.fetchall()}
+        self.updated: dict[str, tuple[int, int, Optional[str], int, int]] = {}
+        self.seen: set[str] = set()
+        _log.debug("manifest %s(%s): %d entries", dbpath, ext, len(self.entries))
+
+    def get(self, filepath: Path) -> Optional[tuple[int, int, Optional[str], int, int]]:
+        key = str(filepath.absolute())
+        with self.lock:
+            self.seen.add(key)
+            return self.entries.get(key)
+
+    def update(self, filepath: Path, size: int, mtime_ns: int, digest: Optional[str], comp_size: int,
+               comp_mtime_ns: int = -1):
+        """comp_size=-1: no compressed file"""
+        key = str(filepath.absolute())
+        val = (size, mtime_ns, digest, comp_size, comp_mtime_ns)
+        with self.lock:
+            self.seen.add(key)
+            if self.entries.get(key) != val:
+                self.entries[key] = val
+                self.updated[key] = val
+
+    def save(self, prune: Optional[Path] = None):
+        """write updated entries. remove entries under `prune` dir which are not seen in this run"""
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO manifest (path, ext, size, mtime_ns, digest, comp_size, comp_mtime_ns)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(k, self.ext, *v) for k, v in self.updated.items()])
+            if prune is not None:
+                pfx = str(prune.absolute()) + "/"
+                gone = [k for k in self.entries.keys() if k.startswith(pfx) and k not in self.seen]
+                _log.debug("manifest: prune %d entries", len(gone))
+                self.conn.executemany("DELETE FROM manifest WHERE path = ? AND ext = ?", [(k, self.ext) for k in gone])
+                for k in gone:
+                    self.entries.pop(k)
+            self.conn.commit()
+            _log.info("manifest: %d updated", len(self.updated))
+            self.updated = {}
+
+
+def _digest(data: bytes) -> str:
+    import hashlib
+    return hashlib.sha256(data).hexdigest()
+
+
+stream_chunk = 1024 * 1024
+
+
+def stream_compressor(name: str, size: int, dictionary: Optional[bytes] = None, level: Optional[int] = None):
+    """incremental compressor object: compress(bytes) -> bytes, flush() -> bytes
+
+    level: (zstd) compression level, default: codec_level
+
+    >>> c = stream_compressor("gzip", 10)
+    >>> gzip.decompress(c.compress(b"hello") + c.compress(b"world") + c.flush())
+    b'helloworld'
+    """
+    if name in ("gzip", "zopfli"):
+        # zopfli cannot compress incrementally
+        import zlib
+        return zlib.compressobj(9, zlib.DEFLATED, 31)
+    elif name == "brotli":
+        import brotli
+        from types import SimpleNamespace
+        c = brotli.Compressor()
+        return SimpleNamespace(compress=c.process, flush=c.finish)
+    elif name == "zstd":
+        import zstandard
+        dict_data = None
+        if dictionary:
+            dict_data = zstandard.ZstdCompressionDict(dictionary)
+        if level is None:
+            level = codec_level[name]
+        return zstandard.ZstdCompressor(level=level, dict_data=dict_data).compressobj(size=size)
+    raise ValueError(f"unknown codec: {name}")
+
+
+def stream_decompressor(name: str, dictionary: Optional[bytes] = None) -> Callable[[bytes], bytes]:
+    """incremental decompress function
+
+    >>> d = stream_decompressor("gzip")
+    >>> data = gzip.compress(b"helloworld")
+    >>> d(data[:10]) + d(data[10:])
+    b'helloworld'
+    """
+    if name in ("gzip", "zopfli"):
+        import zlib
+        return zlib.decompressobj(31).decompress
+    elif name == "brotli":
+        import brotli
+        return brotli.Decompressor().process
+    elif name == "zstd":
+        import zstandard
+        dict_data = None
+        if dictionary:
+            dict_data = zstandard.ZstdCompressionDict(dictionary)
+        return zstandard.ZstdDecompressor(dict_data=dict_data).decompressobj().decompress
+    raise ValueError(f"unknown codec: {name}")
+
+
+class _MemorySource:
+    """source file in memory"""
+
+    def __init__(self, reader: Callable[[], bytes], compressfn: Callable, decompressfn: Callable):
+        self.reader = reader
+        self.compressfn = compressfn
+        self.decompressfn = decompressfn
+
+    @functools.cached_property
+    def digest(self) -> str:
+        return _digest(self.reader())
+
+    def equal(self, filepath_comp: Path) -> bool:
         try:
-            feed = feedendum.from_rdf_text(data)
-            _log.info("feed is rdf")
-        except feedendum.exceptions.FeedParseError:
-            pass
-    if feed is None:
+            return self.decompressfn(filepath_comp.read_bytes()) == self.reader()
+        except Exception:
+            return False
+
+    def compress_to(self, ofp) -> int:
+        data = self.compressfn(self.reader())
+        ofp.write(data)
+        return len(data)
+
+
+class _StreamSource:
+    """source file in chunks: memory usage is bounded for large files"""
+
+    def __init__(self, filepath: Path, name: str, size: int, dictionary: Optional[bytes] = None,
+                 level: Optional[int] = None):
+        self.filepath = filepath
+        self.name = name
+        self.size = size
+        self.dictionary = dictionary
+        self.level = level
+
+    @functools.cached_property
+    def digest(self) -> str:
+        import hashlib
+        h = hashlib.sha256()
+        with self.filepath.open("rb") as ifp:
+            while data := ifp.read(stream_chunk):
+                h.update(data)
+        return h.hexdigest()
+
+    def equal(self, filepath_comp: Path) -> bool:
+        decomp = stream_decompressor(self.name, self.dictionary)
         try:
-            feed = feedendum.from_atom_text(data)
-            _log.info("feed is atom")
-        except feedendum.exceptions.FeedParseError:
-            pass
-    if feed is None:
-        raise click.Abort("cannot parse input xml")
-    if format == "atom":
-        outstr = feedendum.to_atom_string(feed)
-    elif format == "rss":
-        outstr = feedendum.to_rss_string(feed)
-    elif format == "rdf":
-        outstr = feedendum.to_rdf_string(feed)
+            with self.filepath.open("rb") as ifp, filepath_comp.open("rb") as cfp:
+                # small chunk of compressed data: output of decompress may be large
+                while cdata := cfp.read(stream_chunk // 16):
+                    data = decomp(cdata)
+                    if ifp.read(len(data)) != data:
+                        return False
+                return ifp.read(1) == b""
+        except Exception:
+            return False
+
+    def compress_to(self, ofp) -> int:
+        import hashlib
+        h = hashlib.sha256()
+        comp = stream_compressor(self.name, self.size, self.dictionary, self.level)
+        size = 0
+        with self.filepath.open("rb") as ifp:
+            while data := ifp.read(stream_chunk):
+                h.update(data)
+                out = comp.compress(data)
+                ofp.write(out)
+                size += len(out)
+        out = comp.flush()
+        ofp.write(out)
+        size += len(out)
+        self.digest = h.hexdigest()
+        return size
+
+
+def _deflate_block(data: bytes, zdict: bytes, last: bool) -> bytes:
+    import zlib
+    if zdict:
+        c = zlib.compressobj(level=9, wbits=-15, zdict=zdict)
     else:
-        raise click.Abort(f"unknown format: {format}")
-    if pretty:
-        dom = xml.dom.minidom.parseString(outstr)
-        output.write(dom.toprettyxml())
+        c = zlib.compressobj(level=9, wbits=-15)
+    # sync flush: byte-aligned and not final, next block can be appended
+    return c.compress(data) + c.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+class _BlockSource(_StreamSource):
+    """compress gzip in parallel blocks, each primed with previous 32KB (like pigz)
+
+    >>> import io, tempfile
+    >>> with tempfile.NamedTemporaryFile() as tf:
+    ...     _ = Path(tf.name).write_bytes(b"hello world " * 1000)
+    ...     ofp = io.BytesIO()
+    ...     _ = _BlockSource(Path(tf.name), 12000, 2, 1000).compress_to(ofp)
+    ...     gzip.decompress(ofp.getvalue()) == b"hello world " * 1000
+    True
+    """
+
+    def __init__(self, filepath: Path, size: int, parallel: int, block_size: int):
+        super().__init__(filepath, "gzip", size)
+        self.parallel = parallel
+        self.block_size = block_size
+
+    def compress_to(self, ofp) -> int:
+        import hashlib
+        import struct
+        import zlib
+        from collections import deque
+        from concurrent.futures import ThreadPoolExecutor
+        h = hashlib.sha256()
+        crc = 0
+        total = 0
+        # magic, deflate, no flags, mtime=0, max compression, unknown os
+        header = b"\x1f\x8b\x08\x00" + struct.pack("<I", 0) + b"\x02\xff"
+        ofp.write(header)
+        size = len(header)
+        pending = deque()
+        with self.filepath.open("rb") as ifp, ThreadPoolExecutor(self.parallel) as pool:
+            prev = b""
+            data = ifp.read(self.block_size)
+            while data:
+                nxt = ifp.read(self.block_size)
+                h.update(data)
+                crc = zlib.crc32(data, crc)
+                total += len(data)
+                pending.append(pool.submit(_deflate_block, data, prev[-32768:], not nxt))
+                prev, data = data, nxt
+                # bound blocks in memory
+                while len(pending) >= self.parallel * 2:
+                    out = pending.popleft().result()
+                    ofp.write(out)
+                    size += len(out)
+            while pending:
+                out = pending.popleft().result()
+                ofp.write(out)
+                size += len(out)
+        trailer = struct.pack("<II", crc, total & 0xffffffff)
+        ofp.write(trailer)
+        size += len(trailer)
+        self.digest = h.hexdigest()
+        return size
+
+
+def _write_comp(filepath: Path, filepath_comp: Path, src, st_orig: os.stat_result, dry: bool, prefix: str) -> int:
+    """compress to temporary file and rename it. returns size of compressed file (-1: not written)"""
+    if dry:
+        with open(os.devnull, "wb") as ofp:
+            size = src.compress_to(ofp)
+        tmppath = None
     else:
-        output.write(outstr)
+        fd, tmpname = tempfile.mkstemp(dir=filepath_comp.parent, prefix="." + filepath_comp.name + ".", suffix=".tmp")
+        tmppath = Path(tmpname)
+        try:
+            with os.fdopen(fd, "wb") as ofp:
+                size = src.compress_to(ofp)
+        except Exception:
+            tmppath.unlink()
+            raise
+    if size < st_orig.st_size:
+        _log.info(prefix + "compressed: %s %s -> %s", filepath_comp, st_orig.st_size, size)
+        if tmppath is not None:
+            shutil.copystat(filepath, tmppath)
+            os.replace(tmppath, filepath_comp)
+        return size
+    _log.info(prefix + "compress less(not write): %s %s < %s", filepath_comp, st_orig.st_size, size)
+    if tmppath is not None:
+        tmppath.unlink()
+    return -1
+
+
+def _comp_state(filepath_comp: Path) -> tuple[int, int]:
+    """(size, mtime) of compressed file, (-1, -1) if not exists"""
+    try:
+        st = filepath_comp.stat()
+    except FileNotFoundError:
+        return -1, -1
+    return st.st_size, st.st_mtime_ns
 
 
 def may_comp(filepath: Path, minsize: int,
-             compressfn: callable, decompressfn: callable, ext: str, dry: bool):
+             compressfn: callable, decompressfn: callable, ext: str, dry: bool,
+             manifest: Optional[CompManifest] = None, verify: bool = False,
+             st_orig: Optional[os.stat_result] = None, reader: Optional[Callable[[], bytes]] = None,
+             stream: Optional[str] = None, blocks: int = 0, block_size: int = stream_chunk,
+             dictionary: Optional[bytes] = None, level: Optional[int] = None):
+    """compress filepath to filepath+ext
+
+    returns size of compressed file (-1: not compressed, None: skipped by manifest)
+
+    stream: codec name to compress in chunks, instead of compressfn/decompressfn
+    blocks: compress gzip in parallel blocks with this parallelism
+    dictionary: (zstd) dictionary for stream
+    level: (zstd) compression level for stream
+    """
     filepath_comp = filepath.with_suffix(filepath.suffix + ext)
-    st_orig = filepath.stat()
+    if st_orig is None:
+        st_orig = filepath.stat()
+    if reader is None:
+        reader = filepath.read_bytes
+    if stream in ("gzip", "zopfli") and blocks > 1:
+        src = _BlockSource(filepath, st_orig.st_size, blocks, block_size)
+    elif stream:
+        src = _StreamSource(filepath, stream, st_orig.st_size, dictionary, level)
+    else:
+        src = _MemorySource(reader, compressfn, decompressfn)
     prefix = "(WET)"
     if dry:
         prefix = "(DRY)"
+    ent = None
+    if manifest is not None:
+        ent = manifest.get(filepath)
+        if not verify and ent is not None and ent[0] == st_orig.st_size and ent[1] == st_orig.st_mtime_ns:
+            # compressed file may be removed or replaced after the last run
+            if ent[3:] == _comp_state(filepath_comp):
+                _log.debug(prefix + "unchanged(manifest): %s", filepath)
+                return
+
+    def record(comp_size: int) -> int:
+        if manifest is not None and not dry:
+            comp_mtime_ns = -1
+            if comp_size != -1:
+                comp_mtime_ns = _comp_state(filepath_comp)[1]
+            manifest.update(filepath, st_orig.st_size, st_orig.st_mtime_ns, src.digest, comp_size, comp_mtime_ns)
+        return comp_size
+
     try:
         st_comp = filepath_comp.stat()
         if not st_orig.st_size > minsize:
             _log.info(prefix + "small but %s exists(remove): %s", ext, filepath_comp)
             if not dry:
                 filepath_comp.unlink()
-            return
-        if st_comp.st_mtime > st_orig.st_mtime:
+            return record(-1)
+        if not verify and st_comp.st_mtime > st_orig.st_mtime:
             _log.debug(prefix + "newer %s(keep): %s", ext, filepath_comp)
-            return
+            return record(st_comp.st_size)
         _log.debug(prefix + "older ext %s(compare): %s", ext, filepath_comp)
-        orig_data = filepath.read_bytes()
-        if filepath_comp.exists():
-            try:
-                comp_data = decompressfn(filepath_comp.read_bytes())
-            except Exception:
-                comp_data = None
-        if orig_data == comp_data:
+        if not verify and ent is not None and ent[3] == st_comp.st_size and ent[2] == src.digest:
+            _log.debug(prefix + "same digest(keep): %s", filepath_comp)
+            return record(st_comp.st_size)
+        if src.equal(filepath_comp):
             _log.debug(prefix + "equal(keep): %s", filepath_comp)
-            return
+            return record(st_comp.st_size)
         _log.info(prefix + "mismatch(update): %s", filepath_comp)
-        if not dry:
+        comp_size = _write_comp(filepath, filepath_comp, src, st_orig, dry, prefix)
+        if comp_size == -1 and not dry:
             filepath_comp.unlink()
-        comp_content = compressfn(orig_data)
-        if len(comp_content) < st_orig.st_size:
-            _log.info(prefix + "compressed: %s %s -> %s", filepath_comp, st_orig.st_size, len(comp_content))
-            if not dry:
-                filepath_comp.write_bytes(comp_content)
-                shutil.copystat(filepath, filepath_comp)
-        else:
-            _log.info(prefix + "compress less(not write): %s %s < %s",
-                      filepath_comp, st_orig.st_size, len(comp_content))
+        return record(comp_size)
     except FileNotFoundError:
         if st_orig.st_size > minsize:
             _log.debug(prefix + "compress(new): %s", filepath)
-            orig_data = filepath.read_bytes()
-            comp_content = compressfn(orig_data)
-            if len(comp_content) < st_orig.st_size:
-                _log.info(prefix + "compressed: %s %s -> %s", filepath_comp, st_orig.st_size, len(comp_content))
-                if not dry:
-                    filepath_comp.write_bytes(comp_content)
-                    shutil.copystat(filepath, filepath_comp)
-            else:
-                _log.info(prefix + "compress less(not write): %s %s < %s",
-                          filepath_comp, st_orig.st_size, len(comp_content))
+            if not verify and ent is not None and ent[3] == -1 and ent[2] == src.digest:
+                _log.debug(prefix + "same digest(compress less): %s", filepath)
+                return record(-1)
+            return record(_write_comp(filepath, filepath_comp, src, st_orig, dry, prefix))
+        return record(-1)
 
 
 def may_remove(filepath: Path, ext: str, dry: bool):
@@ -126,17 +419,12 @@ def may_remove(filepath: Path, ext: str, dry: bool):
             _log.warning("%s: %s does not exists (continue)", filepath, origpath)
 
 
-@click.option("--minsize", type=int, default=1024*8, show_default=True)
-@click.argument("publicdir", type=click.Path(dir_okay=True, exists=True, file_okay=True),
-                default="./public")
-@click.option("--try-zopfli/--gzip", default=False, show_default=True)
-@click.option("--dry/--wet", default=False, show_default=True)
-@click.option("--remove/--no-remove", default=False, show_default=True, help="remove xxx.gz if xxx does not exists")
-@click.option("--parallel", type=int, default=1, show_default=True)
-def static_gzip(publicdir, minsize, try_zopfli, dry, remove, parallel):
-    """static site: gzip_static on;"""
-    from concurrent.futures import ThreadPoolExecutor
-    compressfn: Callable | None = None
+compress_ignore_dirs = [".git"]
+compress_ignore_files = ["*.gz", "*.br", "*.zst"]
+compress_file_patterns = ["*.txt", "*.css", "*.html", "*.js", "*.xml", "*.svg", "*.json"]
+
+
+def gzip_compressor(try_zopfli: bool) -> CompressFn:
     if try_zopfli:
         try:
             import zopfli
@@ -144,27 +432,885 @@ def static_gzip(publicdir, minsize, try_zopfli, dry, remove, parallel):
             def _cmpfn(b: bytes) -> bytes:
                 zc = zopfli.ZopfliCompressor(zopfli.ZOPFLI_FORMAT_GZIP)
                 return zc.compress(b) + zc.flush()
-            compressfn = _cmpfn
             _log.info("using zopfli module")
+            return _cmpfn
         except ImportError:
             _log.warning("cannot import zopfli. use standard gzip module")
-    if compressfn is None:
-        from gzip import compress
-        compressfn = functools.partial(compress, compresslevel=9)
-        _log.info("using standard gzip module.")
-    ignore_dirs = [".git"]
-    ignore_files = ["*.gz", "*.br"]
-    file_patterns = ["*.txt", "*.css", "*.html", "*.js", "*.xml", "*.svg", "*.json"]
-    basedir = Path(publicdir)
+    _log.info("using standard gzip module.")
+    return functools.partial(gzip.compress, compresslevel=9)
+
+
+codec_ext = {"gzip": ".gz", "zopfli": ".gz", "brotli": ".br", "zstd": ".zst"}
+codec_level = {"gzip": 9, "zopfli": 9, "brotli": 11, "zstd": 19}
+
+
+def zstd_codec(level: int, dictionary: Optional[bytes] = None) -> tuple[CompressFn, CompressFn]:
+    """(compressfn, decompressfn) of zstd with trained dictionary
+
+    >>> c, d = zstd_codec(3)
+    >>> d(c(b"hello"))
+    b'hello'
+    """
+    try:
+        import zstandard
+    except ImportError:
+        _log.error("cannot import zstandard: try 'pip install zstandard'")
+        raise
+    if not dictionary:
+        return functools.partial(zstandard.compress, level=level), zstandard.decompress
+    dict_data = zstandard.ZstdCompressionDict(dictionary)
+    dict_data.precompute_compress(level=level)
+
+    # ZstdCompressor/ZstdDecompressor are not thread safe
+    def _compress(data: bytes) -> bytes:
+        return zstandard.ZstdCompressor(level=level, dict_data=dict_data).compress(data)
+
+    def _decompress(data: bytes) -> bytes:
+        return zstandard.ZstdDecompressor(dict_data=dict_data).decompress(data)
+    return _compress, _decompress
+
+
+def get_codec(name: str, dictionary: Optional[bytes] = None,
+              level: Optional[int] = None) -> tuple[str, CompressFn, CompressFn]:
+    """returns (ext, compressfn, decompressfn)
+
+    level: (zstd) compression level, default: codec_level
+
+    >>> ext, c, d = get_codec("gzip")
+    >>> ext, d(c(b"hello"))
+    ('.gz', b'hello')
+    """
+    if name in ("gzip", "zopfli"):
+        return codec_ext[name], gzip_compressor(name == "zopfli"), gzip.decompress
+    elif name == "brotli":
+        try:
+            import brotli
+        except ImportError:
+            _log.error("cannot import brotli: try 'pip install brotli'")
+            raise
+        return codec_ext[name], brotli.compress, brotli.decompress
+    elif name == "zstd":
+        return codec_ext[name], *zstd_codec(level or codec_level[name], dictionary)
+    raise ValueError(f"unknown codec: {name}")
+
+
+def parse_codec(spec: str, minsize: int) -> tuple[str, int]:
+    """parse codec[:minsize]
+
+    >>> parse_codec("brotli", 100)
+    ('brotli', 100)
+    >>> parse_codec("gzip:512", 100)
+    ('gzip', 512)
+    """
+    name, _, size = spec.partition(":")
+    if name not in codec_ext:
+        raise click.BadParameter(f"unknown codec: {name}")
+    if size:
+        return name, int(size)
+    return name, minsize
+
+
+def get_codec_tiers(name: str, dictionary: Optional[bytes] = None) -> tuple[CompressFn, CompressFn]:
+    """(cheap, expensive) compress functions for adaptive mode
+
+    >>> cheap, expensive = get_codec_tiers("gzip")
+    >>> gzip.decompress(cheap(b"hello")), gzip.decompress(expensive(b"hello"))
+    (b'hello', b'hello')
+    """
+    if name in ("gzip", "zopfli"):
+        return functools.partial(gzip.compress, compresslevel=9), gzip_compressor(True)
+    elif name == "brotli":
+        import brotli
+        return functools.partial(brotli.compress, quality=5), functools.partial(brotli.compress, quality=11, lgwin=24)
+    elif name == "zstd":
+        return zstd_codec(9, dictionary)[0], zstd_codec(19, dictionary)[0]
+    raise ValueError(f"unknown codec: {name}")
+
+
+class Codec:
+    """codec and its settings
+
+    compressor objects (zopfli etc.) cannot be pickled: worker processes build their own from spec
+    """
+
+    def __init__(self, name: str, minsize: int, dictionary: Optional[bytes] = None, level: Optional[int] = None,
+                 manifest=None):
+        self.name = name
+        self.minsize = minsize
+        self.dictionary = dictionary
+        # level: only zstd is configurable
+        self.level = level or codec_level[name]
+        self.ext, self.compress, self.decompress = get_codec(name, dictionary, self.level)
+        self.manifest = manifest
+
+    @property
+    def spec(self) -> tuple[str, int, Optional[bytes], int]:
+        return self.name, self.minsize, self.dictionary, self.level
+
+    @property
+    def manifest_key(self) -> str:
+        """files compressed with other codec, level, minsize or dictionary are not compatible
+
+        >>> Codec("gzip", 100).manifest_key
+        '.gz:gzip-9:100'
+        """
+        key = f"{self.ext}:{self.name}-{self.level}:{self.minsize}"
+        if self.dictionary:
+            import zstandard
+            return f"{key}:{zstandard.ZstdCompressionDict(self.dictionary).dict_id()}"
+        return key
+
+    @functools.cached_property
+    def tiers(self) -> tuple[CompressFn, CompressFn]:
+        return get_codec_tiers(self.name, self.dictionary)
+
+
+class CompressSettings:
+    """settings of compress_tree: passed to worker processes"""
+
+    def __init__(self, dry: bool = False, verify: bool = False, stream_threshold: int = 0,
+                 block_threshold: int = 0, block_size: int = stream_chunk, parallel: int = 1):
+        self.dry = dry
+        self.verify = verify
+        self.stream_threshold = stream_threshold
+        self.block_threshold = block_threshold
+        self.block_size = block_size
+        self.parallel = parallel
+
+
+class MemoryBudget:
+    """limit estimated memory usage of files in flight
+
+    >>> b = MemoryBudget(100)
+    >>> with b.reserve(60):
+    ...     b.used
+    60
+    >>> b.used
+    0
+
+    shared: usable from worker processes (pass to ProcessPoolExecutor initargs)
+    """
+
+    def __init__(self, limit: int, shared: bool = False):
+        self.limit = limit
+        if shared:
+            import multiprocessing
+            self._used = multiprocessing.RawValue("q", 0)
+            self.cond = multiprocessing.Condition()
+        else:
+            import threading
+            import types
+            self._used = types.SimpleNamespace(value=0)
+            self.cond = threading.Condition()
+
+    @property
+    def used(self) -> int:
+        return self._used.value
+
+    @contextlib.contextmanager
+    def reserve(self, size: int):
+        with self.cond:
+            # larger than limit: wait until no other file is in flight
+            self.cond.wait_for(lambda: self._used.value == 0 or self._used.value + size <= self.limit)
+            self._used.value += size
+        try:
+            yield
+        finally:
+            with self.cond:
+                self._used.value -= size
+                self.cond.notify_all()
+
+
+def may_precomp(filepath: Path, codecs: list[Codec], settings: CompressSettings,
+                budget: Optional[MemoryBudget] = None,
+                expensive: Optional[set[str]] = None,
+                st_orig: Optional[os.stat_result] = None) -> dict[str, Optional[int]]:
+    """stat and read source once, compress with all codecs
+
+    expensive: (adaptive mode) extensions to compress with expensive tier, others use cheap tier
+    st_orig: stat of the source, if already known
+    returns compressed size for each extension (None: skipped)
+    """
+    if st_orig is None:
+        st_orig = filepath.stat()
+    blocks = 0
+    if settings.block_threshold > 0 and st_orig.st_size > settings.block_threshold:
+        blocks = settings.parallel
+    stream = (settings.stream_threshold > 0 and st_orig.st_size > settings.stream_threshold) or blocks > 1
+    if stream:
+        cost = max(stream_chunk, settings.block_size * blocks * 3)
+    else:
+        # source and compressed output
+        cost = st_orig.st_size * 2
+    res = {}
+    with budget.reserve(cost) if budget is not None else contextlib.nullcontext():
+        reader = functools.cache(filepath.read_bytes)
+        for c in codecs:
+            compressfn = c.compress
+            if expensive is not None:
+                compressfn = c.tiers[c.ext in expensive]
+            res[c.ext] = may_comp(filepath, c.minsize, compressfn, c.decompress, c.ext, settings.dry, c.manifest,
+                                  settings.verify, st_orig, reader, c.name if stream else None, blocks,
+                                  settings.block_size, c.dictionary, c.level)
+            if st_orig.st_size <= c.minsize:
+                res[c.ext] = None
+    return res
+
+
+def chunk_by_size(files: list[tuple[Path, int]], nchunk: int) -> list[list[tuple[Path, int]]]:
+    """split files into size-balanced chunks, largest first
+
+    >>> [[x[1] for x in c] for c in chunk_by_size([(Path("a"), 1), (Path("b"), 5), (Path("c"), 3), (Path("d"), 2)], 2)]
+    [[5, 1], [3, 2]]
+    """
+    chunks: list[list[tuple[Path, int]]] = [[] for _ in range(max(nchunk, 1))]
+    totals = [0] * len(chunks)
+    for f in sorted(files, key=lambda x: x[1], reverse=True):
+        idx = totals.index(min(totals))
+        chunks[idx].append(f)
+        totals[idx] += f[1]
+    return [x for x in chunks if x]
+
+
+class _ManifestDelta:
+    """manifest in worker process: collect updates and send back to parent"""
+
+    def __init__(self, entries: dict[str, tuple]):
+        self.entries = entries
+        self.updated: dict[str, tuple] = {}
+
+    def get(self, filepath: Path):
+        return self.entries.get(str(filepath.absolute()))
+
+    def update(self, filepath: Path, size: int, mtime_ns: int, digest: Optional[str], comp_size: int,
+               comp_mtime_ns: int = -1):
+        self.updated[str(filepath.absolute())] = (size, mtime_ns, digest, comp_size, comp_mtime_ns)
+
+
+def _add_result(total: dict[str, list[int]], size: int, result: dict[str, Optional[int]]):
+    # total: ext -> [files, original bytes, compressed bytes]
+    for ext, comp_size in result.items():
+        if comp_size is None:
+            continue
+        t = total.setdefault(ext, [0, 0, 0])
+        t[0] += 1
+        t[1] += size
+        t[2] += comp_size if comp_size >= 0 else size
+
+
+def plan_adaptive(files: list[tuple[Path, int]], codecs: list[Codec], budget_sec: float, parallel: int,
+                  sample: int = 5, sample_size: int = 64 * 1024) -> tuple[dict[str, set[str]], dict[str, int]]:
+    """choose files to compress with expensive tier within time budget
+
+    estimate ratio and speed of each tier for each file type from samples,
+    then choose (file, codec) with most saved bytes per second.
+    returns (path -> extensions to use expensive tier, ext -> expected compressed bytes)
+    """
+    import time
+    start = time.monotonic()
+    by_type: dict[str, list[tuple[Path, int]]] = {}
+    for f in files:
+        by_type.setdefault(f[0].suffix, []).append(f)
+    # (codec ext, file type) -> [input bytes, [cheap bytes, expensive bytes], [cheap sec, expensive sec]]
+    est: dict[tuple[str, str], list] = {}
+    picked: dict[str, list[Path]] = {}
+    for ftype, flist in by_type.items():
+        flist = sorted(flist, key=lambda x: x[1])
+        npick = min(sample, len(flist))
+        picked[ftype] = [flist[i * len(flist) // npick][0] for i in range(npick)]
+        for c in codecs:
+            est[(c.ext, ftype)] = [0, [0, 0], [0.0, 0.0]]
+    # sampling takes at most 1/4 of budget (but at least 1 sample for each file type)
+    for i in range(sample):
+        if i != 0 and time.monotonic() - start > budget_sec / 4:
+            break
+        for ftype, plist in picked.items():
+            if i >= len(plist):
+                continue
+            with plist[i].open("rb") as ifp:
+                data = ifp.read(sample_size)
+            for c in codecs:
+                e = est[(c.ext, ftype)]
+                e[0] += len(data)
+                for tier in (0, 1):
+                    t0 = time.monotonic()
+                    e[1][tier] += len(c.tiers[tier](data))
+                    e[2][tier] += time.monotonic() - t0
+    # all files with cheap tier
+    total_sec = 0.0
+    candidates = []
+    expected = {c.ext: 0 for c in codecs}
+    for filepath, size in files:
+        for c in codecs:
+            if size <= c.minsize:
+                continue
+            nbytes, comp, sec = est[(c.ext, filepath.suffix)]
+            if nbytes == 0:
+                continue
+            total_sec += size * sec[0] / nbytes
+            expected[c.ext] += size * comp[0] // nbytes
+            gain = size * (comp[0] - comp[1]) / nbytes
+            cost = size * (sec[1] - sec[0]) / nbytes
+            if gain > 0:
+                candidates.append((gain / max(cost, 1e-9), gain, cost, str(filepath), c.ext))
+    remain = budget_sec * parallel - total_sec - (time.monotonic() - start) * parallel
+    _log.info("adaptive: cheap tier %.2f sec, remain %.2f sec for expensive tier", total_sec, remain)
+    plan: dict[str, set[str]] = {}
+    for _, gain, cost, path, ext in sorted(candidates, reverse=True):
+        if cost > remain:
+            continue
+        remain -= cost
+        plan.setdefault(path, set()).add(ext)
+        expected[ext] -= int(gain)
+    return plan, expected
+
+
+_worker_budget: Optional[MemoryBudget] = None
+
+
+def _precomp_init(budget: Optional[MemoryBudget]):
+    """worker process: set budget shared with other workers"""
+    global _worker_budget
+    _worker_budget = budget
+
+
+def _precomp_chunk(files: list[Path], specs: list[tuple], entries: dict[str, dict],
+                   settings: CompressSettings, plan: Optional[dict[str, set[str]]]) -> tuple:
+    """worker process: returns (pid, files, bytes, elapsed, manifest updates, result)"""
+    import time
+    start = time.monotonic()
+    codecs = []
+    for spec in specs:
+        codecs.append(Codec(*spec))
+        if codecs[-1].ext in entries:
+            codecs[-1].manifest = _ManifestDelta(entries[codecs[-1].ext])
+    nbytes = 0
+    total: dict[str, list[int]] = {}
+    for filepath in files:
+        try:
+            size = filepath.stat().st_size
+            nbytes += size
+            expensive = None
+            if plan is not None:
+                expensive = plan.get(str(filepath), set())
+            _add_result(total, size, may_precomp(filepath, codecs, settings, _worker_budget, expensive))
+        except Exception as e:
+            _log.warning("compress failed: %s: %s", filepath, e)
+    updates = {x.ext: x.manifest.updated for x in codecs if x.manifest is not None}
+    return os.getpid(), len(files), nbytes, time.monotonic() - start, updates, total
+
+
+def precomp_process(files: list[tuple[Path, int]], codecs: list[Codec], settings: CompressSettings,
+                    plan: Optional[dict[str, set[str]]] = None, memory_budget: int = 0) -> dict[str, list[int]]:
+    """run may_precomp in process pool with size-balanced chunks
+
+    memory_budget: limit of memory usage shared by all workers"""
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    specs = [x.spec for x in codecs]
+    parallel = settings.parallel
+    chunks = chunk_by_size(files, parallel * 4)
+    _log.info("process pool: %d files, %d chunks, %d workers", len(files), len(chunks), parallel)
+    stats: dict[int, list] = {}
+    total: dict[str, list[int]] = {}
+    budget = None
+    if memory_budget > 0:
+        budget = MemoryBudget(memory_budget, shared=True)
+    with ProcessPoolExecutor(parallel, initializer=_precomp_init, initargs=(budget,)) as executor:
+        futures = {}
+        for chunk in chunks:
+            paths = [x[0] for x in chunk]
+            entries = {}
+            for c in codecs:
+                if c.manifest is not None:
+                    entries[c.ext] = {k: v for k, v in ((str(p.absolute()), c.manifest.get(p)) for p in paths)
+                                      if v is not None}
+            subplan = None
+            if plan is not None:
+                subplan = {str(p): plan[str(p)] for p in paths if str(p) in plan}
+            futures[executor.submit(_precomp_chunk, paths, specs, entries, settings, subplan)] = chunk
+        for fut in as_completed(futures):
+            try:
+                pid, nfiles, nbytes, elapsed, updates, result = fut.result()
+            except Exception:
+                _log.exception("chunk failed: %d files", len(futures[fut]))
+                continue
+            st = stats.setdefault(pid, [0, 0, 0.0])
+            st[0] += nfiles
+            st[1] += nbytes
+            st[2] += elapsed
+            for c in codecs:
+                if c.manifest is not None:
+                    for k, v in updates.get(c.ext, {}).items():
+                        c.manifest.update(Path(k), *v)
+            for ext, v in result.items():
+                t = total.setdefault(ext, [0, 0, 0])
+                for i in range(3):
+                    t[i] += v[i]
+    for pid, (nfiles, nbytes, elapsed) in sorted(stats.items()):
+        _log.info("worker %d: %d files, %d bytes, %.2f sec, %.2f MB/s",
+                  pid, nfiles, nbytes, elapsed, nbytes / max(elapsed, 1e-6) / 1024 / 1024)
+    return total
+
+
+class Incremental:
+    """select files to process: changed-file list, files newer than watermark, or all files
+
+    changed-file list has a path per line, relative to basedir (or absolute).
+    watermark file holds time of last run (ns). affected directories are recorded
+    to limit orphan removal"""
+
+    def __init__(self, basedir: Path, changed: Optional[TextIO] = None, watermark: Optional[str] = None):
+        import time
+        self.basedir = basedir
+        self.watermark = Path(watermark) if watermark else None
+        self.start_ns = time.time_ns()
+        self.paths: Optional[list[Path]] = None
+        self.since: Optional[int] = None
+        self.dirs: set[Path] = set()
+        self.stats: dict[Path, os.stat_result] = {}
+        self.orphan_files: Optional[list[Path]] = None
+        if changed is not None:
+            self.paths = []
+            for line in changed:
+                line = line.strip()
+                if not line:
+                    continue
+                p = Path(line)
+                if not p.is_absolute():
+                    p = basedir / p
+                self.paths.append(p)
+                self.dirs.add(p.parent)
+            _log.info("incremental: %d changed paths, %d dirs", len(self.paths), len(self.dirs))
+        elif self.watermark is not None and self.watermark.exists():
+            self.since = int(self.watermark.read_text().strip())
+            _log.info("incremental: since %d", self.since)
+
+    @property
+    def active(self) -> bool:
+        return self.paths is not None or self.since is not None
+
+    def _ignored_dir(self, filepath: Path, ignore_dirs: list[str]) -> bool:
+        try:
+            parts = filepath.relative_to(self.basedir).parts[:-1]
+        except ValueError:
+            _log.warning("not under %s: %s", self.basedir, filepath)
+            return True
+        return any(x in ignore_dirs for x in parts)
+
+    def _newer(self, st: os.stat_result) -> bool:
+        return max(st.st_mtime_ns, st.st_ctime_ns) > self.since
+
+    def stat(self, filepath: Path) -> os.stat_result:
+        """stat cached while walking"""
+        st = self.stats.get(filepath)
+        if st is None:
+            st = filepath.stat()
+        return st
+
+    def files(self, ignore_dirs: list[str], ignore_files: list[str], pattern: list[str],
+              orphan_pattern: Optional[list[str]] = None):
+        """files to process. orphan_pattern: collect orphan candidates in the same walk"""
+        if self.paths is not None:
+            for p in self.paths:
+                if p.is_file() and match_name(p.name, ignore_files, pattern) and not self._ignored_dir(p, ignore_dirs):
+                    yield p
+        elif self.since is not None:
+            def on_dir(root: Path):
+                if self._newer(root.stat()):
+                    # entries added or removed
+                    self.dirs.add(root)
+            for p, st, _ in scan_files([self.basedir], ignore_dirs, ignore_files, pattern, on_dir=on_dir):
+                if self._newer(st):
+                    self.dirs.add(p.parent)
+                    self.stats[p] = st
+                    yield p
+        else:
+            if orphan_pattern is not None:
+                self.orphan_files = []
+            for p, st, orphan in scan_files([self.basedir], ignore_dirs, ignore_files, pattern, orphan_pattern):
+                if orphan:
+                    self.orphan_files.append(p)
+                else:
+                    self.stats[p] = st
+                    yield p
+
+    def orphans(self, ignore_dirs: list[str], ignore_files: list[str], pattern: list[str]):
+        """candidates of orphan removal. call after files() is consumed"""
+        if not self.active:
+            if self.orphan_files is not None:
+                yield from self.orphan_files
+            else:
+                yield from find_files([self.basedir], ignore_dirs, ignore_files, pattern)
+            return
+        for d in sorted(self.dirs):
+            if not d.is_dir() or self._ignored_dir(d / "_", ignore_dirs):
+                continue
+            for p in d.iterdir():
+                if p.is_file() and match_name(p.name, ignore_files, pattern):
+                    yield p
+
+    def commit(self, dry: bool):
+        """record start time of this run as watermark"""
+        if self.watermark is not None and not dry:
+            self.watermark.write_text(str(self.start_ns))
+
+
+def incremental_option(func):
+    @click.option("--changed", type=click.File("r"), help="process listed files only ('-': stdin)")
+    @click.option("--watermark", type=click.Path(dir_okay=False), help="process files newer than last run")
+    @functools.wraps(func)
+    def _(changed, watermark, **kwargs):
+        incremental = Incremental(Path(kwargs["publicdir"]), changed, watermark)
+        res = func(incremental=incremental, **kwargs)
+        incremental.commit(kwargs.get("dry", False))
+        return res
+    return _
+
+
+def find_duplicates(files: list[Path], stat: Callable[[Path], os.stat_result]) -> dict[Path, list[Path]]:
+    """group byte-identical files. returns {first file: [other files]}"""
+    import hashlib
+    by_size: dict[int, list[Path]] = {}
+    for filepath in files:
+        by_size.setdefault(stat(filepath).st_size, []).append(filepath)
+    res = {}
+    for size, group in by_size.items():
+        if size == 0 or len(group) < 2:
+            continue
+        by_digest: dict[str, list[Path]] = {}
+        for filepath in group:
+            with filepath.open("rb") as ifp:
+                by_digest.setdefault(hashlib.file_digest(ifp, "sha256").hexdigest(), []).append(filepath)
+        for same in by_digest.values():
+            if len(same) > 1:
+                same.sort()
+                res[same[0]] = same[1:]
+    return res
+
+
+def link_file(src: Path, dst: Path, dry: bool) -> bool:
+    """replace dst with hardlink to src. returns False if already linked"""
+    if dst.exists() and os.path.samefile(src, dst):
+        return False
+    _log.info("link(dry=%s): %s -> %s", dry, src, dst)
+    if dry:
+        return True
+    tmppath = dst.with_name("." + dst.name + f".{os.getpid()}.tmp")
+    tmppath.unlink(missing_ok=True)
+    os.link(src, tmppath)
+    try:
+        os.replace(tmppath, dst)
+    except Exception:
+        tmppath.unlink()
+        raise
+    return True
+
+
+def link_duplicates(groups: dict[Path, list[Path]], exts: list[str], dry: bool, sources: bool = False) -> int:
+    """hardlink compressed files of the first file to duplicates. returns number of links"""
+    nlinks = 0
+    for first, dups in groups.items():
+        for ext in exts:
+            comp = first.with_suffix(first.suffix + ext)
+            for dup in dups:
+                dup_comp = dup.with_suffix(dup.suffix + ext)
+                if comp.exists():
+                    nlinks += link_file(comp, dup_comp, dry)
+                elif dup_comp.exists():
+                    _log.info("remove(dry=%s): %s", dry, dup_comp)
+                    if not dry:
+                        dup_comp.unlink()
+        if sources:
+            for dup in dups:
+                nlinks += link_file(first, dup, dry)
+    return nlinks
+
+
+def _cpu_time() -> float:
+    import resource
+    res = 0.0
+    for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+        ru = resource.getrusage(who)
+        res += ru.ru_utime + ru.ru_stime
+    return res
+
+
+# nginx "combined" log format: request, status, body bytes
+access_log_re = re.compile(r'^\S+ \S+ \S+ \[[^\]]*\] "(?:GET|HEAD) (\S+)[^"]*" (\d{3}) (\d+|-)')
+
+
+def url_to_relpath(url: str, prefix: str = "/") -> Optional[str]:
+    """path of url relative to publicdir
+
+    >>> url_to_relpath("/hugo/post/a/?x=1", "/hugo/")
+    'post/a/index.html'
+    >>> url_to_relpath("/hugo/css/a%20b.css", "/hugo")
+    'css/a b.css'
+    >>> url_to_relpath("/other/", "/hugo/") is None
+    True
+    """
+    import urllib.parse
+    path = urllib.parse.unquote(urllib.parse.urlsplit(url).path)
+    prefix = prefix.rstrip("/") + "/"
+    if not path.startswith(prefix):
+        if path + "/" != prefix:
+            return None
+        path = prefix
+    path = path[len(prefix):]
+    if path == "" or path.endswith("/"):
+        path += "index.html"
+    if ".." in path.split("/"):
+        return None
+    return path
+
+
+def read_access_log(filepath: Path, prefix: str = "/"):
+    """yields (relative path, body bytes) of successful GET requests. *.gz is decompressed while reading"""
+    opener = gzip.open if filepath.suffix == ".gz" else open
+    with opener(filepath, "rt", errors="replace") as ifp:
+        for line in ifp:
+            m = access_log_re.match(line)
+            if m is None:
+                continue
+            url, status, nbytes = m.groups()
+            if status not in ("200", "206", "304"):
+                continue
+            path = url_to_relpath(url, prefix)
+            if path is not None:
+                yield path, 0 if nbytes == "-" else int(nbytes)
+
+
+class HitIndex:
+    """hit count of each path (relative to publicdir) from access logs"""
+
+    def __init__(self, dbpath: Path):
+        import sqlite3
+        self.conn = sqlite3.connect(dbpath)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS hits (path TEXT PRIMARY KEY, hits INTEGER, bytes INTEGER)")
+
+    def load(self) -> dict[str, tuple[int, int]]:
+        return {x[0]: (x[1], x[2]) for x in self.conn.execute("SELECT path, hits, bytes FROM hits")}
+
+    def save(self, counts: dict[str, list[int]], append: bool = False):
+        if not append:
+            self.conn.execute("DELETE FROM hits")
+        self.conn.executemany(
+            "INSERT INTO hits (path, hits, bytes) VALUES (?, ?, ?)"
+            " ON CONFLICT(path) DO UPDATE SET hits = hits + excluded.hits, bytes = bytes + excluded.bytes",
+            [(k, *v) for k, v in counts.items()])
+        self.conn.commit()
+
+    def top(self, basedir: Path, files: list[tuple[Path, int]], percent: float) -> tuple[set[Path], set[Path]]:
+        """files serving top `percent` of bytes (hits x size), and files never hit"""
+        hits = self.load()
+        weights = []
+        unseen = set()
+        for filepath, size in files:
+            key = filepath.relative_to(basedir).as_posix()
+            nhits = hits.get(key, (0, 0))[0]
+            if nhits == 0:
+                unseen.add(filepath)
+            else:
+                weights.append((nhits * size, filepath))
+        weights.sort(key=lambda x: x[0], reverse=True)
+        limit = sum(x[0] for x in weights) * percent / 100
+        top = set()
+        acc = 0
+        for weight, filepath in weights:
+            if acc >= limit:
+                break
+            top.add(filepath)
+            acc += weight
+        _log.info("hits: top %d files, %d files without hits", len(top), len(unseen))
+        return top, unseen
+
+
+def hits_option(func):
+    @click.option("--hits", type=click.Path(exists=True, dir_okay=False), help="index by static-access-index")
+    @click.option("--hits-top", type=float, default=20, show_default=True,
+                  help="percent of served bytes to spend expensive settings")
+    @click.option("--hits-skip/--no-hits-skip", default=False, show_default=True, help="skip files without hits")
+    @functools.wraps(func)
+    def _(*args, **kwargs):
+        return func(*args, **kwargs)
+    return _
+
+
+@click.argument("logs", type=click.Path(exists=True, dir_okay=False), nargs=-1)
+@click.option("--output", type=click.Path(dir_okay=False), default="hits.db", show_default=True)
+@click.option("--prefix", default="/", show_default=True, help="url prefix of publicdir (e.g. /hugo/)")
+@click.option("--append/--replace", default=False, show_default=True)
+def static_access_index(logs, output, prefix, append):
+    """static site: count hits of each path from nginx access logs (plain or .gz)"""
+    counts: dict[str, list[int]] = {}
+    nreq = 0
+    for log in logs:
+        for path, nbytes in read_access_log(Path(log), prefix):
+            ent = counts.setdefault(path, [0, 0])
+            ent[0] += 1
+            ent[1] += nbytes
+            nreq += 1
+    HitIndex(Path(output)).save(counts, append)
+    click.echo(f"{nreq} requests, {len(counts)} paths")
+
+
+def compress_tree(basedir: Path, specs: list[tuple[str, int]], dry: bool, remove: bool,
+                  parallel: int, executor: str, manifest: Optional[str], verify: bool,
+                  stream_threshold: int, memory_budget: int, adaptive: float = 0,
+                  block_threshold: int = 0, block_size: int = stream_chunk, zstd_dict: Optional[str] = None,
+                  incremental: Optional[Incremental] = None, dedup: bool = False, dedup_sources: bool = False,
+                  hits: Optional[str] = None, hits_top: float = 20, hits_skip: bool = False,
+                  zstd_level: Optional[int] = None):
+    """compress files under basedir with codecs, and remove orphaned compressed files
+
+    dedup: compress identical files once and hardlink the compressed files
+    hits: use expensive tier for files serving top `hits_top` percent of bytes in access logs"""
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+    codecs: list[Codec] = []
+    for name, minsize in specs:
+        dictionary = None
+        level = None
+        if name == "zstd":
+            if zstd_dict:
+                dictionary = Path(zstd_dict).read_bytes()
+            level = zstd_level
+        codec = Codec(name, minsize, dictionary, level)
+        if codec.ext in [x.ext for x in codecs]:
+            raise click.BadParameter(f"duplicate codec for {codec.ext}: {name}")
+        if manifest:
+            codec.manifest = CompManifest(Path(manifest), codec.manifest_key)
+        codecs.append(codec)
+    manifests = [x.manifest for x in codecs if x.manifest is not None]
+    settings = CompressSettings(dry, verify, stream_threshold, block_threshold, block_size, parallel)
+    budget = None
+    if memory_budget > 0:
+        budget = MemoryBudget(memory_budget)
     if basedir.is_file():
-        may_comp(basedir, minsize, compressfn, gzip.decompress, ".gz", dry)
+        may_precomp(basedir, codecs, settings)
+        for mf in manifests:
+            mf.save()
+        return
+    start = time.monotonic()
+    if incremental is None:
+        incremental = Incremental(basedir)
+    comp_patterns = ["*" + x.ext for x in codecs]
+    files = incremental.files(compress_ignore_dirs, compress_ignore_files, compress_file_patterns, comp_patterns)
+    groups = {}
+    if dedup or dedup_sources:
+        files = list(files)
+        groups = find_duplicates(files, incremental.stat)
+        dups = {x for v in groups.values() for x in v}
+        files = [x for x in files if x not in dups]
+        dup_bytes = sum(incremental.stat(k).st_size * len(v) for k, v in groups.items())
+        uniq_bytes = sum(incremental.stat(x).st_size for x in files) or 1
+    cpu_start = _cpu_time()
+    plan = None
+    expected = None
+    if adaptive > 0 and hits:
+        raise click.BadParameter("--adaptive and --hits are exclusive")
+    if executor == "process" or adaptive > 0 or hits:
+        files = [(x, incremental.stat(x).st_size) for x in files]
+    if hits:
+        top, unseen = HitIndex(Path(hits)).top(basedir, files, hits_top)
+        if hits_skip:
+            files = [x for x in files if x[0] not in unseen]
+        plan = {str(x): {c.ext for c in codecs} for x in top}
+    if adaptive > 0:
+        # some compressors hold GIL: do not expect speedup by threads
+        workers = min(parallel, os.cpu_count() or 1) if executor == "process" else 1
+        plan, expected = plan_adaptive(files, codecs, adaptive, workers)
+    if executor == "process":
+        total = precomp_process(files, codecs, settings, plan, memory_budget)
     else:
-        executor = ThreadPoolExecutor(parallel)
-        for filepath in find_files([Path(publicdir)], ignore_dirs, ignore_files, file_patterns):
-            executor.submit(may_comp, filepath, minsize, compressfn, gzip.decompress, ".gz", dry)
-        executor.shutdown()
-        for filepath in find_files([Path(publicdir)], ignore_dirs, file_patterns, ignore_files):
-            may_remove(filepath, ".gz", not remove)
+        total = {}
+        futures = {}
+        pool = ThreadPoolExecutor(parallel)
+        for filepath in files:
+            size = None
+            if isinstance(filepath, tuple):
+                filepath, size = filepath
+            expensive = None
+            if plan is not None:
+                expensive = plan.get(str(filepath), set())
+            futures[pool.submit(may_precomp, filepath, codecs, settings, budget, expensive,
+                                incremental.stats.get(filepath))] = (filepath, size)
+        for fut, (filepath, size) in futures.items():
+            try:
+                res = fut.result()
+            except Exception as e:
+                _log.warning("compress failed: %s: %s", filepath, e)
+                continue
+            if size is not None:
+                _add_result(total, size, res)
+        pool.shutdown()
+    if groups:
+        cpu = _cpu_time() - cpu_start
+        ndups = sum(len(x) for x in groups.values())
+        nlinks = link_duplicates(groups, [x.ext for x in codecs], dry, dedup_sources)
+        click.echo("dedup: %d duplicates of %d files, %d links, %d bytes skipped, about %.2f cpu sec saved" % (
+            ndups, len(groups), nlinks, dup_bytes, cpu * dup_bytes / uniq_bytes))
+    if expected is not None:
+        click.echo("adaptive: %.2f sec (budget %.2f sec)" % (time.monotonic() - start, adaptive))
+        for ext, exp in expected.items():
+            nfiles, nbytes, actual = total.get(ext, [0, 0, 0])
+            click.echo("%s: %d files, %d bytes -> expected %d, actual %d" % (ext, nfiles, nbytes, exp, actual))
+    for mf in manifests:
+        # other files are not seen in incremental mode
+        mf.save(prune=None if incremental.active else basedir)
+    for filepath in incremental.orphans(compress_ignore_dirs, compress_file_patterns, comp_patterns):
+        may_remove(filepath, filepath.suffix, not remove)
+
+
+def compress_option(func):
+    @click.option("--parallel", type=int, default=1, show_default=True)
+    @click.option("--executor", type=click.Choice(["thread", "process"]), default="thread", show_default=True,
+                  help="process: for cpu-bound codecs (zopfli, brotli)")
+    @click.option("--manifest", type=click.Path(dir_okay=False), help="state db to skip unchanged files")
+    @click.option("--verify/--no-verify", default=False, show_default=True,
+                  help="compare content of all compressed files (ignore manifest)")
+    @click.option("--stream-threshold", type=int, default=1024*1024*32, show_default=True,
+                  help="compress larger files in chunks (0: never)")
+    @click.option("--memory-budget", type=int, default=1024*1024*1024, show_default=True,
+                  help="limit memory of files in flight (0: unlimited)")
+    @click.option("--adaptive", type=float, default=0, show_default=True,
+                  help="time budget(sec) to choose expensive/cheap levels for each file (0: off)")
+    @click.option("--dedup/--no-dedup", default=False, show_default=True,
+                  help="compress identical files once and hardlink compressed files")
+    @click.option("--dedup-sources/--no-dedup-sources", default=False, show_default=True,
+                  help="hardlink identical sources too (do not use on trees updated in place)")
+    @functools.wraps(func)
+    def _(*args, **kwargs):
+        return func(*args, **kwargs)
+    return _
+
+
+def block_option(func):
+    @click.option("--block-threshold", type=int, default=0, show_default=True,
+                  help="gzip larger files in parallel blocks (0: never)")
+    @click.option("--block-size", type=int, default=stream_chunk, show_default=True)
+    @functools.wraps(func)
+    def _(*args, **kwargs):
+        return func(*args, **kwargs)
+    return _
+
+
+@click.option("--minsize", type=int, default=1024*8, show_default=True)
+@click.argument("publicdir", type=click.Path(dir_okay=True, exists=True, file_okay=True),
+                default="./public")
+@click.option("--try-zopfli/--gzip", default=False, show_default=True)
+@click.option("--dry/--wet", default=False, show_default=True)
+@click.option("--remove/--no-remove", default=False, show_default=True, help="remove xxx.gz if xxx does not exists")
+@incremental_option
+@hits_option
+@compress_option
+@block_option
+def static_gzip(publicdir, minsize, try_zopfli, dry, remove, **kwargs):
+    """static site: gzip_static on;"""
+    name = "gzip"
+    if try_zopfli:
+        name = "zopfli"
+    compress_tree(Path(publicdir), [(name, minsize)], dry, remove, **kwargs)
 
 
 @click.option("--minsize", type=int, default=1024*8, show_default=True)
@@ -172,28 +1318,164 @@ def static_gzip(publicdir, minsize, try_zopfli, dry, remove, parallel):
                 default="./public")
 @click.option("--dry/--wet", default=False, show_default=True)
 @click.option("--remove/--no-remove", default=False, show_default=True, help="remove xxx.br if xxx does not exists")
-@click.option("--parallel", type=int, default=1, show_default=True)
-def static_brotli(publicdir, minsize, dry, remove, parallel):
+@incremental_option
+@hits_option
+@compress_option
+def static_brotli(publicdir, minsize, dry, remove, **kwargs):
     """static site: brotli_static on;"""
-    from concurrent.futures import ThreadPoolExecutor
+    compress_tree(Path(publicdir), [("brotli", minsize)], dry, remove, **kwargs)
+
+
+@click.option("--minsize", type=int, default=1024*8, show_default=True)
+@click.argument("publicdir", type=click.Path(dir_okay=True, exists=True, file_okay=True),
+                default="./public")
+@click.option("--dry/--wet", default=False, show_default=True)
+@click.option("--remove/--no-remove", default=False, show_default=True, help="remove xxx.zst if xxx does not exists")
+@click.option("--dict", "zstd_dict", type=click.Path(exists=True, dir_okay=False),
+              help="dictionary trained by static-zstd-train")
+@click.option("--level", "zstd_level", type=int, default=codec_level["zstd"], show_default=True)
+@incremental_option
+@hits_option
+@compress_option
+def static_zstd(publicdir, minsize, dry, remove, **kwargs):
+    """static site: zstd_static on;"""
+    compress_tree(Path(publicdir), [("zstd", minsize)], dry, remove, **kwargs)
+
+
+@click.argument("publicdir", type=click.Path(dir_okay=True, exists=True, file_okay=False),
+                default="./public")
+@click.option("--output", type=click.Path(dir_okay=False), default="zstd.dict", show_default=True)
+@click.option("--size", type=int, default=112640, show_default=True, help="dictionary size")
+@click.option("--sample", type=int, default=2000, show_default=True, help="max number of sample files")
+@click.option("--pattern", multiple=True, default=["*.html", "*.css", "*.js"], show_default=True)
+def static_zstd_train(publicdir, output, size, sample, pattern):
+    """static site: train zstd dictionary for static-zstd --dict"""
+    import random
     try:
-        import brotli
+        import zstandard
     except ImportError:
-        _log.error("cannot import brotli: try 'pip install brotli'")
+        _log.error("cannot import zstandard: try 'pip install zstandard'")
         raise
-    ignore_dirs = [".git"]
-    ignore_files = ["*.gz", "*.br"]
-    file_patterns = ["*.txt", "*.css", "*.html", "*.js", "*.xml", "*.svg", "*.json"]
+    files = sorted(find_files([Path(publicdir)], compress_ignore_dirs, compress_ignore_files, list(pattern)))
+    if len(files) > sample:
+        files = random.Random(0).sample(files, sample)
+    samples = [x.read_bytes()[:128 * 1024] for x in files]
+    _log.info("train: %d files, %d bytes", len(samples), sum(len(x) for x in samples))
+    dict_data = zstandard.train_dictionary(size, samples)
+    Path(output).write_bytes(dict_data.as_bytes())
+    compress, _ = zstd_codec(19)
+    compress_dict, _ = zstd_codec(19, dict_data.as_bytes())
+    click.echo("dictionary %s: id=%d, %d bytes" % (output, dict_data.dict_id(), len(dict_data)))
+    click.echo("samples: %d bytes, zstd %d bytes, zstd+dict %d bytes" % (
+        sum(len(x) for x in samples), sum(len(compress(x)) for x in samples),
+        sum(len(compress_dict(x)) for x in samples)))
+
+
+@click.option("--minsize", type=int, default=1024*8, show_default=True)
+@click.argument("publicdir", type=click.Path(dir_okay=True, exists=True, file_okay=True),
+                default="./public")
+@click.option("--codec", multiple=True, default=["gzip", "brotli"], show_default=True,
+              help="codec[:minsize] (" + ", ".join(codec_ext.keys()) + ")")
+@click.option("--dry/--wet", default=False, show_default=True)
+@click.option("--remove/--no-remove", default=False, show_default=True,
+              help="remove compressed files if original does not exists")
+@click.option("--zstd-dict", type=click.Path(exists=True, dir_okay=False), help="dictionary for zstd")
+@click.option("--zstd-level", type=int, default=codec_level["zstd"], show_default=True)
+@incremental_option
+@hits_option
+@compress_option
+@block_option
+def static_precompress(publicdir, minsize, codec, dry, remove, **kwargs):
+    """static site: generate .gz/.br/.zst in single pass"""
+    specs = [parse_codec(x, minsize) for x in codec]
+    compress_tree(Path(publicdir), specs, dry, remove, **kwargs)
+
+
+minify_patterns = ["*" + x for x in minifiers.keys()]
+
+
+def may_minify(filepath: Path, unquote: bool, dry: bool) -> tuple[int, int]:
+    """minify file in place if it gets smaller. returns (size before, size after)"""
+    data = filepath.read_bytes()
+    text = data.decode("utf-8", errors="surrogateescape")
+    if filepath.suffix == ".html":
+        newtext = minify_html(text, unquote)
+    else:
+        newtext = minifiers[filepath.suffix](text)
+    newdata = newtext.encode("utf-8", errors="surrogateescape")
+    if len(newdata) >= len(data):
+        return len(data), len(data)
+    _log.debug("minify(dry=%s): %s %d -> %d", dry, filepath, len(data), len(newdata))
+    if not dry:
+        write_atomic(filepath, newdata)
+    return len(data), len(newdata)
+
+
+def _minify_chunk(files: list[Path], unquote: bool, specs: list[tuple], settings: CompressSettings) -> list[tuple]:
+    """worker process: minify then compress. returns [(path, size before, size after, stat)]"""
+    codecs = [Codec(*x) for x in specs]
+    res = []
+    for filepath in files:
+        try:
+            before, after = may_minify(filepath, unquote, settings.dry)
+            if codecs:
+                may_precomp(filepath, codecs, settings)
+            res.append((filepath, before, after, filepath.stat()))
+        except Exception as e:
+            _log.warning("minify failed: %s: %s", filepath, e)
+    return res
+
+
+@click.argument("publicdir", type=click.Path(dir_okay=True, exists=True, file_okay=True),
+                default="./public")
+@click.option("--dry/--wet", default=False, show_default=True)
+@click.option("--remove-quotes/--keep-quotes", default=False, show_default=True,
+              help="remove quotes of simple html attribute values")
+@click.option("--codec", multiple=True,
+              help="compress after minify: codec[:minsize] (" + ", ".join(codec_ext.keys()) + ")")
+@click.option("--minsize", type=int, default=1024*8, show_default=True)
+@click.option("--manifest", type=click.Path(dir_okay=False), help="state db to skip unchanged files")
+@click.option("--parallel", type=int, default=os.cpu_count(), show_default=True)
+@incremental_option
+def static_minify(publicdir, dry, remove_quotes, codec, minsize, manifest, parallel, incremental):
+    """static site: minify html/css/js/svg (run before compress)"""
+    from concurrent.futures import ProcessPoolExecutor
     basedir = Path(publicdir)
-    if basedir.is_file():
-        may_comp(basedir, minsize, brotli.compress, brotli.decompress, ".br", dry)
+    specs = [Codec(*parse_codec(x, minsize)).spec for x in codec]
+    settings = CompressSettings(dry=dry)
+    mf = None
+    if manifest:
+        mf = CompManifest(Path(manifest), ".min")
+    files = []
+    nskip = 0
+    for filepath in incremental.files(compress_ignore_dirs, compress_ignore_files, minify_patterns):
+        if mf is not None:
+            st = incremental.stat(filepath)
+            ent = mf.get(filepath)
+            if ent is not None and ent[:2] == (st.st_size, st.st_mtime_ns):
+                nskip += 1
+                continue
+        files.append(filepath)
+    nproc = max(min(parallel, len(files)), 1)
+    chunks = [files[i::nproc * 4] for i in range(min(len(files), nproc * 4))]
+    if nproc == 1:
+        results = [_minify_chunk(x, remove_quotes, specs, settings) for x in chunks]
     else:
-        executor = ThreadPoolExecutor(parallel)
-        for filepath in find_files([Path(publicdir)], ignore_dirs, ignore_files, file_patterns):
-            executor.submit(may_comp, filepath, minsize, brotli.compress, brotli.decompress, ".br", dry)
-        executor.shutdown()
-        for filepath in find_files([Path(publicdir)], ignore_dirs, file_patterns, ignore_files):
-            may_remove(filepath, ".br", not remove)
+        with ProcessPoolExecutor(nproc) as executor:
+            results = list(executor.map(_minify_chunk, chunks, [remove_quotes] * len(chunks),
+                                        [specs] * len(chunks), [settings] * len(chunks)))
+    nfiles = nbefore = nafter = nchanged = 0
+    for filepath, before, after, st in (x for res in results for x in res):
+        nfiles += 1
+        nbefore += before
+        nafter += after
+        nchanged += before != after
+        if mf is not None and not dry:
+            mf.update(filepath, st.st_size, st.st_mtime_ns, None, after)
+    if mf is not None and not dry:
+        mf.save(prune=None if incremental.active else basedir)
+    click.echo("minify: %d files (%d changed, %d skipped), %d bytes -> %d bytes" % (
+        nfiles, nchanged, nskip, nbefore, nafter))
 
 
 imageopt_map = {
@@ -216,6 +1498,72 @@ imageopt_map = {
 imageopt_map = {k: v for k, v in imageopt_map.items() if shutil.which(v[1][0])}
 
 
+# tools which accept multiple files and optimize them in place
+imageopt_batch = {
+    "optipng": ["optipng", "-o7", "__FILES__"],
+    "advpng": ["advpng", "-z", "__FILES__"],
+    "jpegoptim": ["jpegoptim", "--strip-all", "__FILES__"],
+    "gifsicle": ["gifsicle", "-b", "-O3", "__FILES__"],
+}
+
+
+@functools.cache
+def scratch_dir() -> Optional[str]:
+    """tmpfs for scratch files, if available"""
+    shm = Path("/dev/shm")
+    if shm.is_dir() and os.access(shm, os.W_OK):
+        return str(shm)
+    return None
+
+
+def replace_file(filepath: Path, newpath: Path):
+    """replace content of filepath with newpath atomically"""
+    fd, tmpname = tempfile.mkstemp(dir=filepath.parent, prefix="." + filepath.name + ".", suffix=".tmp")
+    os.close(fd)
+    try:
+        shutil.copyfile(newpath, tmpname)
+        shutil.copymode(filepath, tmpname)
+        os.replace(tmpname, filepath)
+    except Exception:
+        Path(tmpname).unlink(missing_ok=True)
+        raise
+
+
+def write_atomic(filepath: Path, data: bytes):
+    """write data to filepath via temporary file and rename"""
+    fd, tmpname = tempfile.mkstemp(dir=filepath.parent, prefix="." + filepath.name + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as ofp:
+            ofp.write(data)
+        if filepath.exists():
+            shutil.copymode(filepath, tmpname)
+        else:
+            os.chmod(tmpname, 0o644)
+        os.replace(tmpname, filepath)
+    except Exception:
+        Path(tmpname).unlink(missing_ok=True)
+        raise
+
+
+def _run_tool(cmd: list[str]) -> subprocess.CompletedProcess:
+    res = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.DEVNULL, text=True)
+    if res.stdout:
+        _log.debug("stdout: %s", repr(res.stdout))
+    if res.stderr:
+        _log.debug("stderr: %s", repr(res.stderr))
+    return res
+
+
+def _update_image(filepath: Path, size: int, outfname: Path, dry: bool):
+    ost = outfname.stat()
+    _log.info("compress(dry=%s): %s %s -> %s", dry, filepath, size, ost.st_size)
+    if size <= ost.st_size or ost.st_size == 0:
+        _log.info("already optimized. continue")
+    elif not dry:
+        _log.info("update file: %s %s -> %s", filepath, size, ost.st_size)
+        replace_file(filepath, outfname)
+
+
 def may_imagecomp(filepath: Path, command: list[str], dry: bool):
     defer = []
     cmd = []
@@ -228,69 +1576,1205 @@ def may_imagecomp(filepath: Path, command: list[str], dry: bool):
             infname = filepath
             cmd.append(str(infname))
         elif i == "__OUTPUT__":
-            tf = tempfile.NamedTemporaryFile("wb+", suffix=ext, )
+            tf = tempfile.NamedTemporaryFile("wb+", suffix=ext, dir=scratch_dir())
             outfname = Path(tf.name)
             cmd.append(str(outfname))
             defer.append(tf.close)
             outfname.unlink()
         elif i == "__TMPDIR__":
-            td = tempfile.TemporaryDirectory()
+            td = tempfile.TemporaryDirectory(dir=scratch_dir())
             outfname = Path(td.name)
             cmd.append(str(td.name))
             defer.append(td.cleanup)
         elif i == "__TMPFILE__":
-            tf = tempfile.NamedTemporaryFile("wb+", suffix=ext)
-            tf.write(filepath.read_bytes())
-            tf.flush()
+            tf = tempfile.NamedTemporaryFile("wb+", suffix=ext, dir=scratch_dir())
+            shutil.copyfile(filepath, tf.name)
             infname = Path(tf.name)
             outfname = Path(tf.name)
-            cmd.append(infname)
+            cmd.append(str(infname))
             defer.append(tf.close)
         else:
             cmd.append(i)
     _log.debug("%s: %s -> %s, cmd=%s, defer=%s", filepath, infname, outfname, cmd, defer)
-    res = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.DEVNULL, text=True)
-    if res.stdout:
-        _log.debug("stdout: %s", repr(res.stdout))
-    if res.stderr:
-        _log.debug("stderr: %s", repr(res.stderr))
-    res.check_returncode()
-    if outfname.is_dir():
-        files = list(outfname.iterdir())
-        if len(files) != 1:
-            _log.warning("multiple files: %s", files)
-            files = [x for x in files if x.endswith(ext)]
-            _log.info("choose[0] %s", files)
+    try:
+        _run_tool(cmd).check_returncode()
+        if outfname.is_dir():
+            files = list(outfname.iterdir())
+            if len(files) != 1:
+                _log.warning("multiple files: %s", files)
+                files = [x for x in files if x.name.endswith(ext)]
+                _log.info("choose[0] %s", files)
             outfname = files[0]
-    ost = outfname.stat()
-    _log.info("compress(dry=%s): %s %s -> %s", dry, filepath, ist.st_size, ost.st_size)
-    if ist.st_size <= ost.st_size or ost.st_size == 0:
-        _log.info("already optimized. continue")
-    elif not dry:
-        _log.info("update file: %s %s -> %s", filepath, ist.st_size, ost.st_size)
-        filepath.write_bytes(outfname.read_bytes())
-    for fn in defer:
-        fn()
+        _update_image(filepath, ist.st_size, outfname, dry)
+    finally:
+        for fn in defer:
+            fn()
+
+
+def may_imagebatch(files: list[Path], command: list[str], dry: bool):
+    """optimize copies of files on scratch dir with single tool invocation"""
+    with tempfile.TemporaryDirectory(dir=scratch_dir()) as td:
+        work = []
+        for i, filepath in enumerate(files):
+            tmp = Path(td) / f"{i}{filepath.suffix}"
+            shutil.copyfile(filepath, tmp)
+            work.append((filepath, filepath.stat().st_size, tmp))
+        cmd = []
+        for i in command:
+            if i == "__FILES__":
+                cmd.extend(str(x[2]) for x in work)
+            else:
+                cmd.append(i)
+        _log.debug("batch %d files: cmd=%s", len(work), cmd[:len(command)])
+        # output of broken file may be truncated: update nothing on failure
+        _run_tool(cmd).check_returncode()
+        for filepath, size, tmp in work:
+            _update_image(filepath, size, tmp, dry)
+
+
+class ImageOptCache:
+    """persistent cache of optimized images, keyed by content hash
+
+    records optimizers applied to each content and the result content.
+    results are stored in blobs/ directory
+    """
+
+    def __init__(self, cachedir: Path):
+        import sqlite3
+        import threading
+        self.cachedir = cachedir
+        self.cachedir.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(cachedir / "index.db", check_same_thread=False)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS imageopt (digest TEXT PRIMARY KEY, modes TEXT, result TEXT)")
+        res = self.conn.execute("SELECT digest, modes, result FROM imageopt")
+        self.entries: dict[str, tuple[set[str], str]] = {x[0]: (set(x[1].split(",")), x[2]) for x in res.fetchall()}
+        _log.debug("image cache %s: %d entries", cachedir, len(self.entries))
+
+    def blob(self, digest: str) -> Path:
+        return self.cachedir / "blobs" / digest[:2] / digest
+
+    def get(self, digest: str) -> tuple[set[str], str]:
+        """returns (applied modes, digest of result)"""
+        with self.lock:
+            return self.entries.get(digest, (set(), digest))
+
+    def put(self, digest: str, modes: set[str], result: str, data: Optional[bytes] = None):
+        if data is not None and result != digest and not self.blob(result).exists():
+            blob = self.blob(result)
+            blob.parent.mkdir(parents=True, exist_ok=True)
+            blob.write_bytes(data)
+        with self.lock:
+            val = ",".join(sorted(modes))
+            for k in {digest, result}:
+                self.entries[k] = (set(modes), result)
+                self.conn.execute("INSERT OR REPLACE INTO imageopt (digest, modes, result) VALUES (?, ?, ?)",
+                                  (k, val, result))
+
+    def save(self):
+        with self.lock:
+            self.conn.commit()
+
+
+ImageStep = tuple[str, list[str], list[str], Optional[list[str]]]
+
+
+def parse_imageopt_modes(mode: str) -> list[ImageStep]:
+    """parse comma separated optimizers: returns [(mode, file patterns, command, batch command), ...]"""
+    res = []
+    for m in mode.split(","):
+        if m not in imageopt_map:
+            raise click.BadParameter(f"unknown mode: {m} (choose from {', '.join(imageopt_map.keys())})")
+        res.append((m, *imageopt_map[m], imageopt_batch.get(m)))
+    return res
+
+
+def may_imagechain(files: list[Path], chain: list[ImageStep], dry: bool,
+                   cache: Optional[ImageOptCache] = None, batch: bool = False):
+    """apply optimizers in order. each step keeps the result only if smaller"""
+    import fnmatch
+    states = []
+    for filepath in files:
+        digest = None
+        applied: set[str] = set()
+        if cache is not None:
+            digest = _digest(filepath.read_bytes())
+            applied, result = cache.get(digest)
+            if result != digest:
+                if cache.blob(result).exists():
+                    _log.info("restore from cache(%s): %s", ",".join(sorted(applied)), filepath)
+                    if not dry:
+                        replace_file(filepath, cache.blob(result))
+                else:
+                    applied = set()
+        states.append((filepath, digest, applied))
+    for mode, patterns, command, batch_command in chain:
+        targets = []
+        for filepath, _, applied in states:
+            if not any(fnmatch.fnmatch(filepath.name, p) for p in patterns):
+                continue
+            if mode in applied:
+                _log.debug("already applied %s: %s", mode, filepath)
+                continue
+            targets.append((filepath, applied))
+        if not targets:
+            continue
+        # record mode only if the step succeeded: failed steps are retried next time
+        if batch and batch_command is not None:
+            try:
+                may_imagebatch([x[0] for x in targets], batch_command, dry)
+                for _, applied in targets:
+                    applied.add(mode)
+                continue
+            except subprocess.CalledProcessError as e:
+                _log.warning("batch optimize failed(%s files): %s: retry each file", len(targets), e)
+        for filepath, applied in targets:
+            try:
+                may_imagecomp(filepath, command, dry)
+                applied.add(mode)
+            except subprocess.CalledProcessError as e:
+                _log.warning("optimize failed: %s: %s", filepath, e)
+    if cache is not None and not dry:
+        for filepath, digest, applied in states:
+            if applied:
+                data = filepath.read_bytes()
+                cache.put(digest, applied, _digest(data), data)
+
+
+def image_optimize_tree(basedir: Path, chain: list[ImageStep], dry: bool, parallel: int, batch: int,
+                        cache: Optional[ImageOptCache], incremental: Incremental, hits: Optional[str] = None,
+                        hits_top: float = 20, hits_skip: bool = False,
+                        cheap_chain: Optional[list[ImageStep]] = None):
+    """optimize images under basedir
+
+    hits: files serving top `hits_top` percent of bytes use chain, others use cheap_chain (default: chain)
+    hits_skip: skip files without hits"""
+    from concurrent.futures import ThreadPoolExecutor
+    ignore_dirs = [".git"]
+    ignore_files = ["*.gz", "*.br", "*.html", "*.xml", "*.css", "*.js"]
+    if cheap_chain is None:
+        cheap_chain = chain
+    file_patterns = sorted({p for x in chain + cheap_chain for p in x[1]})
+    files = list(incremental.files(ignore_dirs, ignore_files, file_patterns))
+    jobs = [(files, chain)]
+    if hits:
+        sizes = [(x, incremental.stat(x).st_size) for x in files]
+        top, unseen = HitIndex(Path(hits)).top(basedir, sizes, hits_top)
+        if hits_skip:
+            files = [x for x in files if x not in unseen]
+        jobs = [([x for x in files if x in top], chain), ([x for x in files if x not in top], cheap_chain)]
+    batch = max(batch, 1)
+    executor = ThreadPoolExecutor(parallel)
+    futures = [executor.submit(may_imagechain, targets[i:i+batch], steps, dry, cache, batch > 1)
+               for targets, steps in jobs for i in range(0, len(targets), batch)]
+    for fut in futures:
+        try:
+            fut.result()
+        except Exception as e:
+            _log.warning("optimize failed: %s", e)
+    executor.shutdown()
 
 
 if len(imageopt_map) != 0:
     @click.argument("publicdir", type=click.Path(dir_okay=True, exists=True, file_okay=True),
                     default="./public")
     @click.option("--dry/--wet", default=False, show_default=True)
-    @click.option("--mode", type=click.Choice(list(imageopt_map.keys())),
-                  default=list(imageopt_map.keys())[0], show_default=True)
+    @click.option("--mode", default=list(imageopt_map.keys())[0], show_default=True,
+                  help="comma separated optimizers (" + ", ".join(imageopt_map.keys()) + ")")
+    @click.option("--cheap-mode", help="optimizers for files outside --hits-top (default: --mode)")
     @click.option("--parallel", type=int, default=1, show_default=True)
-    def static_image_optimize(publicdir, mode, dry, parallel):
+    @click.option("--batch", type=int, default=1, show_default=True,
+                  help="files per tool invocation (" + ", ".join(imageopt_batch.keys()) + ")")
+    @click.option("--cache-dir", type=click.Path(file_okay=False), help="cache of optimized images")
+    @incremental_option
+    @hits_option
+    def static_image_optimize(publicdir, mode, cheap_mode, dry, parallel, batch, cache_dir, incremental, hits,
+                              hits_top, hits_skip):
         """static site: optimize image"""
-        from concurrent.futures import ThreadPoolExecutor
-        ignore_dirs = [".git"]
-        ignore_files = ["*.gz", "*.br", "*.html", "*.xml", "*.css", "*.js"]
-        file_patterns, command = imageopt_map.get(mode)
+        chain = parse_imageopt_modes(mode)
+        cheap_chain = None
+        if cheap_mode:
+            cheap_chain = parse_imageopt_modes(cheap_mode)
+        cache = None
+        if cache_dir:
+            cache = ImageOptCache(Path(cache_dir))
         basedir = Path(publicdir)
         if basedir.is_file():
-            may_imagecomp(basedir, command, dry)
+            may_imagechain([basedir], chain, dry, cache)
+        else:
+            image_optimize_tree(basedir, chain, dry, parallel, batch, cache, incremental, hits, hits_top, hits_skip,
+                                cheap_chain)
+        if cache is not None:
+            cache.save()
+
+
+# format: (pillow format name, mime type)
+image_variant_formats = {
+    "webp": ("WEBP", "image/webp"),
+    "avif": ("AVIF", "image/avif"),
+}
+image_variant_patterns = ["*.png", "*.jpg", "*.jpeg"]
+
+
+def variant_path(filepath: Path, fmt: str) -> Path:
+    """
+    >>> variant_path(Path("a/b.png"), "webp")
+    PosixPath('a/b.png.webp')
+    """
+    return filepath.with_name(filepath.name + "." + fmt)
+
+
+def may_imagevariant(filepath: Path, fmt: str, quality: int, dry: bool) -> Optional[int]:
+    """make fmt sibling of filepath if it is smaller. returns size of variant or None"""
+    try:
+        from PIL import Image
+    except ImportError:
+        _log.error("cannot import PIL: try 'pip install pillow'")
+        raise
+    import io
+    outpath = variant_path(filepath, fmt)
+    ist = filepath.stat()
+    if outpath.exists():
+        ost = outpath.stat()
+        if ost.st_mtime_ns >= ist.st_mtime_ns:
+            _log.debug("variant is up to date: %s", outpath)
+            return ost.st_size
+    buf = io.BytesIO()
+    with Image.open(filepath) as img:
+        meta = image_meta(img)
+        if img.mode not in ("RGB", "RGBA", "L", "LA"):
+            img = img.convert("RGBA" if "transparency" in img.info or img.mode == "PA" else "RGB")
+        img.save(buf, format=image_variant_formats[fmt][0], quality=quality, **meta)
+    data = buf.getvalue()
+    _log.info("variant(dry=%s): %s %s -> %s %s", dry, filepath, ist.st_size, fmt, len(data))
+    if len(data) >= ist.st_size:
+        _log.info("variant is not smaller: %s", outpath)
+        if outpath.exists() and not dry:
+            outpath.unlink()
+        return None
+    if not dry:
+        write_atomic(outpath, data)
+    return len(data)
+
+
+def _local_image(basedir: Path, htmlpath: Path, url: str) -> Optional[Path]:
+    import urllib.parse
+    u = urllib.parse.urlsplit(url)
+    if u.scheme or u.netloc or not u.path:
+        return None
+    path = urllib.parse.unquote(u.path)
+    if path.startswith("/"):
+        return basedir / path.lstrip("/")
+    return htmlpath.parent / path
+
+
+def write_html(htmlpath: Path, tree):
+    """serialize lxml.html tree to htmlpath"""
+    import lxml.html
+    import uuid
+    # libxml2 does not know <source> is a void element and writes </source>.
+    # rename empty ones to an unique name which cannot appear in the page, then drop only their end tags
+    placeholder = "source-" + uuid.uuid4().hex
+    for el in tree.iter("source"):
+        if len(el) == 0 and not el.text:
+            el.tag = placeholder
+    data = lxml.html.tostring(tree, method="html", encoding=tree.docinfo.encoding or "utf-8",
+                              doctype=tree.docinfo.doctype)
+    data = data.replace(f"</{placeholder}>".encode(), b"").replace(f"<{placeholder}".encode(), b"<source")
+    write_atomic(htmlpath, data)
+
+
+def picture_rewrite(htmlpath: Path, basedir: Path, formats: list[str], dry: bool) -> int:
+    """wrap <img> with <picture> if variants exist. returns number of rewritten tags"""
+    import lxml.html
+    import urllib.parse
+    tree = lxml.html.parse(str(htmlpath))
+    count = 0
+    for img in tree.xpath("//img[@src][not(@srcset)][not(ancestor::picture)]"):
+        src = img.attrib["src"]
+        local = _local_image(basedir, htmlpath, src)
+        if local is None:
+            continue
+        sources = []
+        for fmt in formats:
+            if variant_path(local, fmt).exists():
+                u = urllib.parse.urlsplit(src)
+                url = urllib.parse.urlunsplit(u._replace(path=u.path + "." + fmt))
+                sources.append(lxml.html.Element("source", type=image_variant_formats[fmt][1], srcset=url))
+        if not sources:
+            continue
+        picture = lxml.html.Element("picture")
+        img.addprevious(picture)
+        picture.tail, img.tail = img.tail, None
+        picture.extend(sources)
+        picture.append(img)
+        count += 1
+    if count != 0:
+        _log.info("rewrite(dry=%s): %s %d images", dry, htmlpath, count)
+        if not dry:
+            write_html(htmlpath, tree)
+    return count
+
+
+@click.argument("publicdir", type=click.Path(dir_okay=True, exists=True, file_okay=False),
+                default="./public")
+@click.option("--dry/--wet", default=False, show_default=True)
+@click.option("--format", "formats", type=click.Choice(list(image_variant_formats.keys())),
+              multiple=True, default=["webp"], show_default=True)
+@click.option("--quality", type=int, default=80, show_default=True)
+@click.option("--rewrite/--no-rewrite", default=True, show_default=True, help="rewrite html to use <picture>")
+@click.option("--parallel", type=int, default=1, show_default=True)
+def static_image_variants(publicdir, dry, formats, quality, rewrite, parallel):
+    """static site: make webp/avif variants and rewrite html"""
+    from concurrent.futures import ThreadPoolExecutor
+    ignore_dirs = [".git"]
+    basedir = Path(publicdir)
+    images = list(find_files([basedir], ignore_dirs, [], image_variant_patterns))
+    total = {fmt: [0, 0, 0] for fmt in formats}   # files, bytes, variant bytes
+    with ThreadPoolExecutor(parallel) as executor:
+        futures = {executor.submit(may_imagevariant, filepath, fmt, quality, dry): (filepath, fmt)
+                   for filepath in images for fmt in formats}
+        for fut, (filepath, fmt) in futures.items():
+            try:
+                size = fut.result()
+            except Exception as e:
+                _log.warning("cannot convert %s to %s: %s", filepath, fmt, e)
+                continue
+            if size is not None:
+                total[fmt][0] += 1
+                total[fmt][1] += filepath.stat().st_size
+                total[fmt][2] += size
+    for fmt, (nfiles, nbytes, vbytes) in total.items():
+        click.echo(f"{fmt}: {nfiles} files, {nbytes} bytes -> {vbytes}")
+    if rewrite:
+        with ThreadPoolExecutor(parallel) as executor:
+            htmls = find_files([basedir], ignore_dirs, compress_ignore_files, ["*.html"])
+            count = sum(executor.map(lambda x: picture_rewrite(x, basedir, list(formats), dry), htmls))
+        click.echo(f"html: {count} images")
+
+
+def _box_mean(x, win: int):
+    import numpy as np
+    c = np.pad(x.cumsum(0).cumsum(1), ((1, 0), (1, 0)))
+    return (c[win:, win:] - c[:-win, win:] - c[win:, :-win] + c[:-win, :-win]) / (win * win)
+
+
+def ssim(a, b, win: int = 8) -> float:
+    """mean SSIM of two grayscale images (2d arrays of 0..255) with uniform window
+
+    >>> import numpy as np
+    >>> x = np.arange(256, dtype=float).reshape(16, 16)
+    >>> float(ssim(x, x))
+    1.0
+    >>> bool(ssim(x, x[::-1]) < 0.5)
+    True
+    """
+    import numpy as np
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    win = max(1, min(win, *a.shape))
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    mu_a, mu_b = _box_mean(a, win), _box_mean(b, win)
+    var_a = _box_mean(a * a, win) - mu_a * mu_a
+    var_b = _box_mean(b * b, win) - mu_b * mu_b
+    cov = _box_mean(a * b, win) - mu_a * mu_b
+    s = ((2 * mu_a * mu_b + c1) * (2 * cov + c2)) / ((mu_a * mu_a + mu_b * mu_b + c1) * (var_a + var_b + c2))
+    return float(s.mean())
+
+
+# format: (min quality, max quality)
+quality_range = {"JPEG": (10, 95), "PNG": (2, 256)}
+quality_patterns = ["*.png", "*.jpg", "*.jpeg"]
+
+
+def image_meta(img) -> dict:
+    """metadata to keep on re-encoding: EXIF (orientation) and ICC profile (colors)"""
+    return {k: img.info[k] for k in ("exif", "icc_profile") if img.info.get(k)}
+
+
+def _encode_quality(img, fmt: str, quality: int, meta: dict) -> bytes:
+    import io
+    from PIL import Image
+    buf = io.BytesIO()
+    if fmt == "JPEG":
+        img.convert("RGB").save(buf, format=fmt, quality=quality, optimize=True, progressive=True, **meta)
+    else:
+        method = Image.Quantize.FASTOCTREE if img.mode == "RGBA" else Image.Quantize.MEDIANCUT
+        img.quantize(colors=quality, method=method).save(buf, format=fmt, optimize=True, **meta)
+    return buf.getvalue()
+
+
+def may_imagequality(filepath: Path, target: float, dry: bool) -> Optional[tuple[int, int, int, float]]:
+    """binary search lowest encoder quality keeping SSIM >= target
+
+    returns (original size, new size, quality, ssim) or None if the file is kept"""
+    try:
+        import numpy as np
+        from PIL import Image
+    except ImportError:
+        _log.error("cannot import numpy/PIL: try 'pip install numpy pillow'")
+        raise
+    import io
+    data = filepath.read_bytes()
+    with Image.open(io.BytesIO(data)) as img:
+        fmt = img.format
+        if fmt not in quality_range:
+            _log.debug("not supported: %s %s", filepath, fmt)
+            return None
+        meta = image_meta(img)
+        if img.mode not in ("RGB", "RGBA", "L"):
+            img = img.convert("RGBA" if img.has_transparency_data else "RGB")
+        else:
+            img.load()
+    ref = np.asarray(img.convert("L"))
+    lo, hi = quality_range[fmt]
+    best = None
+    while lo <= hi:
+        q = (lo + hi) // 2
+        enc = _encode_quality(img, fmt, q, meta)
+        with Image.open(io.BytesIO(enc)) as dec:
+            score = ssim(ref, np.asarray(dec.convert("L")))
+        _log.debug("%s: quality=%d size=%d ssim=%.4f", filepath, q, len(enc), score)
+        if score >= target:
+            best = (q, score, enc)
+            hi = q - 1
+        else:
+            lo = q + 1
+    if best is None or len(best[2]) >= len(data):
+        _log.info("keep original: %s", filepath)
+        return None
+    q, score, enc = best
+    _log.info("quality(dry=%s): %s %s -> %s (quality=%d, ssim=%.4f)", dry, filepath, len(data), len(enc), q, score)
+    if not dry:
+        write_atomic(filepath, enc)
+    return len(data), len(enc), q, score
+
+
+@click.argument("publicdir", type=click.Path(dir_okay=True, exists=True, file_okay=False),
+                default="./public")
+@click.option("--dry/--wet", default=False, show_default=True)
+@click.option("--target", type=float, default=0.98, show_default=True, help="minimum SSIM to keep")
+@click.option("--parallel", type=int, default=os.cpu_count(), show_default=True)
+@click.option("--cache-dir", type=click.Path(file_okay=False),
+              help="cache of optimized images (required with --wet: records recompressed images)")
+@click.option("--report/--no-report", default=False, show_default=True, help="show result of each file")
+def static_image_quality(publicdir, dry, target, parallel, cache_dir, report):
+    """static site: lossy recompress images to target SSIM"""
+    from concurrent.futures import ProcessPoolExecutor
+    if not dry and not cache_dir:
+        # without record, next run recompresses lossy output and loses quality again
+        raise click.BadParameter("required with --wet", param_hint="--cache-dir")
+    mode = f"quality:{target}"
+    cache = None
+    if cache_dir:
+        cache = ImageOptCache(Path(cache_dir))
+    files: dict[Path, tuple[Optional[str], set[str]]] = {}
+    for filepath in find_files([Path(publicdir)], [".git"], [], quality_patterns):
+        digest = None
+        applied: set[str] = set()
+        if cache is not None:
+            digest = _digest(filepath.read_bytes())
+            applied, result = cache.get(digest)
+            if mode in applied:
+                if result != digest and cache.blob(result).exists():
+                    _log.info("restore from cache(%s): %s", mode, filepath)
+                    if not dry:
+                        replace_file(filepath, cache.blob(result))
+                continue
+        files[filepath] = (digest, applied)
+    nbytes, obytes, scores = 0, 0, []
+    with ProcessPoolExecutor(max(parallel, 1)) as executor:
+        futures = {executor.submit(may_imagequality, x, target, dry): x for x in files}
+        for fut, filepath in futures.items():
+            try:
+                res = fut.result()
+            except Exception as e:
+                _log.warning("cannot optimize %s: %s", filepath, e)
+                continue
+            if res is None:
+                size = filepath.stat().st_size
+                nbytes, obytes = nbytes + size, obytes + size
+            else:
+                nbytes, obytes = nbytes + res[0], obytes + res[1]
+                scores.append(res[3])
+                if report:
+                    click.echo(f"{filepath}: {res[0]} -> {res[1]} (quality={res[2]}, ssim={res[3]:.4f})")
+            if cache is not None and not dry:
+                data = filepath.read_bytes()
+                # shared with static-image-optimize: keep its modes
+                digest, applied = files[filepath]
+                cache.put(digest, applied | {mode}, _digest(data), data)
+    if cache is not None:
+        cache.save()
+    saved = nbytes - obytes
+    click.echo(f"{len(files)} files, {nbytes} bytes -> {obytes} (saved {saved}, {100 * saved / max(nbytes, 1):.1f}%)")
+    if scores:
+        click.echo(f"{len(scores)} recompressed, ssim min={min(scores):.4f} mean={sum(scores) / len(scores):.4f}")
+
+
+class InotifyWatcher:
+    """watch directory tree with inotify(7) via libc"""
+    IN_MODIFY = 0x2
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_FROM = 0x40
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_DELETE_SELF = 0x400
+    IN_ISDIR = 0x40000000
+    IN_Q_OVERFLOW = 0x4000
+    IN_IGNORED = 0x8000
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+    mask = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+
+    def __init__(self, basedir: Path, ignore_dirs: list[str]):
+        import ctypes
+        import ctypes.util
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = self.libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1")
+        self.basedir = basedir
+        self.ignore_dirs = ignore_dirs
+        self.wds: dict[int, Path] = {}
+        self.add_tree(basedir)
+
+    def close(self):
+        os.close(self.fd)
+
+    def add_tree(self, dirpath: Path) -> list[Path]:
+        """watch dirpath and its subdirectories. returns files already exists"""
+        import ctypes
+
+        def watch(root: Path):
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(root), self.mask)
+            if wd < 0:
+                _log.warning("cannot watch %s: %s", root, os.strerror(ctypes.get_errno()))
+                return
+            self.wds[wd] = root
+        return list(find_files([dirpath], self.ignore_dirs, [], ["*"], on_dir=watch))
+
+    def events(self, timeout: float) -> tuple[list[Path], list[Path]]:
+        """wait events. returns (written files, removed files)"""
+        import select
+        import struct
+        written, removed = [], []
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return written, removed
+        try:
+            buf = os.read(self.fd, 1024 * 1024)
+        except BlockingIOError:
+            return written, removed
+        ofs = 0
+        while ofs < len(buf):
+            wd, mask, _, length = struct.unpack_from("iIII", buf, ofs)
+            name = buf[ofs + 16:ofs + 16 + length].rstrip(b"\0")
+            ofs += 16 + length
+            if mask & self.IN_Q_OVERFLOW:
+                _log.warning("inotify queue overflow: rescan")
+                written.extend(self.add_tree(self.basedir))
+                continue
+            if mask & self.IN_IGNORED:
+                self.wds.pop(wd, None)
+                continue
+            root = self.wds.get(wd)
+            if root is None or not name:
+                continue
+            path = root / os.fsdecode(name)
+            if mask & self.IN_ISDIR:
+                if mask & (self.IN_CREATE | self.IN_MOVED_TO) and path.name not in self.ignore_dirs:
+                    written.extend(self.add_tree(path))
+            elif mask & (self.IN_CLOSE_WRITE | self.IN_MOVED_TO):
+                written.append(path)
+            elif mask & (self.IN_DELETE | self.IN_MOVED_FROM):
+                removed.append(path)
+        return written, removed
+
+
+class PollWatcher:
+    """watch directory tree by scanning periodically"""
+
+    def __init__(self, basedir: Path, ignore_dirs: list[str], interval: float = 2.0):
+        self.basedir = basedir
+        self.ignore_dirs = ignore_dirs
+        self.interval = interval
+        self.snapshot = self.scan()
+
+    def close(self):
+        pass
+
+    def scan(self) -> dict[Path, tuple[int, int]]:
+        return {p: (st.st_mtime_ns, st.st_size) for p, st, _ in scan_files([self.basedir], self.ignore_dirs, [], ["*"])}
+
+    def events(self, timeout: float) -> tuple[list[Path], list[Path]]:
+        import time
+        time.sleep(min(timeout, self.interval))
+        cur = self.scan()
+        written = [p for p, v in cur.items() if self.snapshot.get(p) != v]
+        removed = [p for p in self.snapshot.keys() if p not in cur]
+        self.snapshot = cur
+        return written, removed
+
+
+def make_watcher(basedir: Path, ignore_dirs: list[str], poll: bool = False, interval: float = 2.0):
+    if not poll:
+        try:
+            return InotifyWatcher(basedir, ignore_dirs)
+        except (OSError, AttributeError) as e:
+            _log.warning("inotify is not available(%s): use polling", e)
+    return PollWatcher(basedir, ignore_dirs, interval)
+
+
+def watch_tree(basedir: Path, codecs: list[Codec], settings: CompressSettings,
+               chain: Optional[list[ImageStep]], cache: Optional[ImageOptCache], debounce: float,
+               watcher, pool, stop, remove: bool = False):
+    """process files written under basedir until stop(threading.Event) is set"""
+    import time
+    import threading
+    pending: dict[Path, float] = {}
+    done: dict[Path, int] = {}   # mtime_ns after our processing
+    lock = threading.Lock()
+    image_patterns = sorted({p for x in chain for p in x[1]}) if chain else []
+
+    def process(filepath: Path):
+        try:
+            if match_name(filepath.name, compress_ignore_files, compress_file_patterns):
+                may_precomp(filepath, codecs, settings)
+            elif image_patterns and match_name(filepath.name, [], image_patterns):
+                may_imagechain([filepath], chain, settings.dry, cache)
+                if cache is not None:
+                    cache.save()
+            st = filepath.stat()
+            with lock:
+                done[filepath] = st.st_mtime_ns
+        except FileNotFoundError:
+            _log.debug("vanished: %s", filepath)
+        except Exception as e:
+            _log.warning("failed: %s: %s", filepath, e)
+
+    while not stop.is_set():
+        written, removed = watcher.events(debounce / 2)
+        now = time.monotonic()
+        for p in written:
+            if p.name.startswith("."):
+                continue
+            pending[p] = now
+        for p in removed:
+            pending.pop(p, None)
+            if remove and match_name(p.name, compress_ignore_files, compress_file_patterns):
+                for c in codecs:
+                    comp = p.with_suffix(p.suffix + c.ext)
+                    if comp.exists():
+                        may_remove(comp, c.ext, settings.dry)
+        ready = [p for p, t in pending.items() if now - t >= debounce]
+        for p in ready:
+            del pending[p]
+            try:
+                mtime_ns = p.stat().st_mtime_ns
+            except FileNotFoundError:
+                continue
+            with lock:
+                if done.get(p) == mtime_ns:
+                    # written by ourselves
+                    continue
+            _log.info("changed: %s", p)
+            pool.submit(process, p)
+
+
+@click.argument("publicdir", type=click.Path(dir_okay=True, exists=True, file_okay=False),
+                default="./public")
+@click.option("--minsize", type=int, default=1024*8, show_default=True)
+@click.option("--codec", multiple=True, default=["gzip", "brotli"], show_default=True,
+              help="codec[:minsize] (" + ", ".join(codec_ext.keys()) + ")")
+@click.option("--image-mode", help="comma separated image optimizers")
+@click.option("--cache-dir", type=click.Path(file_okay=False), help="cache of optimized images")
+@click.option("--dry/--wet", default=False, show_default=True)
+@click.option("--remove/--no-remove", default=False, show_default=True,
+              help="remove compressed files when original is removed")
+@click.option("--parallel", type=int, default=1, show_default=True)
+@click.option("--debounce", type=float, default=0.5, show_default=True, help="seconds to wait after last write")
+@click.option("--poll/--inotify", default=False, show_default=True)
+@click.option("--poll-interval", type=float, default=2.0, show_default=True)
+def static_watch(publicdir, minsize, codec, image_mode, cache_dir, dry, remove, parallel, debounce,
+                 poll, poll_interval):
+    """static site: compress/optimize files on write"""
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+    basedir = Path(publicdir)
+    codecs = [Codec(*parse_codec(x, minsize)) for x in codec]
+    if len({x.ext for x in codecs}) != len(codecs):
+        raise click.BadParameter("duplicate codec")
+    settings = CompressSettings(dry, stream_threshold=1024*1024*32, parallel=parallel)
+    chain = parse_imageopt_modes(image_mode) if image_mode else None
+    cache = ImageOptCache(Path(cache_dir)) if cache_dir else None
+    watcher = make_watcher(basedir, compress_ignore_dirs, poll, poll_interval)
+    stop = threading.Event()
+    click.echo(f"watching {basedir} ({type(watcher).__name__})")
+    with ThreadPoolExecutor(parallel) as pool:
+        try:
+            watch_tree(basedir, codecs, settings, chain, cache, debounce, watcher, pool, stop, remove)
+        except KeyboardInterrupt:
+            stop.set()
+        finally:
+            watcher.close()
+
+
+# root tag: (feed type, entry tag, date tags)
+feed_types = {
+    "rss": ("rss", "item", ["pubDate"]),
+    "{http://www.w3.org/1999/02/22-rdf-syntax-ns#}RDF": (
+        "rdf", "{http://purl.org/rss/1.0/}item", ["{http://purl.org/dc/elements/1.1/}date"]),
+    "{http://www.w3.org/2005/Atom}feed": (
+        "atom", "{http://www.w3.org/2005/Atom}entry",
+        ["{http://www.w3.org/2005/Atom}updated", "{http://www.w3.org/2005/Atom}published"]),
+}
+
+
+def _feed_date(text: Optional[str]):
+    """
+    >>> _feed_date("Thu, 06 Jun 2024 22:25:10 +0900").isoformat()
+    '2024-06-06T22:25:10+09:00'
+    >>> _feed_date("2024-06-06T22:25:10+09:00").isoformat()
+    '2024-06-06T22:25:10+09:00'
+    >>> _feed_date("xyz") is None
+    True
+    """
+    import datetime
+    import email.utils
+    if not text:
+        return None
+    text = text.strip()
+    try:
+        res = datetime.datetime.fromisoformat(text)
+    except ValueError:
+        try:
+            res = email.utils.parsedate_to_datetime(text)
+        except (TypeError, ValueError):
+            return None
+    if res.tzinfo is None:
+        res = res.astimezone()
+    return res
+
+
+def read_feed(input, limit: int = 0, since=None):
+    """parse rss/rdf/atom from binary file in single pass
+
+    root element decides the parser. entries over `limit` or older than `since` are dropped while parsing"""
+    import lxml.etree
+    import feedendum
+    import feedendum.rss
+    import feedendum.rdf
+    import feedendum.atom
+    parsers = {"rss": feedendum.rss.to_feed, "rdf": feedendum.rdf.to_feed, "atom": feedendum.atom.to_feed}
+    if since is not None and since.tzinfo is None:
+        since = since.astimezone()
+    root = None
+    ftype, entry_tag, date_tags = None, None, []
+    count = 0
+    try:
+        for event, elem in lxml.etree.iterparse(input, events=("start", "end"), resolve_entities=False):
+            if root is None:
+                root = elem
+                if elem.tag not in feed_types:
+                    raise click.Abort(f"unknown feed: {elem.tag}")
+                ftype, entry_tag, date_tags = feed_types[elem.tag]
+                _log.info("feed is %s", ftype)
+                continue
+            if event != "end" or elem.tag != entry_tag:
+                continue
+            keep = limit <= 0 or count < limit
+            if keep and since is not None:
+                for t in date_tags:
+                    dt = _feed_date(elem.findtext(t))
+                    if dt is not None:
+                        keep = dt >= since
+                        break
+            if keep:
+                count += 1
+            else:
+                elem.getparent().remove(elem)
+    except lxml.etree.XMLSyntaxError as e:
+        raise feedendum.exceptions.FeedXMLError("Not a valid XML document") from e
+    if root is None:
+        raise feedendum.exceptions.FeedXMLError("empty document")
+    _log.debug("%d entries", count)
+    try:
+        return parsers[ftype](root)
+    except feedendum.exceptions.FeedParseError as e:
+        raise click.Abort(f"cannot parse input xml: {e}")
+
+
+def write_feed(feed, format: str, pretty: bool) -> str:
+    import lxml.etree
+    import feedendum
+    if format == "atom":
+        outstr = feedendum.to_atom_string(feed)
+    elif format == "rss":
+        outstr = feedendum.to_rss_string(feed)
+    elif format == "rdf":
+        outstr = feedendum.to_rdf_string(feed)
+    else:
+        raise click.Abort(f"unknown format: {format}")
+    if pretty:
+        root = lxml.etree.fromstring(outstr.encode("utf-8"))
+        lxml.etree.indent(root)
+        outstr = lxml.etree.tostring(root, encoding="UTF-8", xml_declaration=True).decode("utf-8") + "\n"
+    return outstr
+
+
+def feed_option(func):
+    @click.option("--pretty/--compact", default=False, show_default=True)
+    @click.option("--format", type=click.Choice(["rss", "atom", "rdf"]),
+                  default="atom", show_default=True, help="output format")
+    @click.option("--limit", type=int, default=0, show_default=True, help="max entries (0: unlimited)")
+    @click.option("--since", type=click.DateTime(["%Y-%m-%d", "%Y-%m-%dT%H:%M:%S"]), help="drop older entries")
+    @functools.wraps(func)
+    def _(*args, **kwargs):
+        return func(*args, **kwargs)
+    return _
+
+
+@feed_option
+@click.argument("input", type=click.File('rb'), default="-")
+@click.argument("output", type=click.File('w'), default="-")
+def static_rss_atom(input, output, format, pretty, limit, since):
+    """static site: convert rss, rdf and atom"""
+    feed = read_feed(input, limit, since)
+    output.write(write_feed(feed, format, pretty))
+
+
+def convert_feed_file(filepath: Path, outpath: Path, format: str, pretty: bool, limit: int = 0, since=None):
+    with filepath.open("rb") as ifp:
+        feed = read_feed(ifp, limit, since)
+    write_atomic(outpath, write_feed(feed, format, pretty).encode("utf-8"))
+
+
+@feed_option
+@click.argument("publicdir", type=click.Path(dir_okay=True, exists=True, file_okay=False),
+                default="./public")
+@click.option("--pattern", default="index.xml", show_default=True)
+@click.option("--output-name", help="output file name in same directory (default: <format>.xml)")
+@click.option("--parallel", type=int, default=os.cpu_count(), show_default=True)
+def static_rss_atom_all(publicdir, pattern, output_name, format, pretty, limit, since, parallel):
+    """static site: convert all feeds (index.xml) under publicdir"""
+    from concurrent.futures import ProcessPoolExecutor
+    output_name = output_name or f"{format}.xml"
+    files = [x for x in find_files([Path(publicdir)], [".git"], [], [pattern]) if x.name != output_name]
+    nfiles = 0
+    with ProcessPoolExecutor(max(parallel, 1)) as executor:
+        futures = {executor.submit(convert_feed_file, x, x.with_name(output_name), format, pretty, limit, since): x
+                   for x in files}
+        for fut, filepath in futures.items():
+            try:
+                fut.result()
+                nfiles += 1
+            except Exception as e:
+                _log.warning("cannot convert %s: %r", filepath, e)
+    click.echo(f"{nfiles}/{len(files)} feeds converted")
+
+
+def bench_codec(spec: str) -> tuple[CompressFn, CompressFn]:
+    """codec-level for benchmark: gzip-9, zopfli, brotli-11, zstd-19, ...
+
+    >>> c, d = bench_codec("gzip-6")
+    >>> d(c(b"hello"))
+    b'hello'
+    """
+    name, _, level = spec.partition("-")
+    if name == "gzip":
+        return functools.partial(gzip.compress, compresslevel=int(level or 9)), gzip.decompress
+    elif name == "zopfli":
+        try:
+            import zopfli  # noqa: F401
+        except ImportError:
+            _log.error("cannot import zopfli: try 'pip install zopflipy'")
+            raise
+        return gzip_compressor(True), gzip.decompress
+    elif name == "brotli":
+        try:
+            import brotli
+        except ImportError:
+            _log.error("cannot import brotli: try 'pip install brotli'")
+            raise
+        return functools.partial(brotli.compress, quality=int(level or 11)), brotli.decompress
+    elif name == "zstd":
+        return zstd_codec(int(level or 19))
+    raise click.BadParameter(f"unknown codec: {spec}")
+
+
+size_buckets = [1024, 8 * 1024, 64 * 1024, 512 * 1024, 4 * 1024 * 1024]
+
+
+def size_bucket(size: int) -> str:
+    """
+    >>> size_bucket(100), size_bucket(1024), size_bucket(10000), size_bucket(10 ** 8)
+    ('<1K', '<8K', '<64K', '>=4M')
+    """
+    def human(n: int) -> str:
+        return f"{n // (1024 * 1024)}M" if n >= 1024 * 1024 else f"{n // 1024}K"
+    for b in size_buckets:
+        if size < b:
+            return "<" + human(b)
+    return ">=" + human(size_buckets[-1])
+
+
+def compress_report(files: list[Path], codecs: dict[str, tuple[CompressFn, CompressFn]]) -> list[dict]:
+    """compress/decompress files with codecs, aggregate by extension and size bucket"""
+    import time
+    total: dict[tuple[str, str, str], list] = {}
+    for filepath in files:
+        data = filepath.read_bytes()
+        keys = [("ext", filepath.suffix or filepath.name), ("size", size_bucket(len(data))), ("all", "")]
+        for name, (compressfn, decompressfn) in codecs.items():
+            start = time.perf_counter()
+            comp = compressfn(data)
+            ctime = time.perf_counter() - start
+            start = time.perf_counter()
+            decompressfn(comp)
+            dtime = time.perf_counter() - start
+            for group, key in keys:
+                ent = total.setdefault((group, key, name), [0, 0, 0, 0.0, 0.0])
+                ent[0] += 1
+                ent[1] += len(data)
+                ent[2] += len(comp)
+                ent[3] += ctime
+                ent[4] += dtime
+    res = []
+    for (group, key, name), (nfiles, nbytes, cbytes, ctime, dtime) in total.items():
+        res.append({
+            "group": group, "key": key, "codec": name, "files": nfiles, "bytes": nbytes, "compressed": cbytes,
+            "ratio": cbytes / nbytes if nbytes else 1.0, "compress_sec": ctime, "decompress_sec": dtime})
+    order = {"ext": 0, "size": 1, "all": 2}
+    bucket_order = {size_bucket(x): i for i, x in enumerate([0] + size_buckets)}
+    res.sort(key=lambda x: (order[x["group"]], bucket_order.get(x["key"], 0), x["key"], list(codecs).index(x["codec"])))
+    return res
+
+
+@click.argument("publicdir", type=click.Path(dir_okay=True, exists=True, file_okay=False),
+                default="./public")
+@click.option("--codec", multiple=True, show_default=True,
+              default=["gzip-9", "zopfli", "brotli-5", "brotli-9", "brotli-11", "zstd-3", "zstd-19"])
+@click.option("--sample", type=int, default=200, show_default=True, help="number of files (0: all)")
+@click.option("--format", type=click.Choice(["table", "json"]), default="table", show_default=True)
+def static_compress_report(publicdir, codec, sample, format):
+    """static site: benchmark codecs by extension and size"""
+    import json
+    import random
+    files = sorted(find_files([Path(publicdir)], compress_ignore_dirs, compress_ignore_files, compress_file_patterns))
+    if sample > 0 and len(files) > sample:
+        files = sorted(random.Random(0).sample(files, sample))
+    codecs = {}
+    for spec in codec:
+        try:
+            codecs[spec] = bench_codec(spec)
+        except ImportError:
+            _log.warning("skip %s", spec)
+    res = compress_report(files, codecs)
+    if format == "json":
+        click.echo(json.dumps(res, indent=2))
+        return
+    click.echo("%-5s %-10s %-10s %6s %12s %12s %6s %9s %9s" % (
+        "group", "key", "codec", "files", "bytes", "compressed", "ratio", "comp MB/s", "dec MB/s"))
+    for r in res:
+        mb = r["bytes"] / 1024 / 1024
+        click.echo("%-5s %-10s %-10s %6d %12d %12d %6.3f %9.1f %9.1f" % (
+            r["group"], r["key"], r["codec"], r["files"], r["bytes"], r["compressed"], r["ratio"],
+            mb / max(r["compress_sec"], 1e-9), mb / max(r["decompress_sec"], 1e-9)))
+
+
+fingerprint_len = 10
+fingerprint_re = re.compile(r"\.[0-9a-f]{%d}\.[^.]+$" % fingerprint_len)
+fingerprint_patterns = ["*.css", "*.js", "*.png", "*.jpg", "*.jpeg", "*.gif", "*.svg", "*.webp", "*.avif",
+                        "*.ico", "*.woff", "*.woff2", "*.ttf"]
+css_url_re = re.compile(r"""(url\(\s*["']?|@import\s+["'])([^"')\s]+)""")
+html_url_re = re.compile(r"""((?:src|href|poster)\s*=\s*["'])([^"']+)""")
+html_url_attrs = ["src", "href", "poster", "data-src"]
+# state of worker processes: (basedir, url prefix, base url, mapping)
+_fingerprint_state: tuple = ()
+
+
+def fingerprint_name(filepath: Path, digest: str) -> str:
+    """
+    >>> fingerprint_name(Path("css/main.css"), "0123456789abcdef")
+    'main.0123456789.css'
+    >>> fingerprint_name(Path("a.png.webp"), "0123456789abcdef")
+    'a.png.0123456789.webp'
+    """
+    return filepath.stem + "." + digest[:fingerprint_len] + filepath.suffix
+
+
+def _fingerprint_init(basedir: Path, base_url: str, mapping: dict[str, str]):
+    import urllib.parse
+    global _fingerprint_state
+    prefix = urllib.parse.urlsplit(base_url).path if base_url else "/"
+    _fingerprint_state = (basedir, prefix.rstrip("/") + "/", base_url, mapping)
+
+
+def fingerprint_url(url: str, docpath: Path) -> str:
+    """url of fingerprinted asset, if url points to renamed asset"""
+    import posixpath
+    import urllib.parse
+    basedir, prefix, base_url, mapping = _fingerprint_state
+    u = urllib.parse.urlsplit(url)
+    path = urllib.parse.unquote(u.path)
+    if u.scheme or u.netloc:
+        if not base_url or not url.startswith(base_url):
+            return url
+    if not path:
+        return url
+    if path.startswith("/"):
+        if not path.startswith(prefix):
+            return url
+        rel = path[len(prefix):]
+    else:
+        rel = posixpath.join(docpath.parent.relative_to(basedir).as_posix(), path)
+    rel = posixpath.normpath(rel)
+    newname = mapping.get(rel)
+    if newname is None:
+        return url
+    newpath = u.path[:u.path.rfind("/") + 1] + urllib.parse.quote(newname)
+    return urllib.parse.urlunsplit(u._replace(path=newpath))
+
+
+def _fingerprint_text(regex: re.Pattern, text: str, docpath: Path) -> str:
+    return regex.sub(lambda m: m.group(1) + fingerprint_url(m.group(2), docpath), text)
+
+
+def _fingerprint_srcset(srcset: str, docpath: Path) -> str:
+    res = []
+    for ent in srcset.split(","):
+        parts = ent.strip().split(None, 1)
+        if parts:
+            parts[0] = fingerprint_url(parts[0], docpath)
+        res.append(" ".join(parts))
+    return ", ".join(res)
+
+
+def fingerprint_doc(docpath: Path, dry: bool) -> bool:
+    """rewrite references in html/css/xml to fingerprinted names. returns True if changed"""
+    import lxml.etree
+    import lxml.html
+    if docpath.suffix == ".css":
+        text = docpath.read_text(errors="surrogateescape")
+        newtext = _fingerprint_text(css_url_re, text, docpath)
+        changed = text != newtext
+        if changed and not dry:
+            write_atomic(docpath, newtext.encode(errors="surrogateescape"))
+        return changed
+    changed = False
+
+    def update(el, attr: str, value: str):
+        nonlocal changed
+        if value != el.get(attr):
+            el.set(attr, value)
+            changed = True
+    if docpath.suffix == ".html":
+        tree = lxml.html.parse(str(docpath))
+        for el in tree.iter(lxml.etree.Element):
+            for attr in html_url_attrs:
+                if attr in el.attrib:
+                    update(el, attr, fingerprint_url(el.get(attr), docpath))
+            for attr in ("srcset", "data-srcset"):
+                if attr in el.attrib:
+                    update(el, attr, _fingerprint_srcset(el.get(attr), docpath))
+            if "style" in el.attrib:
+                update(el, "style", _fingerprint_text(css_url_re, el.get("style"), docpath))
+            if el.tag == "style" and el.text:
+                text = _fingerprint_text(css_url_re, el.text, docpath)
+                changed, el.text = changed or text != el.text, text
+        if changed and not dry:
+            write_html(docpath, tree)
+        return changed
+    # xml: attributes and texts which are urls, escaped html in texts (feeds)
+    tree = lxml.etree.parse(str(docpath), lxml.etree.XMLParser(resolve_entities=False))
+    for el in tree.iter(lxml.etree.Element):
+        for attr, value in el.attrib.items():
+            update(el, attr, fingerprint_url(value, docpath))
+        if el.text and el.text.strip():
+            if "<" in el.text:
+                text = _fingerprint_text(html_url_re, el.text, docpath)
+            else:
+                text = fingerprint_url(el.text.strip(), docpath)
+                text = el.text if text == el.text.strip() else text
+            changed, el.text = changed or text != el.text, text
+    if changed and not dry:
+        write_atomic(docpath, lxml.etree.tostring(
+            tree, encoding=tree.docinfo.encoding or "utf-8", xml_declaration=True))
+    return changed
+
+
+def _fingerprint_docs(docs: list[Path], dry: bool) -> int:
+    return sum(fingerprint_doc(x, dry) for x in docs)
+
+
+def _hash_assets(basedir: Path, files: list[Path]) -> dict[str, str]:
+    import hashlib
+    res = {}
+    for filepath in files:
+        if fingerprint_re.search(filepath.name):
+            continue
+        with filepath.open("rb") as ifp:
+            digest = hashlib.file_digest(ifp, "sha256").hexdigest()
+        res[filepath.relative_to(basedir).as_posix()] = fingerprint_name(filepath, digest)
+    return res
+
+
+nginx_fingerprint_conf = """# generated by static-fingerprint: include in http context, then add
+#   add_header Cache-Control $fingerprint_cache_control;
+# to the location of the site
+map $uri $fingerprint_cache_control {
+    default "";
+    "~\\.[0-9a-f]{%d}\\.[0-9a-z]+$" "public, max-age=31536000, immutable";
+}
+"""
+
+
+@click.argument("publicdir", type=click.Path(dir_okay=True, exists=True, file_okay=False),
+                default="./public")
+@click.option("--dry/--wet", default=False, show_default=True)
+@click.option("--pattern", multiple=True, default=fingerprint_patterns, show_default=True)
+@click.option("--base-url", help="absolute urls with this prefix are local (e.g. https://example.com/hugo/)")
+@click.option("--keep-original/--no-keep-original", default=True, show_default=True,
+              help="keep original names as hardlinks (for references from js or other sites)")
+@click.option("--nginx-conf", type=click.Path(dir_okay=False), help="write nginx snippet to set Cache-Control")
+@click.option("--parallel", type=int, default=os.cpu_count(), show_default=True)
+def static_fingerprint(publicdir, dry, pattern, base_url, keep_original, nginx_conf, parallel):
+    """static site: rename assets to content hashed names (run before compress)"""
+    from concurrent.futures import ProcessPoolExecutor
+    basedir = Path(publicdir)
+    assets = list(find_files([basedir], compress_ignore_dirs, compress_ignore_files, list(pattern)))
+    css = [x for x in assets if x.suffix == ".css"]
+    # css refers other assets: rewrite and hash after them
+    mapping = _hash_assets(basedir, [x for x in assets if x.suffix != ".css"])
+    ndocs = 0
+    nproc = max(parallel, 1)
+
+    def rewrite(docs: list[Path]) -> int:
+        if not docs:
+            return 0
+        chunks = [docs[i::nproc * 4] for i in range(min(len(docs), nproc * 4))]
+        with ProcessPoolExecutor(nproc, initializer=_fingerprint_init,
+                                 initargs=(basedir, base_url, mapping)) as executor:
+            return sum(executor.map(_fingerprint_docs, chunks, [dry] * len(chunks)))
+    ndocs += rewrite(css)
+    mapping.update(_hash_assets(basedir, css))
+    ndocs += rewrite(list(find_files([basedir], compress_ignore_dirs, compress_ignore_files, ["*.html", "*.xml"])))
+    nlinks = 0
+    for rel, newname in mapping.items():
+        src = basedir / rel
+        dst = src.with_name(newname)
+        if dst.exists():
+            continue
+        _log.info("fingerprint(dry=%s): %s -> %s", dry, rel, newname)
+        nlinks += 1
+        if dry:
+            continue
+        if keep_original:
+            os.link(src, dst)
         else:
-            executor = ThreadPoolExecutor(parallel)
-            for filepath in find_files([basedir], ignore_dirs, ignore_files, file_patterns):
-                executor.submit(may_imagecomp, filepath, command, dry)
-            executor.shutdown()
+            os.rename(src, dst)
+    if nginx_conf and not dry:
+        Path(nginx_conf).write_text(nginx_fingerprint_conf % fingerprint_len)
+    click.echo(f"fingerprint: {len(mapping)} assets ({nlinks} new), {ndocs} documents rewritten")
@@ -3,6 +3,8 @@ import click
 from pathlib import Path
 import functools
 import fnmatch
+import os
+import re
 import importlib
 import json
 import yaml
@@ -13,7 +15,7 @@ import datetime
 import jinja2
 import sqlite3
 import importlib.resources
-from typing import TextIO
+from typing import TextIO, Iterator, Optional, Callable
 
 _log = getLogger(__name__)
 
@@ -28,25 +30,98 @@ def sqlite_option(func):
     return _
 
 
-def find_files(rootdirs: list[Path], ignore_dirs: list[str], ignore_files: list[str], pattern: list[str]):
-    for r in rootdirs:
-        for root, dirs, files in r.walk():
-            for i in ignore_dirs:
-                if i in dirs:
-                    _log.debug("skip %s %s", root, i)
-                    dirs.remove(i)
-            for i in files:
-                for p in ignore_files:
-                    if fnmatch.fnmatch(i, p):
-                        _log.debug("ignore %s %s", root, i)
-                        break
-                else:
-                    for p in pattern:
-                        if fnmatch.fnmatch(i, p):
-                            yield root / i
-                            break
-                    else:
-                        _log.debug("pass %s %s", root, i)
+def compile_globs(patterns: list[str]) -> Optional[re.Pattern]:
+    """compile glob patterns into single regex (None: empty)
+
+    >>> compile_globs(["*.html", "*.css"]).match("a.css") is not None
+    True
+    >>> compile_globs(["*.html", "*.css"]).match("a.css.gz") is None
+    True
+    >>> compile_globs([]) is None
+    True
+    """
+    if not patterns:
+        return None
+    return re.compile("|".join(fnmatch.translate(x) for x in patterns))
+
+
+@functools.lru_cache
+def _compile_globs_cached(patterns: tuple[str, ...]) -> Optional[re.Pattern]:
+    return compile_globs(list(patterns))
+
+
+def match_name(name: str, ignore_files: list[str], pattern: list[str]) -> bool:
+    """same rule as find_files for single name
+
+    >>> match_name("a.html", ["*.gz"], ["*.html"])
+    True
+    >>> match_name("a.html.gz", ["*.gz"], ["*.html", "*.gz"])
+    False
+    """
+    ignore_re = _compile_globs_cached(tuple(ignore_files))
+    if ignore_re is not None and ignore_re.match(name):
+        return False
+    include_re = _compile_globs_cached(tuple(pattern))
+    return include_re is not None and include_re.match(name) is not None
+
+
+def _scan(rootdirs: list[Path], ignore_dirs: list[str], ignore_files: list[str], pattern: list[str],
+          orphan_pattern: Optional[list[str]] = None,
+          on_dir: Optional[Callable[[Path], None]] = None) -> Iterator[tuple[Path, os.DirEntry, bool]]:
+    # same order as Path.walk(top_down=True): files in a directory, then its subdirectories
+    ignore_dir_set = set(ignore_dirs)
+    ignore_re = compile_globs(ignore_files)
+    include_re = compile_globs(pattern)
+    orphan_re = compile_globs(orphan_pattern or [])
+    stack = list(reversed(rootdirs))
+    while stack:
+        root = stack.pop()
+        subdirs = []
+        try:
+            with os.scandir(root) as it:
+                entries = list(it)
+        except OSError as e:
+            _log.debug("cannot scan %s: %s", root, e)
+            continue
+        if on_dir is not None:
+            on_dir(root)
+        for ent in entries:
+            try:
+                is_dir = ent.is_dir()
+            except OSError:
+                is_dir = False
+            if is_dir:
+                if ent.name not in ignore_dir_set and not ent.is_symlink():
+                    subdirs.append(root / ent.name)
+                continue
+            name = ent.name
+            if include_re is not None and include_re.match(name) and not (ignore_re and ignore_re.match(name)):
+                yield root / name, ent, False
+            elif orphan_re is not None and orphan_re.match(name):
+                yield root / name, ent, True
+        stack.extend(reversed(subdirs))
+
+
+def scan_files(rootdirs: list[Path], ignore_dirs: list[str], ignore_files: list[str], pattern: list[str],
+               orphan_pattern: Optional[list[str]] = None,
+               on_dir: Optional[Callable[[Path], None]] = None) -> Iterator[tuple[Path, os.stat_result, bool]]:
+    """walk directories once with os.scandir, yields (path, stat, orphan)
+
+    files matching pattern (and not ignore_files) are yielded with orphan=False.
+    other files matching orphan_pattern are yielded with orphan=True.
+    on_dir is called with each directory before its files
+    """
+    for path, ent, orphan in _scan(rootdirs, ignore_dirs, ignore_files, pattern, orphan_pattern, on_dir):
+        try:
+            yield path, ent.stat(), orphan
+        except FileNotFoundError:
+            _log.debug("vanished: %s", path)
+
+
+def find_files(rootdirs: list[Path], ignore_dirs: list[str], ignore_files: list[str], pattern: list[str],
+               on_dir: Optional[Callable[[Path], None]] = None):
+    for path, _, _ in _scan(rootdirs, ignore_dirs, ignore_files, pattern, on_dir=on_dir):
+        yield path
 
 
 def json_serial(obj):
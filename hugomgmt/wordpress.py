@@ -7,7 +7,8 @@ import mysql.connector as mydb
 import datetime
 import uuid
 import requests
-from typing import Optional
+import urllib3
+from typing import Optional, Iterator, Union, NamedTuple
 from pathlib import Path
 from .util import make_template, sqlite_option, file_or_resource
 from logging import getLogger
@@ -44,18 +45,224 @@ def template_option(func):
     @click.option("--template", envvar="WP_POST_TEMPLATE", default="template/post.md.j2", show_default=True)
     @functools.wraps(func)
     def _(template, *args, **kwargs):
+        # source, not jinja template: templates cannot be pickled and worker processes build their own
         fp = file_or_resource(template)
-        tmpl = make_template(fp.read())
-        return func(template=tmpl, *args, **kwargs)
+        return func(template_source=fp.read(), *args, **kwargs)
     return _
 
 
+Asset = Union[bytes, Path]
+
+
+class AssetCache:
+    """downloaded assets on disk, survives across runs
+
+    objects/xx/<sha256>: content, index.db: url -> (sha256, size, etag, last-modified)
+    """
+
+    def __init__(self, cachedir: Path):
+        import sqlite3
+        import threading
+        self.cachedir = cachedir
+        self.objdir = cachedir / "objects"
+        self.objdir.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        # shared by fetcher threads (--jobs workers do not fetch: see DeferredFetcher)
+        self.conn = sqlite3.connect(cachedir / "index.db", timeout=60, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS assets (url TEXT PRIMARY KEY, digest TEXT, size INTEGER,"
+            " etag TEXT, last_modified TEXT)")
+        self.conn.commit()
+
+    def path(self, digest: str) -> Path:
+        return self.objdir / digest[:2] / digest
+
+    def get(self, url: str) -> Optional[tuple[str, Optional[str], Optional[str]]]:
+        """(digest, etag, last-modified) if cached content exists"""
+        with self.lock:
+            res = self.conn.execute(
+                "SELECT digest, size, etag, last_modified FROM assets WHERE url = ?", (url, )).fetchone()
+        if res is None:
+            return None
+        digest, size, etag, last_modified = res
+        objpath = self.path(digest)
+        if not objpath.exists() or objpath.stat().st_size != size:
+            _log.warning("broken cache: %s", url)
+            return None
+        return digest, etag, last_modified
+
+    def put(self, url: str, chunks: Iterator[bytes], etag: Optional[str], last_modified: Optional[str]) -> Path:
+        """stream content to cache. returns path of the content"""
+        import hashlib
+        import tempfile
+        import os
+        digester = hashlib.sha256()
+        size = 0
+        fd, tmpname = tempfile.mkstemp(dir=self.objdir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as ofp:
+                for chunk in chunks:
+                    digester.update(chunk)
+                    ofp.write(chunk)
+                    size += len(chunk)
+            digest = digester.hexdigest()
+            objpath = self.path(digest)
+            objpath.parent.mkdir(exist_ok=True)
+            os.replace(tmpname, objpath)
+        except Exception:
+            Path(tmpname).unlink(missing_ok=True)
+            raise
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO assets (url, digest, size, etag, last_modified) VALUES (?, ?, ?, ?, ?)",
+                (url, digest, size, etag, last_modified))
+            self.conn.commit()
+        return objpath
+
+
+# body interrupted while streaming: ChunkedEncodingError (urllib3 ProtocolError if raised directly)
+_retry_errors = (requests.ConnectionError, requests.Timeout, requests.HTTPError,
+                 requests.exceptions.ChunkedEncodingError, urllib3.exceptions.ProtocolError)
+
+
+class AssetFetcher:
+    """fetch assets in parallel with pooled connections
+
+    per_host: max concurrent requests to one host
+    bandwidth: total bytes/sec of all downloads (0: unlimited)
+    retries: retry connection errors and 429/5xx with exponential backoff
+    cache_dir: keep downloaded assets in AssetCache. cached assets are returned as Path
+    revalidate: send conditional request (ETag/Last-Modified) for cached assets (False: no request)
+    """
+
+    def __init__(self, parallel: int = 8, per_host: int = 4, timeout: float = 30, retries: int = 3,
+                 backoff: float = 0.5, bandwidth: int = 0, cache_dir: Optional[str] = None,
+                 revalidate: bool = False):
+        import threading
+        self.parallel = max(parallel, 1)
+        self.per_host = max(per_host, 1)
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.bandwidth = bandwidth
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=self.parallel, pool_maxsize=self.parallel)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.lock = threading.Lock()
+        self.hosts: dict[str, threading.Semaphore] = {}
+        self.next_slot = 0.0
+        self.cache = AssetCache(Path(cache_dir)) if cache_dir else None
+        self.revalidate = revalidate
+
+    def _host(self, url: str):
+        import threading
+        host = urllib.parse.urlsplit(url).netloc
+        with self.lock:
+            if host not in self.hosts:
+                self.hosts[host] = threading.BoundedSemaphore(self.per_host)
+            return self.hosts[host]
+
+    def _throttle(self, size: int):
+        """wait until `size` bytes fit in bandwidth"""
+        import time
+        if self.bandwidth <= 0:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.next_slot = max(self.next_slot, now) + size / self.bandwidth
+            wait = self.next_slot - now
+        time.sleep(wait)
+
+    def _chunks(self, res: requests.Response) -> Iterator[bytes]:
+        for chunk in res.iter_content(64 * 1024):
+            self._throttle(len(chunk))
+            yield chunk
+
+    def _get(self, url: str) -> Optional[Asset]:
+        headers = {}
+        cached = self.cache.get(url) if self.cache is not None else None
+        if cached is not None:
+            digest, etag, last_modified = cached
+            if not self.revalidate:
+                _log.debug("cached: %s", url)
+                return self.cache.path(digest)
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+        with self._host(url):
+            with self.session.get(url, timeout=self.timeout, stream=True, headers=headers) as res:
+                if res.status_code == 429 or res.status_code >= 500:
+                    raise requests.HTTPError(f"status {res.status_code}", response=res)
+                if res.status_code == 304 and cached is not None:
+                    _log.debug("not modified: %s", url)
+                    return self.cache.path(cached[0])
+                if res.status_code != 200:
+                    _log.warning("cannot get asset: %s: status %s", url, res.status_code)
+                    return None
+                if self.cache is not None:
+                    return self.cache.put(url, self._chunks(res), res.headers.get("ETag"),
+                                          res.headers.get("Last-Modified"))
+                return b"".join(self._chunks(res))
+
+    def fetch(self, url: str) -> Optional[Asset]:
+        import time
+        for i in range(self.retries + 1):
+            try:
+                _log.debug("fetch %s", url)
+                return self._get(url)
+            except _retry_errors as e:
+                if i == self.retries:
+                    _log.warning("cannot get asset: %s: %s", url, e)
+                    break
+                _log.info("retry %s: %s", url, e)
+                time.sleep(self.backoff * 2 ** i)
+        return None
+
+    def fetch_all(self, urls: list[str]) -> dict[str, Optional[Asset]]:
+        from concurrent.futures import ThreadPoolExecutor
+        urls = list(dict.fromkeys(urls))
+        if len(urls) <= 1:
+            return {x: self.fetch(x) for x in urls}
+        with ThreadPoolExecutor(min(self.parallel, len(urls))) as executor:
+            return dict(zip(urls, executor.map(self.fetch, urls)))
+
+
+class RemoteAsset(NamedTuple):
+    """asset to be fetched later (by the process which owns the AssetFetcher)"""
+    url: str
+
+
+class DeferredFetcher:
+    """fetcher of worker processes: limits of AssetFetcher apply to all workers only if one process fetches"""
+
+    def fetch_all(self, urls: list[str]) -> dict[str, RemoteAsset]:
+        return {x: RemoteAsset(x) for x in urls}
+
+
+def fetch_assets(fetcher: AssetFetcher, assets: dict[str, Union[Asset, RemoteAsset]]) -> dict[str, Asset]:
+    """fetch deferred assets. assets which cannot be fetched are dropped"""
+    remote = fetcher.fetch_all([x.url for x in assets.values() if isinstance(x, RemoteAsset)])
+    res = {}
+    for k, v in assets.items():
+        if isinstance(v, RemoteAsset):
+            v = remote.get(v.url)
+        if v:
+            res[k] = v
+    return res
+
+
 class WP:
     replacer = {}
+    select_batch = 100
 
-    def __init__(self, conn, baseurl=None, path=None, uploads_dir=None, copy_resource=False):
+    def __init__(self, conn, baseurl=None, path=None, uploads_dir=None, copy_resource=False,
+                 fetcher: Union[AssetFetcher, DeferredFetcher, None] = None):
         self.conn = conn
-        self.cur = conn.cursor()
+        self.fetcher = fetcher or AssetFetcher()
+        # conn=None: no database (worker process with primed permalink/categorymap)
+        self.cur = conn.cursor() if conn is not None else None
         self.wp_baseurl = baseurl
         self.hugo_path = path
         self.copy_resource = copy_resource
@@ -83,6 +290,29 @@ class WP:
         keys = [x[0] for x in self.cur.description]
         return [dict(zip(keys, one)) for one in self.cur.fetchall()]
 
+    def select_iter(self, table, key="ID", batch: Optional[int] = None, **kwargs) -> Iterator[dict]:
+        """stream rows ordered by `key` with keyset pagination
+
+        only one page of rows (as tuples) is held at a time, and the cursor is free between pages
+        """
+        _log.debug("SELECT(ITER): %s, key=%s, args=%s", table, key, kwargs)
+        qargs = [f'{k} = %s' for k in kwargs.keys()]
+        q = f'SELECT * FROM {table} WHERE ' + ' AND '.join(qargs + [f'{key} > %s'])
+        q += f' ORDER BY {key} LIMIT %s'
+        batch = batch or self.select_batch
+        last = -1
+        while True:
+            self.cur.execute(q, (*kwargs.values(), last, batch))
+            keys = [x[0] for x in self.cur.description]
+            rows = self.cur.fetchall()
+            if len(rows) == 0:
+                return
+            last = rows[-1][keys.index(key)]
+            for row in rows:
+                yield dict(zip(keys, row))
+            if len(rows) < batch:
+                return
+
     def select_one(self, table, **kwargs):
         _log.debug("SELECT(1): %s, args=%s", table, kwargs)
         args = tuple(kwargs.values())
@@ -108,8 +338,8 @@ class WP:
         if res:
             return res["option_value"]
 
-    def posts(self):
-        return self.select('wp_posts', post_status="publish", post_type="post")
+    def posts(self) -> Iterator[dict]:
+        return self.select_iter('wp_posts', post_status="publish", post_type="post")
 
     def get_post(self, id: int):
         return self.select_one('wp_posts', id=id)
@@ -120,8 +350,22 @@ class WP:
     def get_comment(self, post_id: int):
         return self.select('wp_comments', comment_post_ID=post_id)
 
-    def pages(self):
-        return self.select('wp_posts', post_status="publish", post_type="page")
+    def comments_by_post(self) -> dict[int, list[dict]]:
+        res: dict[int, list[dict]] = {}
+        for c in self.comments():
+            res.setdefault(c["comment_post_ID"], []).append(c)
+        return res
+
+    def comment_posts(self) -> dict[int, dict]:
+        """metadata (without content) of posts which have approved comments, in single query"""
+        rows = self.select_raw(
+            'SELECT DISTINCT p.ID, p.post_date, p.post_name, p.post_title, p.post_status, p.post_type,'
+            ' p.post_author FROM wp_posts AS p INNER JOIN wp_comments AS c ON c.comment_post_ID = p.ID'
+            ' WHERE c.comment_approved = %s', ("1", ))
+        return {x["ID"]: self.convert_post_meta(x) for x in rows}
+
+    def pages(self) -> Iterator[dict]:
+        return self.select_iter('wp_posts', post_status="publish", post_type="page")
 
     def get_page(self, id: int):
         return self.select_one('wp_posts', id=id)
@@ -151,9 +395,29 @@ class WP:
         return res
 
     def download_replace(self, htmlstr: str, baseurl: str, replace_to: str = "./",
-                         filepath: Optional[Path] = None) -> tuple[str, dict[str, bytes]]:
-        # returns replaced-html, assets(filename:content)
+                         filepath: Optional[Path] = None) -> tuple[str, dict[str, Asset]]:
+        # returns replaced-html, assets(filename:content or path of content)
         root = lxml.html.fromstring(htmlstr)
+        targets = [(tag, "src") for tag in root.xpath(f"//img[starts-with(@src, '{baseurl}')]")]
+        targets.extend((tag, "href") for tag in root.xpath(f"//a[starts-with(@href, '{baseurl}')]"))
+        contents: dict[str, Optional[Asset]] = {}
+        remote = []
+        for tag, attr in targets:
+            url = tag.attrib[attr]
+            if url in contents:
+                continue
+            contents[url] = None
+            if filepath:
+                relative_url = Path(urllib.parse.unquote(url)).relative_to(baseurl)
+                target_file = filepath / relative_url
+                if target_file.exists():
+                    _log.debug("file exists. copy it: %s", target_file)
+                    contents[url] = target_file
+                    continue
+                _log.debug("file does not exists: %s", target_file)
+            remote.append(url)
+        # fetch all assets of the post at once
+        contents.update(self.fetcher.fetch_all(remote))
         urlmap = {}   # url: (filename, content)
 
         def update_urlmap(url: str) -> str:
@@ -161,47 +425,31 @@ class WP:
             if url in urlmap:
                 # duplicate
                 _log.debug("alread downloaded: %s", url)
-                new_url = urlmap[url][0]
-            else:
-                new_url = replace_to + url.rsplit("/", 1)[-1]
-                if new_url in dict(urlmap.values()):
-                    new_url = replace_to + str(uuid.uuid4()) + Path(new_url).suffix
-                content = None
-                if filepath:
-                    relative_url = Path(urllib.parse.unquote(url)).relative_to(baseurl)
-                    target_file = filepath / relative_url
-                    if target_file.exists():
-                        _log.debug("file exists. read it: %s -> %s", target_file, new_url)
-                        content = target_file.read_bytes()
-                    else:
-                        _log.debug("file does not exists: %s -> %s", target_file, new_url)
-                if content is None:
-                    _log.debug("fetch %s -> %s", url, new_url)
-                    res = requests.get(url)
-                    if res.status_code == 200:
-                        content = res.content
-                    else:
-                        _log.warning("cannot get asset: %s -> %s", url, new_url)
-                if content:
-                    urlmap[url] = (new_url, content)
+                return urlmap[url][0]
+            new_url = replace_to + url.rsplit("/", 1)[-1]
+            if new_url in dict(urlmap.values()):
+                new_url = replace_to + str(uuid.uuid4()) + Path(new_url).suffix
+            if contents.get(url):
+                urlmap[url] = (new_url, contents[url])
             return new_url
 
-        for tag in root.xpath(f"//img[starts-with(@src, '{baseurl}')]"):
-            burl = tag.attrib["src"]
-            tag.attrib["src"] = update_urlmap(burl)
-        for tag in root.xpath(f"//a[starts-with(@href, '{baseurl}')]"):
-            burl = tag.attrib["href"]
-            tag.attrib["href"] = update_urlmap(burl)
+        for tag, attr in targets:
+            tag.attrib[attr] = update_urlmap(tag.attrib[attr])
         return lxml.etree.tostring(root, encoding="utf-8").decode("utf-8"), dict(urlmap.values())
 
-    def convert_post(self, post: dict) -> dict:
-        if post is None:
-            return post
+    def convert_post_meta(self, post: dict) -> dict:
+        """date, id and path only: enough for comments"""
         if isinstance(post["post_date"], str):
             post["post_date"] = datetime.datetime.fromisoformat(post["post_date"])
-        post["categories"] = self.categorymap.get(post["ID"], [])
         post["post_id"] = post["ID"]
         post["post_path"] = self.post2url(post).lstrip("/")
+        return post
+
+    def convert_post(self, post: dict) -> dict:
+        if post is None:
+            return post
+        post = self.convert_post_meta(post)
+        post["categories"] = self.categorymap.get(post["ID"], [])
         post["header"] = {
             "title": post["post_title"],
             "date": post["post_date"].astimezone().isoformat(),
@@ -372,6 +620,8 @@ class IssoComment:
             return
         # create comment
         kwargs = {k: comment[v] for k, v in key_conv.items()}
+        if isinstance(kwargs["created"], str):
+            kwargs["created"] = datetime.datetime.fromisoformat(kwargs["created"])
         kwargs["created"] = kwargs["created"].timestamp()
         if kwargs["parent"] == 0:
             kwargs.pop("parent")
@@ -385,10 +635,23 @@ def wordpress_option(func):
     @click.option("--hugopath", envvar="HUGO_PATH", show_envvar=True)
     @click.option("--copy-resource/--no-copy-resource", default=False, show_default=True)
     @click.option("--uploads-dir", envvar="WP_UPLOADS_DIR", show_envvar=True)
+    @click.option("--fetch-parallel", type=int, default=8, show_default=True, help="concurrent asset downloads")
+    @click.option("--fetch-per-host", type=int, default=4, show_default=True, help="concurrent downloads per host")
+    @click.option("--fetch-timeout", type=float, default=30, show_default=True)
+    @click.option("--fetch-retries", type=int, default=3, show_default=True)
+    @click.option("--fetch-bandwidth", type=int, default=0, show_default=True,
+                  help="total download bytes/sec (0: unlimited)")
+    @click.option("--asset-cache", type=click.Path(file_okay=False), envvar="WP_ASSET_CACHE", show_envvar=True,
+                  help="keep downloaded assets in this directory across runs")
+    @click.option("--asset-revalidate/--no-asset-revalidate", default=False, show_default=True,
+                  help="check cached assets with ETag/Last-Modified")
     @mysql_option
     @functools.wraps(func)
-    def _(baseurl, hugopath, mysql_conn, uploads_dir, copy_resource, *args, **kwargs):
-        return func(wp=WP(mysql_conn, baseurl, hugopath, uploads_dir, copy_resource), *args, **kwargs)
+    def _(baseurl, hugopath, mysql_conn, uploads_dir, copy_resource, fetch_parallel, fetch_per_host, fetch_timeout,
+          fetch_retries, fetch_bandwidth, asset_cache, asset_revalidate, *args, **kwargs):
+        fetcher = AssetFetcher(fetch_parallel, fetch_per_host, fetch_timeout, fetch_retries,
+                               bandwidth=fetch_bandwidth, cache_dir=asset_cache, revalidate=asset_revalidate)
+        return func(wp=WP(mysql_conn, baseurl, hugopath, uploads_dir, copy_resource, fetcher), *args, **kwargs)
     return _
 
 
@@ -449,16 +712,16 @@ def wp_list_post(wp: WP):
 @wordpress_option
 @template_option
 @click.argument("id", type=int)
-def wp_convpost1(wp: WP, id, template):
+def wp_convpost1(wp: WP, id, template_source):
     """WP: convert single post to hugo markdown"""
     permalink = wp.get_option("permalink_structure")
     _log.debug("permalink: %s", permalink)
     post = wp.convert_post(wp.get_post(id))
     if post is None:
         raise click.BadParameter(f"post {id} not found")
-    click.echo(template.render(post))
+    click.echo(make_template(template_source).render(post))
     for k, v in post["assets"].items():
-        _log.debug("assets: %s: %s bytes", k, len(v))
+        _log.debug("assets: %s: %s", k, v if isinstance(v, Path) else f"{len(v)} bytes")
 
 
 @wordpress_option
@@ -482,32 +745,121 @@ def wp_convcomment1(sqlite3_conn, wp: WP, url_prefix: str, id):
         isso.convert_comment(post, c)
 
 
+def convpost(wp: WP, template, kind: str, row: dict) -> tuple[str, str, dict[str, Asset]]:
+    """convert and render post/page. returns (output path, text, assets)"""
+    if kind == "page":
+        page = wp.convert_page(row)
+        # dt = page["post_date"]
+        # outf: Path = outpath / "pages" / (page["post_name"]+".markdown")
+        outf = Path("pages") / (page["post_name"].strip("/") + ".markdown")
+        return str(outf), template.render(page), page["assets"]
+    post = wp.convert_post(row)
+    # dt = post["post_date"]
+    # outf: Path = outpath / dt.strftime("%Y-%m") / (dt.strftime("%Y-%m-%d-")+str(post["ID"])+".markdown")
+    outf = Path(post["header"]["url"]) / "post.md"
+    return str(outf), template.render(post), post["assets"]
+
+
+def copy_asset(src: Path, dst: Path):
+    """copy file content, skip if dst is a copy of current src"""
+    import shutil
+    if dst.exists():
+        st_src, st_dst = src.stat(), dst.stat()
+        if st_src.st_size == st_dst.st_size and st_src.st_mtime_ns <= st_dst.st_mtime_ns:
+            _log.debug("assets: %s: up to date", dst)
+            return
+    shutil.copyfile(src, dst)
+
+
+def write_post(outpath: Path, outname: str, text: str, assets: dict[str, Asset]):
+    outf: Path = outpath / outname
+    outf.parent.mkdir(exist_ok=True, parents=True)
+    outf.write_text(text)
+    for k, v in assets.items():
+        if isinstance(v, Path):
+            _log.info("assets: %s: %s", k, v)
+            copy_asset(v, outf.parent / k)
+        else:
+            _log.info("assets: %s: %s bytes", k, len(v))
+            (outf.parent / k).write_bytes(v)
+
+
+_convpost_state: tuple = ()
+
+
+def _convpost_init(wpargs: tuple, permalink: str, categorymap: dict, source: str):
+    global _convpost_state
+    # downloads are done by the parent: per-host and bandwidth limits are shared by all workers
+    wp = WP(None, *wpargs, fetcher=DeferredFetcher())
+    wp.permalink = permalink
+    wp.categorymap = categorymap
+    _convpost_state = (wp, make_template(source))
+
+
+def _convpost_job(kind: str, row: dict) -> tuple[str, str, dict[str, Asset]]:
+    return convpost(*_convpost_state, kind, row)
+
+
 @wordpress_option
 @template_option
+@click.option("--jobs", type=int, default=1, show_default=True, help="convert/render in worker processes")
 @click.argument("outdir", type=click.Path(dir_okay=True, exists=True))
-def wp_convpost_all(wp: WP, outdir, template):
+def wp_convpost_all(wp: WP, outdir, template_source, jobs):
     """WP: convert all post to hugo markdown"""
+    import itertools
     outpath = Path(outdir)
-    for p in wp.posts():
-        post = wp.convert_post(p)
-        # dt = post["post_date"]
-        # outf: Path = outpath / dt.strftime("%Y-%m") / (dt.strftime("%Y-%m-%d-")+str(post["ID"])+".markdown")
-        outf: Path = outpath / post["header"]["url"] / "post.md"
-        outf.parent.mkdir(exist_ok=True, parents=True)
-        outf.write_text(template.render(post))
-        for k, v in post["assets"].items():
-            _log.info("assets: %s: %s bytes", k, len(v))
-            (outf.parent / k).write_bytes(v)
-    for p in wp.pages():
-        page = wp.convert_page(p)
-        # dt = page["post_date"]
-        # outf: Path = outpath / "pages" / (page["post_name"]+".markdown")
-        outf: Path = outpath / "pages" / (page["post_name"].strip("/") + ".markdown")
-        outf.parent.mkdir(exist_ok=True, parents=True)
-        outf.write_text(template.render(page))
-        for k, v in page["assets"].items():
-            _log.info("assets: %s: %s bytes", k, len(v))
-            (outf.parent / k).write_bytes(v)
+    rows = itertools.chain((("post", x) for x in wp.posts()), (("page", x) for x in wp.pages()))
+    errors: list[tuple[str, int, Exception]] = []
+    if jobs <= 1:
+        template = make_template(template_source)
+        for kind, row in rows:
+            try:
+                write_post(outpath, *convpost(wp, template, kind, row))
+            except Exception as e:
+                _log.exception("%s %s", kind, row["ID"])
+                errors.append((kind, row["ID"], e))
+    else:
+        from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+        from collections import deque
+        initargs = ((wp.wp_baseurl, wp.hugo_path, wp.wp_uploads_path, wp.copy_resource),
+                    wp.permalink, wp.categorymap, template_source)
+        inflight: deque = deque()
+        fetching: deque = deque()
+
+        def write(limit: int):
+            # write in submission order: output does not depend on scheduling
+            while len(fetching) > limit:
+                kind, post_id, outname, text, fut = fetching.popleft()
+                try:
+                    write_post(outpath, outname, text, fut.result())
+                except Exception as e:
+                    _log.error("%s %s: %s", kind, post_id, e)
+                    errors.append((kind, post_id, e))
+
+        def drain(limit: int):
+            while len(inflight) > limit:
+                kind, post_id, fut = inflight.popleft()
+                try:
+                    outname, text, assets = fut.result()
+                except Exception as e:
+                    _log.error("%s %s: %s", kind, post_id, e)
+                    errors.append((kind, post_id, e))
+                    continue
+                # assets of several posts are fetched concurrently with the single fetcher
+                fetching.append((kind, post_id, outname, text, fetcher.submit(fetch_assets, wp.fetcher, assets)))
+                write(limit)
+        with ProcessPoolExecutor(jobs, initializer=_convpost_init, initargs=initargs) as executor, \
+                ThreadPoolExecutor(wp.fetcher.parallel) as fetcher:
+            for kind, row in rows:
+                inflight.append((kind, row["ID"], executor.submit(_convpost_job, kind, row)))
+                # back-pressure: do not read ahead of workers
+                drain(jobs * 4)
+            drain(0)
+            write(0)
+    if errors:
+        for kind, post_id, e in errors:
+            click.echo(f"{kind} {post_id}: {e}", err=True)
+        raise click.ClickException(f"{len(errors)} posts/pages failed")
 
 
 @wordpress_option
@@ -518,14 +870,16 @@ def wp_convcomment_all(sqlite3_conn, wp: WP, url_prefix):
     isso = IssoComment(sqlite3_conn, url_prefix)
     permalink = wp.get_option("permalink_structure")
     _log.debug("permalink: %s", permalink)
-    done_posts = set()
-    for comment in wp.comments():
-        post_id = comment["comment_post_ID"]
-        if post_id not in done_posts:
-            done_posts.add(post_id)
-        post = wp.convert_post(wp.get_post(post_id))
-        _log.debug("convert %s/%d", post_id, comment["comment_ID"])
-        isso.convert_comment(post, comment)
+    # isso needs id/path/title only: no per-comment post query, no content/asset conversion
+    posts = wp.comment_posts()
+    for post_id, comments in wp.comments_by_post().items():
+        post = posts.get(post_id)
+        if post is None:
+            _log.warning("post not found: %s (%d comments)", post_id, len(comments))
+            continue
+        for comment in comments:
+            _log.debug("convert %s/%d", post_id, comment["comment_ID"])
+            isso.convert_comment(post, comment)
 
 
 @wordpress_option
@@ -0,0 +1,89 @@
+"""benchmark of util.find_files / util.scan_files on synthetic tree
+
+usage: PYTHONPATH=. python tests/bench_find_files.py [--files 500000] [--dir /tmp/bench]
+"""
+import argparse
+import fnmatch
+import os
+import tempfile
+import time
+from pathlib import Path
+from hugomgmt.util import find_files, scan_files
+from hugomgmt.staticsite import compress_ignore_dirs, compress_ignore_files, compress_file_patterns
+
+exts = [".html", ".html.gz", ".css", ".js", ".png", ".jpg", ".xml", ".xml.gz", ".json", ".txt"]
+
+
+def make_tree(root: Path, nfiles: int, per_dir: int = 100):
+    for i in range(nfiles):
+        d = root / f"{i // (per_dir * 100):03d}" / f"{(i // per_dir) % 100:02d}"
+        if i % per_dir == 0:
+            d.mkdir(parents=True, exist_ok=True)
+        (d / f"f{i}{exts[i % len(exts)]}").touch()
+
+
+def walk_fnmatch(rootdirs, ignore_dirs, ignore_files, pattern):
+    # previous implementation
+    for r in rootdirs:
+        for root, dirs, files in r.walk():
+            for i in ignore_dirs:
+                if i in dirs:
+                    dirs.remove(i)
+            for i in files:
+                for p in ignore_files:
+                    if fnmatch.fnmatch(i, p):
+                        break
+                else:
+                    for p in pattern:
+                        if fnmatch.fnmatch(i, p):
+                            yield root / i
+                            break
+
+
+def bench(name, fn):
+    start = time.perf_counter()
+    n = fn()
+    print(f"{name}: {n} files, {time.perf_counter() - start:.3f} sec")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=500000)
+    parser.add_argument("--dir")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory(dir=args.dir) as td:
+        root = Path(td)
+        start = time.perf_counter()
+        make_tree(root, args.files)
+        print(f"create: {args.files} files, {time.perf_counter() - start:.3f} sec")
+        orphan_pattern = ["*.gz"]
+        rootdirs = [root]
+        include = (compress_ignore_dirs, compress_ignore_files, compress_file_patterns)
+        orphan = (compress_ignore_dirs, compress_file_patterns, orphan_pattern)
+
+        def old():
+            # include walk + stat, and orphan walk
+            n = 0
+            for p in walk_fnmatch(rootdirs, *include):
+                os.stat(p)
+                n += 1
+            return n + sum(1 for _ in walk_fnmatch(rootdirs, *orphan))
+
+        def new_find():
+            n = 0
+            for p in find_files(rootdirs, *include):
+                os.stat(p)
+                n += 1
+            return n + sum(1 for _ in find_files(rootdirs, *orphan))
+
+        def new_scan():
+            return sum(1 for _ in scan_files(rootdirs, *include, orphan_pattern))
+
+        for _ in range(2):
+            bench("fnmatch walk x2 + stat", old)
+            bench("find_files x2 + stat", new_find)
+            bench("scan_files single walk", new_scan)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,30 @@
 import unittest
+import os
+import shutil
+import sys
 from pathlib import Path
 import tempfile
 import gzip
+import zlib
 try:
     import brotli
 except ImportError:
     brotli = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
 from click.testing import CliRunner
 import hugomgmt.main
+import hugomgmt.staticsite
+
+
+def _worker_budget_used():
+    return hugomgmt.staticsite._worker_budget.used
 
 
 class TestStatic(unittest.TestCase):
@@ -29,6 +46,7 @@ class TestStatic(unittest.TestCase):
         self.assertEqual(0, res.exit_code)
         self.assertIn("static-gzip", res.output)
         self.assertIn("static-brotli", res.output)
+        self.assertIn("static-zstd", res.output)
         # self.assertIn("static-image-optimize", res.output)
         self.assertIn("static-rss-atom", res.output)
 
@@ -77,6 +95,111 @@ class TestStatic(unittest.TestCase):
         with gzip.open(self.tdpath / "test.html.gz") as ifp:
             self.assertEqual(b"hello\n"*10240, ifp.read())
 
+    def test_gzip_manifest(self):
+        ofp1, _, _, _, _ = self.prep()
+        mfpath = self.tdpath / "manifest.db"
+        gzpath = self.tdpath / "test.html.gz"
+        res = CliRunner().invoke(self.cli, ["static-gzip", str(ofp1), "--manifest", str(mfpath)])
+        if res.exception:
+            raise res.exception
+        self.assertTrue(mfpath.exists())
+        with gzip.open(gzpath) as ifp:
+            self.assertEqual(b"hello\n"*10240, ifp.read())
+        # broken .gz is not checked: source and .gz have same size and mtime
+        st = gzpath.stat()
+        broken = b"x" * st.st_size
+        gzpath.write_bytes(broken)
+        os.utime(gzpath, ns=(st.st_atime_ns, st.st_mtime_ns))
+        res = CliRunner().invoke(self.cli, ["static-gzip", str(ofp1), "--manifest", str(mfpath)])
+        if res.exception:
+            raise res.exception
+        self.assertEqual(broken, gzpath.read_bytes())
+        # --verify
+        res = CliRunner().invoke(self.cli, ["static-gzip", str(ofp1), "--manifest", str(mfpath), "--verify"])
+        if res.exception:
+            raise res.exception
+        with gzip.open(gzpath) as ifp:
+            self.assertEqual(b"hello\n"*10240, ifp.read())
+        # removed .gz is created again
+        gzpath.unlink()
+        res = CliRunner().invoke(self.cli, ["static-gzip", str(ofp1), "--manifest", str(mfpath)])
+        if res.exception:
+            raise res.exception
+        with gzip.open(gzpath) as ifp:
+            self.assertEqual(b"hello\n"*10240, ifp.read())
+        # changed minsize invalidates manifest entries
+        res = CliRunner().invoke(self.cli, ["static-gzip", str(ofp1), "--manifest", str(mfpath),
+                                            "--minsize", str(ofp1.stat().st_size + 1)])
+        if res.exception:
+            raise res.exception
+        self.assertFalse(gzpath.exists())
+
+    def test_gzip_block(self):
+        ofp1, _, _, _, _ = self.prep()
+        res = CliRunner().invoke(self.cli, [
+            "static-gzip", self.td.name, "--parallel", "4", "--block-threshold", "1024", "--block-size", "4096"])
+        if res.exception:
+            raise res.exception
+        self.assertEqual(0, res.exit_code)
+        # single gzip member
+        d = zlib.decompressobj(31)
+        self.assertEqual(b"hello\n"*10240, d.decompress((self.tdpath / "test.html.gz").read_bytes()))
+        self.assertTrue(d.eof)
+        self.assertEqual(b"", d.unused_data)
+
+    def test_gzip_adaptive(self):
+        self.prep()
+        (self.tdpath / "test2.css").write_text("world\n"*10240)
+        res = CliRunner().invoke(self.cli, ["static-gzip", self.td.name, "--adaptive", "10"])
+        if res.exception:
+            raise res.exception
+        self.assertEqual(0, res.exit_code)
+        self.assertIn("adaptive:", res.output)
+        self.assertIn(".gz: 2 files, 122880 bytes -> expected", res.output)
+        with gzip.open(self.tdpath / "test.html.gz") as ifp:
+            self.assertEqual(b"hello\n"*10240, ifp.read())
+        with gzip.open(self.tdpath / "test2.css.gz") as ifp:
+            self.assertEqual(b"world\n"*10240, ifp.read())
+
+    def test_gzip_process(self):
+        ofp1, _, _, _, _ = self.prep()
+        (self.tdpath / "sub").mkdir()
+        ofp6 = self.tdpath / "sub" / "test2.css"
+        ofp6.write_text("world\n"*10240)
+        mfpath = self.tdpath / "manifest.db"
+        res = CliRunner().invoke(self.cli, [
+            "static-gzip", self.td.name, "--try-zopfli", "--executor", "process", "--parallel", "2",
+            "--manifest", str(mfpath)])
+        if res.exception:
+            raise res.exception
+        self.assertEqual(0, res.exit_code)
+        with gzip.open(self.tdpath / "test.html.gz") as ifp:
+            self.assertEqual(b"hello\n"*10240, ifp.read())
+        with gzip.open(self.tdpath / "sub" / "test2.css.gz") as ifp:
+            self.assertEqual(b"world\n"*10240, ifp.read())
+        self.assertFalse((self.tdpath / "test-short.js.gz").exists())
+        # manifest updated by workers
+        mf = hugomgmt.staticsite.CompManifest(mfpath, hugomgmt.staticsite.Codec("zopfli", 1024*8).manifest_key)
+        self.assertIsNotNone(mf.get(ofp1))
+        self.assertIsNotNone(mf.get(ofp6))
+
+    def test_gzip_process_budget(self):
+        self.prep()
+        res = CliRunner().invoke(self.cli, [
+            "static-gzip", self.td.name, "--executor", "process", "--parallel", "2", "--memory-budget", "1"])
+        if res.exception:
+            raise res.exception
+        self.assertEqual(0, res.exit_code)
+        with gzip.open(self.tdpath / "test.html.gz") as ifp:
+            self.assertEqual(b"hello\n"*10240, ifp.read())
+        # reservation is visible from worker process
+        from concurrent.futures import ProcessPoolExecutor
+        budget = hugomgmt.staticsite.MemoryBudget(100, shared=True)
+        with ProcessPoolExecutor(1, initializer=hugomgmt.staticsite._precomp_init, initargs=(budget,)) as pool:
+            with budget.reserve(60):
+                self.assertEqual(60, pool.submit(_worker_budget_used).result())
+            self.assertEqual(0, pool.submit(_worker_budget_used).result())
+
     @unittest.skipIf(brotli is None, "brotli not installed")
     def test_brotli(self):
         ofp1, _, _, ofp4, ofp5 = self.prep()
@@ -106,6 +229,546 @@ class TestStatic(unittest.TestCase):
         self.assertFalse((self.tdpath / "test-short.js.br").exists())
         self.assertFalse((self.tdpath / "test.png.br").exists())
 
+    @unittest.skipIf(brotli is None or zstandard is None, "brotli/zstandard not installed")
+    def test_precompress(self):
+        ofp1, ofp2, _, ofp4, ofp5 = self.prep()
+        res = CliRunner().invoke(self.cli, [
+            "static-precompress", self.td.name, "--remove",
+            "--codec", "gzip", "--codec", "brotli", "--codec", "zstd:1"])
+        if res.exception:
+            raise res.exception
+        self.assertEqual(0, res.exit_code)
+        self.assertFalse(ofp4.exists())  # --remove
+        self.assertFalse(ofp5.exists())  # --remove
+        with gzip.open(self.tdpath / "test.html.gz") as ifp:
+            self.assertEqual(b"hello\n"*10240, ifp.read())
+        self.assertEqual(b"hello\n"*10240, brotli.decompress((self.tdpath / "test.html.br").read_bytes()))
+        self.assertEqual(b"hello\n"*10240, zstandard.decompress((self.tdpath / "test.html.zst").read_bytes()))
+        self.assertFalse((self.tdpath / "test-short.js.gz").exists())
+        self.assertFalse((self.tdpath / "test-short.js.br").exists())
+        self.assertFalse((self.tdpath / "test.png.zst").exists())
+
+    @unittest.skipIf(brotli is None or zstandard is None, "brotli/zstandard not installed")
+    def test_precompress_stream(self):
+        ofp1, _, _, _, _ = self.prep()
+        args = ["static-precompress", self.td.name, "--codec", "gzip", "--codec", "brotli", "--codec", "zstd",
+                "--stream-threshold", "1024", "--memory-budget", "4096"]
+        res = CliRunner().invoke(self.cli, args)
+        if res.exception:
+            raise res.exception
+        self.assertEqual(0, res.exit_code)
+        with gzip.open(self.tdpath / "test.html.gz") as ifp:
+            self.assertEqual(b"hello\n"*10240, ifp.read())
+        self.assertEqual(b"hello\n"*10240, brotli.decompress((self.tdpath / "test.html.br").read_bytes()))
+        self.assertEqual(b"hello\n"*10240, zstandard.decompress((self.tdpath / "test.html.zst").read_bytes()))
+        self.assertEqual([], list(self.tdpath.glob(".*.tmp")))
+        # compare in chunks
+        (self.tdpath / "test.html.gz").write_bytes(gzip.compress(b"broken"))
+        res = CliRunner().invoke(self.cli, args + ["--verify"])
+        if res.exception:
+            raise res.exception
+        with gzip.open(self.tdpath / "test.html.gz") as ifp:
+            self.assertEqual(b"hello\n"*10240, ifp.read())
+
+    @unittest.skipIf(zstandard is None, "zstandard not installed")
+    def test_zstd_dict(self):
+        for i in range(200):
+            (self.tdpath / f"page{i}.html").write_text(
+                "<html><head><title>page %d</title><link rel='stylesheet' href='/style.css'></head>"
+                "<body><nav><a href='/'>home</a><a href='/archives/'>archives</a></nav>"
+                "<article>article %d: %s</article><footer>footer</footer></body></html>" % (i, i, "x" * i))
+        dictpath = self.tdpath / "zstd.dict"
+        res = CliRunner().invoke(self.cli, ["static-zstd-train", self.td.name, "--output", str(dictpath),
+                                            "--size", "4096"])
+        if res.exception:
+            raise res.exception
+        self.assertEqual(0, res.exit_code)
+        self.assertIn("zstd+dict", res.output)
+        dict_data = zstandard.ZstdCompressionDict(dictpath.read_bytes())
+        res = CliRunner().invoke(self.cli, ["static-zstd", self.td.name, "--minsize", "10", "--dict", str(dictpath)])
+        if res.exception:
+            raise res.exception
+        self.assertEqual(0, res.exit_code)
+        zstpath = self.tdpath / "page100.html.zst"
+        self.assertTrue(zstpath.exists())
+        data = zstandard.ZstdDecompressor(dict_data=dict_data).decompress(zstpath.read_bytes())
+        self.assertEqual((self.tdpath / "page100.html").read_bytes(), data)
+        with self.assertRaises(zstandard.ZstdError):
+            zstandard.decompress(zstpath.read_bytes())
+        # --level applies to dictionary and streaming
+        src = (self.tdpath / "page199.html").read_bytes()
+        for stream_threshold in ["0", "1"]:
+            for level in [1, 19]:
+                zstpath.unlink()
+                (self.tdpath / "page199.html.zst").unlink()
+                res = CliRunner().invoke(self.cli, [
+                    "static-zstd", self.td.name, "--minsize", "10", "--dict", str(dictpath), "--level", str(level),
+                    "--stream-threshold", stream_threshold])
+                if res.exception:
+                    raise res.exception
+                expected = zstandard.ZstdCompressor(level=level, dict_data=dict_data).compress(src)
+                self.assertEqual(expected, (self.tdpath / "page199.html.zst").read_bytes())
+
+    def test_precompress_duplicate(self):
+        self.prep()
+        res = CliRunner().invoke(self.cli, [
+            "static-precompress", self.td.name, "--codec", "gzip", "--codec", "zopfli"])
+        self.assertIsNotNone(res.exception)
+        self.assertIn("duplicate codec", res.output)
+
+    def test_gzip_changed(self):
+        ofp1, _, _, ofp4, _ = self.prep()
+        sub = self.tdpath / "sub"
+        sub.mkdir()
+        other = sub / "other.html"
+        other.write_text("hello\n"*10240)
+        orphan = sub / "gone.html.gz"
+        orphan.write_text("hello\n")
+        res = CliRunner().invoke(self.cli, [
+            "static-gzip", self.td.name, "--remove", "--changed", "-"], input="sub/other.html\nsub/gone.html\n")
+        if res.exception:
+            raise res.exception
+        self.assertTrue((sub / "other.html.gz").exists())
+        self.assertFalse(orphan.exists())
+        # not listed
+        self.assertFalse(ofp1.with_suffix(".html.gz").exists())
+        self.assertTrue(ofp4.exists())
+
+    def test_gzip_watermark(self):
+        ofp1, _, _, ofp4, _ = self.prep()
+        wm = self.tdpath / "watermark"
+        res = CliRunner().invoke(self.cli, ["static-gzip", self.td.name, "--watermark", str(wm)])
+        if res.exception:
+            raise res.exception
+        self.assertTrue(wm.exists())
+        gz1 = ofp1.with_suffix(".html.gz")
+        gz1.write_text("broken")
+        # nothing changed since last run: untouched
+        res = CliRunner().invoke(self.cli, ["static-gzip", self.td.name, "--watermark", str(wm), "--remove"])
+        if res.exception:
+            raise res.exception
+        self.assertEqual("broken", gz1.read_text())
+        # rebuilt by hugo
+        ofp1.write_text("hello\n"*10240)
+        res = CliRunner().invoke(self.cli, ["static-gzip", self.td.name, "--watermark", str(wm), "--remove"])
+        if res.exception:
+            raise res.exception
+        self.assertEqual(ofp1.read_bytes(), gzip.decompress(gz1.read_bytes()))
+        self.assertFalse(ofp4.exists())
+
+    def watch(self, poll: bool):
+        import threading
+        import time
+        from concurrent.futures import ThreadPoolExecutor
+        ss = hugomgmt.staticsite
+        codecs = [ss.Codec("gzip", 100)]
+        opt1, log1 = self.fake_optimizer("opt1", 10)
+        watcher = ss.make_watcher(self.tdpath, [".git"], poll, 0.1)
+        self.assertIsInstance(watcher, ss.PollWatcher if poll else ss.InotifyWatcher)
+        stop = threading.Event()
+        pool = ThreadPoolExecutor(2)
+        th = threading.Thread(target=ss.watch_tree, args=(
+            self.tdpath, codecs, ss.CompressSettings(), [opt1], None, 0.2, watcher, pool, stop, True))
+        th.start()
+        try:
+            sub = self.tdpath / "sub"
+            sub.mkdir()
+            time.sleep(0.3)
+            html = sub / "new.html"
+            html.write_text("hello\n"*1000)
+            png = self.tdpath / "new.png"
+            png.write_text("hello\n"*1000)
+            (self.tdpath / "gone.html").write_text("hello\n"*1000)
+            gz = html.with_suffix(".html.gz")
+            gone = self.tdpath / "gone.html.gz"
+            for _ in range(50):
+                if gz.exists() and gone.exists() and png.stat().st_size != 6000:
+                    break
+                time.sleep(0.1)
+            self.assertEqual(html.read_bytes(), gzip.decompress(gz.read_bytes()))
+            (self.tdpath / "gone.html").unlink()
+            for _ in range(50):
+                if not gone.exists():
+                    break
+                time.sleep(0.1)
+            self.assertFalse(gone.exists())
+            time.sleep(0.5)
+        finally:
+            stop.set()
+            th.join()
+            pool.shutdown()
+            watcher.close()
+        # optimized once: own write is not processed again
+        self.assertEqual(5990, png.stat().st_size)
+        self.assertEqual("x", log1.read_text())
+
+    @unittest.skipUnless(sys.platform == "linux", "inotify")
+    def test_watch_inotify(self):
+        self.watch(False)
+
+    def test_watch_poll(self):
+        self.watch(True)
+
+    def test_gzip_dedup(self):
+        import os
+        ofp1, _, _, _, _ = self.prep()
+        sub = self.tdpath / "tags" / "x"
+        sub.mkdir(parents=True)
+        dup1 = sub / "index.html"
+        dup1.write_text("hello\n"*10240)
+        dup2 = self.tdpath / "copy.html"
+        dup2.write_text("hello\n"*10240)
+        # stale compressed file of duplicate
+        (self.tdpath / "copy.html.gz").write_text("stale")
+        os.utime(self.tdpath / "copy.html.gz", (0, 0))
+        for executor in ["thread", "process"]:
+            res = CliRunner().invoke(self.cli, [
+                "static-gzip", self.td.name, "--dedup", "--executor", executor])
+            if res.exception:
+                raise res.exception
+            self.assertIn("dedup: 2 duplicates of 1 files", res.output)
+            gz = ofp1.with_suffix(".html.gz")
+            self.assertEqual(ofp1.read_bytes(), gzip.decompress(gz.read_bytes()))
+            for dup in [dup1, dup2]:
+                self.assertTrue(os.path.samefile(gz, dup.with_suffix(".html.gz")))
+            self.assertFalse(os.path.samefile(dup1, dup2))
+        self.assertIn(", 0 links,", res.output)
+        res = CliRunner().invoke(self.cli, ["static-gzip", self.td.name, "--dedup-sources"])
+        if res.exception:
+            raise res.exception
+        self.assertTrue(os.path.samefile(ofp1, dup2))
+
+    def test_compress_report(self):
+        import json
+        self.prep()
+        (self.tdpath / "style.css").write_text("body { color: red; }\n"*100)
+        res = CliRunner().invoke(self.cli, [
+            "static-compress-report", self.td.name, "--codec", "gzip-9", "--codec", "gzip-1", "--format", "json"])
+        if res.exception:
+            raise res.exception
+        data = json.loads(res.output)
+        keys = [(x["group"], x["key"], x["codec"]) for x in data]
+        self.assertEqual([
+            ("ext", ".css", "gzip-9"), ("ext", ".css", "gzip-1"),
+            ("ext", ".html", "gzip-9"), ("ext", ".html", "gzip-1"),
+            ("ext", ".js", "gzip-9"), ("ext", ".js", "gzip-1"),
+            ("size", "<1K", "gzip-9"), ("size", "<1K", "gzip-1"),
+            ("size", "<8K", "gzip-9"), ("size", "<8K", "gzip-1"),
+            ("size", "<64K", "gzip-9"), ("size", "<64K", "gzip-1"),
+            ("all", "", "gzip-9"), ("all", "", "gzip-1")], keys)
+        self.assertEqual(3, data[-1]["files"])
+        self.assertGreater(1, data[-1]["ratio"])
+        res = CliRunner().invoke(self.cli, ["static-compress-report", self.td.name, "--codec", "gzip-9"])
+        if res.exception:
+            raise res.exception
+        self.assertIn("comp MB/s", res.output)
+        self.assertEqual(1 + 3 + 3 + 1, len(res.output.splitlines()))
+
+    def test_access_index(self):
+        import sqlite3
+        ofp1, _, _, _, _ = self.prep()
+        (self.tdpath / "post").mkdir()
+        post = self.tdpath / "post" / "index.html"
+        post.write_text("hello world\n"*10240)
+        cold = self.tdpath / "cold.html"
+        cold.write_text("hello\n"*10240)
+        line = '127.0.0.1 - - [06/Jun/2024:22:25:10 +0900] "GET {} HTTP/1.1" {} 1234 "-" "curl/8.0"\n'
+        log1 = self.tdpath / "access.log"
+        log1.write_text(line.format("/hugo/post/", 200) * 10 + line.format("/hugo/test.html?x=1", 200)
+                        + line.format("/hugo/missing.html", 404) + "broken line\n")
+        log2 = self.tdpath / "access.log.1.gz"
+        log2.write_bytes(gzip.compress(line.format("/hugo/post/index.html", 304).encode()))
+        hitsdb = self.tdpath / "hits.db"
+        res = CliRunner().invoke(self.cli, [
+            "static-access-index", str(log1), str(log2), "--output", str(hitsdb), "--prefix", "/hugo/"])
+        if res.exception:
+            raise res.exception
+        self.assertIn("12 requests, 2 paths", res.output)
+        rows = sqlite3.connect(hitsdb).execute("SELECT path, hits, bytes FROM hits ORDER BY path").fetchall()
+        self.assertEqual([("post/index.html", 11, 13574), ("test.html", 1, 1234)], rows)
+        index = hugomgmt.staticsite.HitIndex(hitsdb)
+        files = [(x, x.stat().st_size) for x in [ofp1, post, cold]]
+        top, unseen = index.top(self.tdpath, files, 50)
+        self.assertEqual({post}, top)
+        self.assertEqual({cold}, unseen)
+        res = CliRunner().invoke(self.cli, [
+            "static-gzip", self.td.name, "--hits", str(hitsdb), "--hits-top", "50", "--hits-skip"])
+        if res.exception:
+            raise res.exception
+        self.assertTrue(post.with_suffix(".html.gz").exists())
+        self.assertTrue(ofp1.with_suffix(".html.gz").exists())
+        self.assertFalse(cold.with_suffix(".html.gz").exists())
+
+    def test_minify(self):
+        html = self.tdpath / "index.html"
+        html.write_text('<html>\n  <body class="x">\n    <!-- comment -->\n    <p>hello   world</p>\n'
+                        '    <script>\n      var a = 1;  // c\n    </script>\n  </body>\n</html>\n' * 100)
+        css = self.tdpath / "main.css"
+        css.write_text("body {\n  color : red ;\n}\n")
+        svg = self.tdpath / "a.svg"
+        svg.write_text('<svg xmlns="http://www.w3.org/2000/svg">\n  <g>\n    <rect/>\n  </g>\n</svg>\n')
+        (self.tdpath / "done.js").write_text("a()")
+        mfpath = self.tdpath / "minify.db"
+        res = CliRunner().invoke(self.cli, [
+            "static-minify", self.td.name, "--remove-quotes", "--codec", "gzip:100", "--manifest", str(mfpath),
+            "--parallel", "2"])
+        if res.exception:
+            raise res.exception
+        self.assertIn("minify: 4 files (3 changed, 0 skipped)", res.output)
+        self.assertTrue(html.read_text().startswith('<html><body class=x><p>hello world</p><script>var a=1;'))
+        self.assertEqual("body{color : red}", css.read_text())
+        self.assertEqual('<svg xmlns="http://www.w3.org/2000/svg"><g><rect/></g></svg>', svg.read_text())
+        self.assertEqual(html.read_bytes(), gzip.decompress(html.with_suffix(".html.gz").read_bytes()))
+        self.assertFalse(css.with_suffix(".css.gz").exists())
+        res = CliRunner().invoke(self.cli, ["static-minify", self.td.name, "--manifest", str(mfpath)])
+        if res.exception:
+            raise res.exception
+        self.assertIn("minify: 0 files (0 changed, 4 skipped)", res.output)
+
+    def test_fingerprint(self):
+        import hashlib
+        import re
+        (self.tdpath / "css").mkdir()
+        (self.tdpath / "img").mkdir()
+        (self.tdpath / "post").mkdir()
+        png = self.tdpath / "img" / "a b.png"
+        png.write_bytes(b"png data")
+        (self.tdpath / "app.js").write_text("console.log(1)")
+        css = self.tdpath / "css" / "main.css"
+        css.write_text('body { background: url("../img/a%20b.png"); }\n')
+        (self.tdpath / "post" / "index.html").write_text(
+            '<!DOCTYPE html>\n<html><head><link rel="stylesheet" href="/hugo/css/main.css?v=1">'
+            '<script src="https://example.com/hugo/app.js"></script><script src="https://cdn.example/app.js"></script>'
+            '</head><body><img src="../img/a%20b.png" srcset="../img/a%20b.png 1x, ../img/missing.png 2x">'
+            '<div style="background: url(/hugo/img/a%20b.png)">x</div><a href="/hugo/post/">self</a></body></html>\n')
+        (self.tdpath / "index.xml").write_text(
+            '<?xml version="1.0" encoding="utf-8"?>\n<rss version="2.0"><channel>'
+            '<image><url>https://example.com/hugo/img/a%20b.png</url></image>'
+            '<item><description>&lt;img src="/hugo/img/a%20b.png"&gt;</description></item></channel></rss>\n')
+        conf = self.tdpath / "fp.conf"
+        res = CliRunner().invoke(self.cli, [
+            "static-fingerprint", self.td.name, "--base-url", "https://example.com/hugo/",
+            "--nginx-conf", str(conf), "--parallel", "2"])
+        if res.exception:
+            raise res.exception
+        self.assertIn("fingerprint: 3 assets (3 new), 3 documents rewritten", res.output)
+        pngname = "a b." + hashlib.sha256(b"png data").hexdigest()[:10] + ".png"
+        self.assertTrue((self.tdpath / "img" / pngname).exists())
+        self.assertTrue(png.exists())
+        csstext = css.read_text()
+        self.assertEqual('body { background: url("../img/a%20b.' + pngname[4:] + '"); }\n', csstext)
+        cssname = "main." + hashlib.sha256(csstext.encode()).hexdigest()[:10] + ".css"
+        self.assertTrue((self.tdpath / "css" / cssname).exists())
+        html = (self.tdpath / "post" / "index.html").read_text()
+        self.assertIn(f'href="/hugo/css/{cssname}?v=1"', html)
+        self.assertIn('src="https://example.com/hugo/app.', html)
+        self.assertIn('src="https://cdn.example/app.js"', html)
+        self.assertIn(f'src="../img/a%20b.{pngname[4:]}"', html)
+        self.assertIn(f'srcset="../img/a%20b.{pngname[4:]} 1x, ../img/missing.png 2x"', html)
+        self.assertIn(f'url(/hugo/img/a%20b.{pngname[4:]})', html)
+        self.assertIn('href="/hugo/post/"', html)
+        xml = (self.tdpath / "index.xml").read_text()
+        self.assertIn(f"<url>https://example.com/hugo/img/a%20b.{pngname[4:]}</url>", xml)
+        self.assertIn(f'&lt;img src="/hugo/img/a%20b.{pngname[4:]}"&gt;', xml)
+        pat = re.search(r'"~([^"]*)"', conf.read_text()).group(1)
+        self.assertIsNotNone(re.search(pat, f"/hugo/css/{cssname}"))
+        self.assertIsNone(re.search(pat, "/hugo/css/main.css"))
+        # second run: nothing to do
+        res = CliRunner().invoke(self.cli, [
+            "static-fingerprint", self.td.name, "--base-url", "https://example.com/hugo/"])
+        if res.exception:
+            raise res.exception
+        self.assertIn("(0 new), 0 documents rewritten", res.output)
+        self.assertEqual(html, (self.tdpath / "post" / "index.html").read_text())
+
+    def fake_optimizer(self, name: str, cut: int):
+        # write input without last bytes to output, and count invocation
+        logfile = self.tdpath / f"{name}.log"
+        script = ("import sys; open(sys.argv[2], 'wb').write(open(sys.argv[1], 'rb').read()[:-%d]);"
+                  " open(%r, 'a').write('x')" % (cut, str(logfile)))
+        # batch: truncate each argument in place
+        batch_script = ("import sys; [open(f, 'r+b').truncate(len(open(f, 'rb').read()) - %d) for f in sys.argv[1:]];"
+                        " open(%r, 'a').write('x')" % (cut, str(logfile)))
+        return (name, ["*.png"], [sys.executable, "-c", script, "__INPUT__", "__OUTPUT__"],
+                [sys.executable, "-c", batch_script, "__FILES__"]), logfile
+
+    def test_image_chain_cache(self):
+        _, _, ofp3, _, _ = self.prep()
+        cachedir = self.tdpath / "cache"
+        opt1, log1 = self.fake_optimizer("opt1", 10)
+        opt2, log2 = self.fake_optimizer("opt2", 5)
+        cache = hugomgmt.staticsite.ImageOptCache(cachedir)
+        hugomgmt.staticsite.may_imagechain([ofp3], [opt1, opt2], False, cache)
+        cache.save()
+        self.assertEqual(len("hello\n"*10240) - 15, ofp3.stat().st_size)
+        self.assertEqual("x", log1.read_text())
+        self.assertEqual("x", log2.read_text())
+        # optimized file: skip
+        cache = hugomgmt.staticsite.ImageOptCache(cachedir)
+        hugomgmt.staticsite.may_imagechain([ofp3], [opt1, opt2], False, cache)
+        self.assertEqual("x", log1.read_text())
+        self.assertEqual("x", log2.read_text())
+        # original file again (rebuilt by hugo): restore from cache
+        ofp3.write_text("hello\n"*10240)
+        hugomgmt.staticsite.may_imagechain([ofp3], [opt1, opt2], False, cache)
+        self.assertEqual(len("hello\n"*10240) - 15, ofp3.stat().st_size)
+        self.assertEqual("x", log1.read_text())
+        # chain extended: only new optimizer runs
+        opt3, log3 = self.fake_optimizer("opt3", 1)
+        ofp3.write_text("hello\n"*10240)
+        hugomgmt.staticsite.may_imagechain([ofp3], [opt1, opt2, opt3], False, cache)
+        self.assertEqual(len("hello\n"*10240) - 16, ofp3.stat().st_size)
+        self.assertEqual("x", log1.read_text())
+        self.assertEqual("x", log3.read_text())
+
+    def test_image_chain_cache_fail(self):
+        _, _, ofp3, _, _ = self.prep()
+        cache = hugomgmt.staticsite.ImageOptCache(self.tdpath / "cache")
+        opt1, log1 = self.fake_optimizer("opt1", 10)
+        broken = ("broken", ["*.png"], [sys.executable, "-c", "import sys; sys.exit(1)", "__INPUT__"], None)
+        hugomgmt.staticsite.may_imagechain([ofp3], [opt1, broken], False, cache)
+        applied, _ = cache.get(hugomgmt.staticsite._digest(ofp3.read_bytes()))
+        # failed step is not recorded
+        self.assertEqual({"opt1"}, applied)
+
+    def test_image_chain_batch(self):
+        files = [self.tdpath / f"img{i}.png" for i in range(3)]
+        for f in files:
+            f.write_text("hello\n"*100)
+        files[0].chmod(0o600)
+        opt1, log1 = self.fake_optimizer("opt1", 10)
+        opt2, log2 = self.fake_optimizer("opt2", 5)
+        hugomgmt.staticsite.may_imagechain(files, [opt1, opt2], False, None, True)
+        for f in files:
+            self.assertEqual(600 - 15, f.stat().st_size)
+        # single invocation per optimizer, permission kept
+        self.assertEqual("x", log1.read_text())
+        self.assertEqual("x", log2.read_text())
+        self.assertEqual(0o600, files[0].stat().st_mode & 0o777)
+        self.assertEqual(["img0.png", "img1.png", "img2.png"], sorted(x.name for x in self.tdpath.glob("img*")))
+
+    def test_image_chain_batch_fail(self):
+        files = [self.tdpath / f"img{i}.png" for i in range(3)]
+        for f in files:
+            f.write_text("hello\n"*100)
+        opt1, log1 = self.fake_optimizer("opt1", 10)
+        broken = (opt1[0], opt1[1], opt1[2], [sys.executable, "-c", "import sys; sys.exit(1)", "__FILES__"])
+        opt2, log2 = self.fake_optimizer("opt2", 5)
+        hugomgmt.staticsite.may_imagechain(files, [broken, opt2], False, None, True)
+        # batch failed: each file by single command, then rest of the chain
+        for f in files:
+            self.assertEqual(600 - 15, f.stat().st_size)
+        self.assertEqual("xxx", log1.read_text())
+        self.assertEqual("x", log2.read_text())
+
+    def test_image_optimize_hits(self):
+        line = '127.0.0.1 - - [06/Jun/2024:22:25:10 +0900] "GET {} HTTP/1.1" 200 1234 "-" "curl/8.0"\n'
+        log = self.tdpath / "access.log"
+        log.write_text(line.format("/hot.png") * 10 + line.format("/warm.png"))
+        hitsdb = self.tdpath / "hits.db"
+        res = CliRunner().invoke(self.cli, ["static-access-index", str(log), "--output", str(hitsdb)])
+        if res.exception:
+            raise res.exception
+        imgdir = self.tdpath / "img"
+        opt1, _ = self.fake_optimizer("opt1", 10)
+        opt2, _ = self.fake_optimizer("opt2", 1)
+        for hits_skip, cold_size in [(False, 599), (True, 600)]:
+            imgdir.mkdir()
+            for name in ["hot", "warm", "cold"]:
+                (imgdir / f"{name}.png").write_text("hello\n"*100)
+            hugomgmt.staticsite.image_optimize_tree(
+                imgdir, [opt1], False, 1, 1, None, hugomgmt.staticsite.Incremental(imgdir), str(hitsdb), 50,
+                hits_skip, [opt2])
+            # expensive chain for top files, cheap chain for others
+            self.assertEqual(590, (imgdir / "hot.png").stat().st_size)
+            self.assertEqual(599, (imgdir / "warm.png").stat().st_size)
+            self.assertEqual(cold_size, (imgdir / "cold.png").stat().st_size)
+            shutil.rmtree(imgdir)
+
+    @unittest.skipIf(Image is None, "pillow not installed")
+    def test_image_variants(self):
+        imgdir = self.tdpath / "img"
+        imgdir.mkdir()
+        from PIL import ImageCms
+        # photo-like image: webp wins. tiny image: webp loses
+        exif = Image.Exif()
+        exif[0x0112] = 6    # orientation: rotate 90
+        icc = ImageCms.ImageCmsProfile(ImageCms.createProfile("sRGB")).tobytes()
+        Image.radial_gradient("L").convert("RGB").save(imgdir / "photo.png", exif=exif.tobytes(), icc_profile=icc)
+        Image.effect_noise((64, 64), 128).convert("1").save(imgdir / "tiny.png", optimize=True)
+        (self.tdpath / "index.html").write_text(
+            '<!DOCTYPE html>\n<html><body><p><img src="/img/photo.png" alt="x"> text</p>'
+            '<img src="img/tiny.png"><img src="https://example.com/photo.png">'
+            '<script>var s = "<source></source>";</script></body></html>\n')
+        res = CliRunner().invoke(self.cli, ["static-image-variants", self.td.name])
+        if res.exception:
+            raise res.exception
+        self.assertIn("webp: 1 files", res.output)
+        self.assertIn("html: 1 images", res.output)
+        self.assertTrue((imgdir / "photo.png.webp").exists())
+        self.assertFalse((imgdir / "tiny.png.webp").exists())
+        with Image.open(imgdir / "photo.png.webp") as img:
+            self.assertEqual(6, img.getexif()[0x0112])
+            self.assertEqual(icc, img.info.get("icc_profile"))
+        html = (self.tdpath / "index.html").read_text()
+        self.assertIn('<script>var s = "<source></source>";</script>', html)
+        self.assertTrue(html.startswith("<!DOCTYPE html>"))
+        self.assertIn('<p><picture><source type="image/webp" srcset="/img/photo.png.webp">'
+                      '<img src="/img/photo.png" alt="x"></picture> text</p>', html)
+        self.assertIn('<img src="img/tiny.png">', html)
+        # second run: nothing changed
+        res = CliRunner().invoke(self.cli, ["static-image-variants", self.td.name])
+        if res.exception:
+            raise res.exception
+        self.assertIn("html: 0 images", res.output)
+        self.assertEqual(html, (self.tdpath / "index.html").read_text())
+
+    @unittest.skipIf(Image is None, "pillow not installed")
+    def test_image_quality(self):
+        from PIL import ImageCms
+        photo = self.tdpath / "photo.jpg"
+        exif = Image.Exif()
+        exif[0x0112] = 6    # orientation: rotate 90
+        icc = ImageCms.ImageCmsProfile(ImageCms.createProfile("sRGB")).tobytes()
+        Image.radial_gradient("L").convert("RGB").save(photo, quality=100, exif=exif.tobytes(), icc_profile=icc)
+        flat = self.tdpath / "flat.png"
+        Image.new("RGB", (64, 64), (10, 20, 30)).save(flat)
+        size = photo.stat().st_size
+        # without cache: lossy output would be recompressed on each run
+        res = CliRunner().invoke(self.cli, ["static-image-quality", self.td.name, "--parallel", "1"])
+        self.assertEqual(2, res.exit_code)
+        self.assertIn("--cache-dir", res.output)
+        self.assertEqual(size, photo.stat().st_size)
+        cachedir = self.tdpath / "cache"
+        # recorded by static-image-optimize
+        cache = hugomgmt.staticsite.ImageOptCache(cachedir)
+        digest = hugomgmt.staticsite._digest(photo.read_bytes())
+        cache.put(digest, {"opt1"}, digest)
+        cache.save()
+        res = CliRunner().invoke(self.cli, [
+            "static-image-quality", self.td.name, "--target", "0.95", "--parallel", "1",
+            "--cache-dir", str(cachedir), "--report"])
+        if res.exception:
+            raise res.exception
+        self.assertIn("2 files", res.output)
+        self.assertIn("2 recompressed", res.output)
+        self.assertIn("photo.jpg: %d -> " % size, res.output)
+        self.assertGreater(size, photo.stat().st_size)
+        with Image.open(photo) as img:
+            self.assertEqual(6, img.getexif()[0x0112])
+            self.assertEqual(icc, img.info.get("icc_profile"))
+        optimized = photo.read_bytes()
+        applied, _ = hugomgmt.staticsite.ImageOptCache(cachedir).get(digest)
+        self.assertEqual({"opt1", "quality:0.95"}, applied)
+        # already optimized: skipped by cache
+        res = CliRunner().invoke(self.cli, [
+            "static-image-quality", self.td.name, "--target", "0.95", "--parallel", "1",
+            "--cache-dir", str(cachedir)])
+        if res.exception:
+            raise res.exception
+        self.assertIn("0 files", res.output)
+        self.assertEqual(optimized, photo.read_bytes())
+
     def test_rssatom_invalid_xml(self):
         inputxml = 'xyzxyz'
         res = CliRunner().invoke(self.cli, ["static-rss-atom", "--format", "atom"], input=inputxml)
@@ -180,3 +843,37 @@ class TestStatic(unittest.TestCase):
         self.assertEqual(0, res.exit_code)
         self.assertIn("<feed ", res.output)
         self.assertIn("<title>", res.output)
+
+    def rss(self, n: int) -> str:
+        items = "".join(f"""<item><title>entry {i}</title>
+<pubDate>Thu, {6 - i:02d} Jun 2024 22:25:10 +0900</pubDate></item>""" for i in range(n))
+        return f"""<?xml version='1.0' encoding='UTF-8'?>
+<rss version="2.0"><channel><title>this is title</title>{items}</channel></rss>"""
+
+    def test_rssatom_limit(self):
+        res = CliRunner().invoke(self.cli, ["static-rss-atom", "--limit", "2"], input=self.rss(5))
+        if res.exception:
+            raise res.exception
+        self.assertEqual(2, res.output.count("<entry>"))
+        self.assertIn("entry 1", res.output)
+        self.assertNotIn("entry 2", res.output)
+        res = CliRunner().invoke(self.cli, ["static-rss-atom", "--since", "2024-06-04"], input=self.rss(5))
+        if res.exception:
+            raise res.exception
+        self.assertEqual(3, res.output.count("<entry>"))
+        self.assertIn("entry 2", res.output)
+        self.assertNotIn("entry 3", res.output)
+
+    def test_rssatom_all(self):
+        (self.tdpath / "post").mkdir()
+        (self.tdpath / "index.xml").write_text(self.rss(3))
+        (self.tdpath / "post" / "index.xml").write_text(self.rss(1))
+        (self.tdpath / "broken").mkdir()
+        (self.tdpath / "broken" / "index.xml").write_text("<hello/>")
+        res = CliRunner().invoke(self.cli, ["static-rss-atom-all", self.td.name, "--parallel", "2", "--pretty"])
+        if res.exception:
+            raise res.exception
+        self.assertIn("2/3 feeds converted", res.output)
+        self.assertEqual(3, (self.tdpath / "atom.xml").read_text().count("<entry>"))
+        self.assertIn("\n  <title>this is title</title>", (self.tdpath / "post" / "atom.xml").read_text())
+        self.assertFalse((self.tdpath / "broken" / "atom.xml").exists())
@@ -0,0 +1,51 @@
+import unittest
+import tempfile
+import fnmatch
+from pathlib import Path
+from hugomgmt.util import find_files, scan_files
+
+
+class TestUtil(unittest.TestCase):
+    def setUp(self):
+        self.td = tempfile.TemporaryDirectory()
+        self.tdpath = Path(self.td.name)
+        for name in ["a.html", "a.html.gz", "b.css", "b.css.br", "c.png", "sub/d.html", "sub/d.html.gz",
+                     "sub/sub2/e.js", ".git/f.html", "sub/.git/g.html"]:
+            p = self.tdpath / name
+            p.parent.mkdir(parents=True, exist_ok=True)
+            p.write_text(name)
+
+    def tearDown(self):
+        self.td.cleanup()
+
+    def walk(self, ignore_dirs, ignore_files, pattern):
+        # reference implementation
+        for root, dirs, files in self.tdpath.walk():
+            for i in ignore_dirs:
+                if i in dirs:
+                    dirs.remove(i)
+            for i in files:
+                if any(fnmatch.fnmatch(i, p) for p in ignore_files):
+                    continue
+                if any(fnmatch.fnmatch(i, p) for p in pattern):
+                    yield root / i
+
+    def test_find_files(self):
+        args = ([".git"], ["*.gz", "*.br"], ["*.html", "*.css", "*.js"])
+        self.assertEqual(sorted(self.walk(*args)), sorted(find_files([self.tdpath], *args)))
+        self.assertEqual(4, len(list(find_files([self.tdpath], *args))))
+
+    def test_scan_files_orphan(self):
+        res = list(scan_files([self.tdpath], [".git"], ["*.gz", "*.br"], ["*.html", "*.css", "*.js"],
+                              ["*.gz", "*.br"]))
+        files = sorted(str(p.relative_to(self.tdpath)) for p, _, orphan in res if not orphan)
+        orphans = sorted(str(p.relative_to(self.tdpath)) for p, _, orphan in res if orphan)
+        self.assertEqual(["a.html", "b.css", "sub/d.html", "sub/sub2/e.js"], files)
+        self.assertEqual(["a.html.gz", "b.css.br", "sub/d.html.gz"], orphans)
+        for p, st, _ in res:
+            self.assertEqual(p.stat().st_size, st.st_size)
+
+    def test_scan_files_on_dir(self):
+        dirs = []
+        list(scan_files([self.tdpath], [".git"], [], ["*.html"], on_dir=dirs.append))
+        self.assertEqual([self.tdpath, self.tdpath / "sub", self.tdpath / "sub" / "sub2"], dirs)
@@ -350,6 +350,44 @@ world,abcdef
             self.assertEqual(0, res.exit_code)
             self.assertIn(r"[![](./a-small.png)](./a-large.png)", res.output)
 
+    def test_select_iter(self):
+        from hugomgmt.wordpress import WP
+        wp = WP(self.conn, "http://example.com/wordpress/")
+        expected = wp.select("wp_posts", post_status="publish")
+        with patch.object(sqlite2mysql_cur, "execute", autospec=True, side_effect=sqlite2mysql_cur.execute) as ex:
+            res = list(wp.select_iter("wp_posts", batch=2, post_status="publish"))
+        self.assertEqual(expected, res)
+        self.assertEqual([1, 3, 4, 5], [x["ID"] for x in res])
+        # 2 full pages + last empty page
+        self.assertEqual(3, ex.call_count)
+        self.assertEqual([1, 4, 5], [x["ID"] for x in wp.posts()])
+
+    def test_convcomment_all(self):
+        cur = self.conn.cursor()
+        cur.execute("UPDATE wp_comments SET comment_date = %s, comment_parent = 0, comment_content = %s",
+                    (datetime.datetime(2000, 1, 3), "comment1"))
+        for post_id, content in [(1, "comment2"), (4, "comment3"), (99, "orphan")]:
+            cur.execute("INSERT INTO wp_comments (comment_post_ID, comment_approved, comment_date, comment_parent,"
+                        " comment_content) VALUES (%s, %s, %s, %s, %s)",
+                        (post_id, "1", datetime.datetime(2000, 1, 4), 0, content))
+        with tempfile.NamedTemporaryFile() as tf:
+            Path(tf.name).unlink()
+            res = CliRunner().invoke(self.cli, ["isso-initdb", "--sqlite", tf.name])
+            if res.exception:
+                raise res.exception
+            with patch("hugomgmt.wordpress.WP.get_post", side_effect=AssertionError("per-comment query")):
+                res = CliRunner().invoke(self.cli, [
+                    "wp-convcomment-all", "--sqlite", tf.name, "--url-prefix", "/hugo/"])
+            if res.exception:
+                raise res.exception
+            conn = sqlite3.connect(tf.name)
+            threads = conn.execute("SELECT id, uri, title FROM threads ORDER BY id").fetchall()
+            self.assertEqual([(1, "/hugo/archives/1/", "hello world"), (4, "/hugo/archives/4/", "hello shortcode")],
+                             threads)
+            comments = conn.execute("SELECT tid, text FROM comments ORDER BY id").fetchall()
+            self.assertEqual([(1, "comment1"), (1, "comment2"), (4, "comment3")], comments)
+            conn.close()
+
     def test_convpost_all(self):
         with tempfile.TemporaryDirectory() as td:
             tdpath = Path(td)
@@ -366,3 +404,227 @@ world,abcdef
             self.assertTrue((tdpath / "archives" / "1" / "post.md").exists())
             self.assertFalse((tdpath / "archives" / "3").exists())
             self.assertTrue((tdpath / "archives" / "5" / "a-large.png").exists())
+
+    def test_convpost_all_jobs(self):
+        cur = self.conn.cursor()
+        cur.execute("INSERT INTO wp_posts (post_type, post_date, post_title, post_content, post_status, post_name)"
+                    " VALUES (%s, %s, %s, %s, %s, %s)", ("post", "broken", "broken", "", "publish", "broken"))
+        outputs = []
+        for jobs in ("1", "2"):
+            with tempfile.TemporaryDirectory() as td:
+                tdpath = Path(td)
+                (tdpath / "a-large.png").write_bytes(b"HELLO A.PNG")
+                (tdpath / "a-small.png").write_bytes(b"hello a.png")
+                res = CliRunner().invoke(self.cli, [
+                    "wp-convpost-all", "--copy-resource", "--jobs", jobs,
+                    "--uploads-dir", td, "--baseurl", "http://localhost:8080/wordpress/", td])
+                self.assertEqual(1, res.exit_code)
+                self.assertIn("post 6: ", res.output)
+                self.assertIn("1 posts/pages failed", res.output)
+                outputs.append({str(x.relative_to(tdpath)): x.read_bytes()
+                                for x in sorted(tdpath.glob("**/*")) if x.is_file()})
+        self.assertEqual(outputs[0], outputs[1])
+        self.assertIn("archives/5/a-large.png", outputs[1])
+        self.assertIn("pages/page-test.markdown", outputs[1])
+
+    def test_download_replace_fetch(self):
+        import threading
+        import time
+        import http.server
+        from hugomgmt.wordpress import WP, AssetFetcher
+        state = {"active": 0, "max": 0, "flaky": 0, "requests": 0}
+        lock = threading.Lock()
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                with lock:
+                    state["requests"] += 1
+                    state["active"] += 1
+                    state["max"] = max(state["max"], state["active"])
+                time.sleep(0.05)
+                try:
+                    name = self.path.rsplit("/", 1)[-1]
+                    if name == "flaky.png" and state["flaky"] == 0:
+                        state["flaky"] += 1
+                        self.send_error(503)
+                    elif name == "missing.png":
+                        self.send_error(404)
+                    else:
+                        body = name.encode() * 2000
+                        self.send_response(200)
+                        self.send_header("Content-Length", str(len(body)))
+                        self.end_headers()
+                        self.wfile.write(body)
+                finally:
+                    with lock:
+                        state["active"] -= 1
+
+            def log_message(self, *args):
+                pass
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        th = threading.Thread(target=server.serve_forever, daemon=True)
+        th.start()
+        try:
+            base = f"http://127.0.0.1:{server.server_port}/wp-content/uploads/"
+            names = ["a.png", "b.png", "c.png", "d.png", "flaky.png", "missing.png"]
+            html = "<div>" + "".join(f'<img src="{base}{x}">' for x in names) + f'<a href="{base}a.png">a</a></div>'
+            fetcher = AssetFetcher(parallel=8, per_host=2, timeout=5, backoff=0.01, bandwidth=100000)
+            wp = WP(self.conn, "http://example.com/wordpress/", fetcher=fetcher)
+            start = time.monotonic()
+            res, assets = wp.download_replace(html, base)
+            elapsed = time.monotonic() - start
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertEqual({"a.png", "b.png", "c.png", "d.png", "flaky.png"}, {x[2:] for x in assets})
+        self.assertEqual(b"c.png" * 2000, assets["./c.png"])
+        self.assertIn('<img src="./missing.png"/>', res)
+        self.assertIn('<a href="./a.png">', res)
+        # a.png is fetched once, flaky.png is retried
+        self.assertEqual(7, state["requests"])
+        self.assertLessEqual(state["max"], 2)
+        # 50k bytes at 100k bytes/sec
+        self.assertGreaterEqual(elapsed, 0.4)
+
+    def test_download_replace_cache(self):
+        import threading
+        import http.server
+        from hugomgmt.wordpress import WP, AssetFetcher, write_post
+        log = []
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                name = self.path.rsplit("/", 1)[-1]
+                etag = '"' + name + '"'
+                log.append((name, self.headers.get("If-None-Match")))
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                body = name.encode() * 1000
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("ETag", etag)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        th = threading.Thread(target=server.serve_forever, daemon=True)
+        th.start()
+        try:
+            with tempfile.TemporaryDirectory() as td:
+                base = f"http://127.0.0.1:{server.server_port}/wp-content/uploads/"
+                html = f'<div><img src="{base}a.png"><img src="{base}b.png"></div>'
+                results = []
+                for revalidate in (False, False, True):
+                    wp = WP(self.conn, "http://example.com/wordpress/",
+                            fetcher=AssetFetcher(cache_dir=td, revalidate=revalidate))
+                    results.append(wp.download_replace(html, base)[1])
+                for assets in results:
+                    self.assertEqual({"./a.png", "./b.png"}, set(assets.keys()))
+                    self.assertTrue(assets["./a.png"].is_relative_to(td))
+                    self.assertEqual(b"a.png" * 1000, assets["./a.png"].read_bytes())
+                self.assertEqual(results[0], results[1])
+                self.assertEqual(results[0], results[2])
+                # 2nd run: no request, 3rd run: conditional requests
+                self.assertEqual([("a.png", None), ("b.png", None), ("a.png", '"a.png"'), ("b.png", '"b.png"')],
+                                 sorted(log[:2]) + sorted(log[2:]))
+                # copy to output
+                outdir = Path(td) / "out"
+                write_post(outdir, "archives/1/post.md", "text", results[0])
+                self.assertEqual(b"b.png" * 1000, (outdir / "archives" / "1" / "b.png").read_bytes())
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_download_replace_interrupted(self):
+        import threading
+        import http.server
+        from hugomgmt.wordpress import WP, AssetFetcher
+        state = {"requests": 0}
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                state["requests"] += 1
+                body = b"a.png" * 1000
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                if state["requests"] == 1:
+                    # connection closed in the middle of body
+                    self.wfile.write(body[:len(body) // 2])
+                    self.close_connection = True
+                    return
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        th = threading.Thread(target=server.serve_forever, daemon=True)
+        th.start()
+        try:
+            with tempfile.TemporaryDirectory() as td:
+                base = f"http://127.0.0.1:{server.server_port}/wp-content/uploads/"
+                wp = WP(self.conn, "http://example.com/wordpress/",
+                        fetcher=AssetFetcher(cache_dir=td, timeout=5, backoff=0.01))
+                _, assets = wp.download_replace(f'<div><img src="{base}a.png"></div>', base)
+                self.assertEqual(b"a.png" * 1000, assets["./a.png"].read_bytes())
+                self.assertEqual([], list(Path(td).glob("objects/*.tmp")))
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertEqual(2, state["requests"])
+
+    def test_convpost_all_jobs_fetch(self):
+        import threading
+        import time
+        import http.server
+        state = {"active": 0, "max": 0}
+        lock = threading.Lock()
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                with lock:
+                    state["active"] += 1
+                    state["max"] = max(state["max"], state["active"])
+                try:
+                    time.sleep(0.02)
+                    body = b"x" * 10000
+                    self.send_response(200)
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                finally:
+                    with lock:
+                        state["active"] -= 1
+
+            def log_message(self, *args):
+                pass
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        th = threading.Thread(target=server.serve_forever, daemon=True)
+        th.start()
+        try:
+            baseurl = f"http://127.0.0.1:{server.server_port}/wordpress/"
+            cur = self.conn.cursor()
+            for i in range(4):
+                content = "".join(f'<img src="{baseurl}wp-content/uploads/{i}-{j}.png">' for j in range(2))
+                cur.execute("INSERT INTO wp_posts (post_type, post_date, post_title, post_content, post_status,"
+                            " post_name) VALUES (%s, %s, %s, %s, %s, %s)",
+                            ("post", datetime.datetime(2005, 1, 1), "img", content, "publish", "img"))
+            with tempfile.TemporaryDirectory() as td:
+                start = time.monotonic()
+                res = CliRunner().invoke(self.cli, [
+                    "wp-convpost-all", "--copy-resource", "--jobs", "2", "--baseurl", baseurl,
+                    "--fetch-per-host", "1", "--fetch-bandwidth", "100000", td])
+                elapsed = time.monotonic() - start
+                if res.exception:
+                    raise res.exception
+                self.assertEqual(b"x" * 10000, (Path(td) / "archives" / "9" / "3-1.png").read_bytes())
+        finally:
+            server.shutdown()
+            server.server_close()
+        # limits are shared by all workers: 1 connection, 80000 bytes at 100000 bytes/sec
+        self.assertEqual(1, state["max"])
+        self.assertGreaterEqual(elapsed, 0.7)